@@ -0,0 +1,382 @@
+# encoding: utf-8
+'''
+drive_benchmark -- time GoogleDrive operations and the scripts against a fake Drive
+
+Runs benchmarks/fake_drive.py in its own interpreter (so serving requests doesn't
+compete with the client for the GIL), points GoogleDrive and the scripts at it and
+times:
+
+    list      list_files_in_drive of --files files spread --depth folders deep
+    filter    filter_filepath_in_drive of the files in one of those folders
+    folders   create_folder_path of --paths folder paths --depth folders deep
+    upload    upload_file_to_path of a --size MiB file
+    download  download_file of that file, whole and as --ranges byte ranges, and
+              download_to of it into /dev/null
+    prune     trash_many of --files files
+    backup    drive_backup.py of a --backupsize MiB directory, pruning --keep older backups
+    helper    gdrive_helper.py listing --files files and restoring a --size MiB
+              file with --stdout
+
+Every benchmark reports the best wall time of --repeat runs, with the API calls,
+http requests, connections and bytes the fake saw during that run.
+
+    python benchmarks/drive_benchmark.py [list upload ...] [--latency 20] [--failrate 0.01]
+                                         [--save results.json] [--baseline results.json]
+
+--save writes the results to a json file, --baseline compares them with such a file
+and fails if a benchmark got more than --tolerance percent slower or made more API
+calls than it did.
+
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import sys
+import os
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+import urllib.request
+from argparse import ArgumentParser
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGEDIR = os.path.join(TOPDIR, 'google_drive_utilities')
+SCRIPTSDIR = os.path.join(TOPDIR, 'scripts')
+BENCHDIR = os.path.join(TOPDIR, 'benchmarks')
+sys.path.insert(0, PACKAGEDIR)
+sys.path.insert(0, BENCHDIR)
+
+from fake_drive import configure_client
+
+SCOPES = ['https://www.googleapis.com/auth/drive']
+BENCHMARKS = ['list', 'filter', 'folders', 'upload', 'download', 'prune', 'backup', 'helper']
+
+class FakeDriveProcess(object):
+    '''
+    fake_drive.py running in a child process, set up and inspected through its
+    /_fake/ control calls
+    '''
+    def __init__(self, latency=0.0, failrate=0.0, quota=None, bandwidth=None, seed=None):
+        self.args = ['--latency', str(latency), '--failrate', str(failrate)]
+        if quota is not None:
+            self.args = self.args + ['--quota', str(quota)]
+        if bandwidth is not None:
+            self.args = self.args + ['--bandwidth', str(bandwidth)]
+        if seed is not None:
+            self.args = self.args + ['--seed', str(seed)]
+        self.process = None
+        self.url = None
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, os.path.join(BENCHDIR, 'fake_drive.py')] + self.args,
+                                        stdout=subprocess.PIPE, text=True)
+        self.url = self.process.stdout.readline().strip()
+        if not self.url:
+            raise RuntimeError("the fake Drive server didn't start")
+        return self
+
+    def stop(self):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+    def control(self, command, settings=None):
+        """returns:
+            the json answer of the control call
+        """
+        data = None
+        if command != 'stats':
+            data = json.dumps(settings or {}).encode('utf-8')
+        request = urllib.request.Request(self.url + '_fake/' + command, data=data,
+                                         headers={'Content-Type': 'application/json'})
+        with urllib.request.urlopen(request) as response:
+            return json.loads(response.read())
+
+    def seed(self, folders=(), files=()):
+        """create folders and files in the fake without going through the API
+        returns:
+            dict of path -> id
+        """
+        return self.control('seed', {'folders': list(folders), 'files': list(files)})
+
+class Bench(object):
+    '''
+    What the benchmarks share: the fake, a scratch directory and the client
+    configuration pointing at the fake
+    '''
+    def __init__(self, fake, workdir, options):
+        self.fake = fake
+        self.workdir = workdir
+        self.options = options
+        self.privatedir = os.path.join(workdir, 'private')
+        self.settingsfile, self.tokenfile = configure_client(self.privatedir, fake.url)
+        self.keyfile = os.path.join(self.privatedir, 'credentials.json')
+        self.bigfile = None
+
+    def drive(self):
+        """returns:
+            a new GoogleDrive talking to the fake, with nothing cached but the root
+        """
+        from google_drive import GoogleDrive
+        return GoogleDrive(keyfile=self.keyfile, tokenfile=self.tokenfile, scopes=SCOPES, resumeuploads=False,
+                           backoff=self.options.backoff, maxbackoff=self.options.backoff * 16)
+
+    def big_file(self):
+        """returns:
+            path of a local file of --size MiB of random bytes
+        """
+        if self.bigfile is None:
+            self.bigfile = os.path.join(self.workdir, 'big.dat')
+            with open(self.bigfile, 'wb') as f:
+                for indx in range(self.options.size):
+                    f.write(os.urandom(1024*1024))
+        return self.bigfile
+
+    def list_files(self):
+        """returns:
+            seed specs of --files files spread over 8 folder trees --depth folders deep
+        """
+        files = []
+        for indx in range(self.options.files):
+            folders = '/'.join(['b%d' % (indx % 8)] + ['d%d' % level for level in range(1, self.options.depth)])
+            files.append({'path': '/Bench/list/%s/file%06d.dat' % (folders, indx), 'size': 0})
+        return files
+
+    def run_script(self, name, args, stdout=subprocess.DEVNULL, text=True):
+        """run one of the scripts with the fake's settings file
+        returns:
+            the completed process
+        """
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([PACKAGEDIR] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+        result = subprocess.run([sys.executable, os.path.join(SCRIPTSDIR, name + '.py'), self.settingsfile] + args,
+                                cwd=self.workdir, env=env, stdout=stdout, stderr=subprocess.PIPE)
+        if text and result.stdout is not None:
+            result.stdout = result.stdout.decode('utf-8', 'replace')
+        if result.returncode != 0:
+            raise RuntimeError("%s %s failed (%d): %s" % (name, ' '.join(args), result.returncode,
+                                                          result.stderr.decode('utf-8', 'replace').strip()[-1000:]))
+        return result
+
+def bench_list(bench):
+    bench.fake.seed(files=bench.list_files())
+    def run():
+        paths, ids, files = bench.drive().list_files_in_drive(query="name contains 'file'")
+        assert len(paths) == bench.options.files, "listed %d of %d files" % (len(paths), bench.options.files)
+    return {'list': run}
+
+def bench_filter(bench):
+    bench.fake.seed(files=bench.list_files())
+    folder = '/'.join(['/Bench/list/b0'] + ['d%d' % level for level in range(1, bench.options.depth)])
+    expected = len([indx for indx in range(bench.options.files) if indx % 8 == 0])
+    def run():
+        paths, ids, files = bench.drive().filter_filepath_in_drive(pathquery=folder + '/file.*')
+        assert len(paths) == expected, "filtered %d of %d files" % (len(paths), expected)
+    return {'filter': run}
+
+def bench_folders(bench):
+    def setup():
+        bench.fake.control('clear')
+        bench.fake.seed(folders=['/Bench'])
+    def run():
+        gdrive = bench.drive()
+        for indx in range(bench.options.paths):
+            folders = ['p%d' % indx] + ['l%d' % level for level in range(1, bench.options.depth)]
+            gdrive.create_folder_path('/Bench/folders/' + '/'.join(folders))
+    return {'folders': (setup, run)}
+
+def bench_upload(bench):
+    filename = bench.big_file()
+    bench.fake.seed(folders=['/Bench/files'])
+    def run():
+        path, fileid, file = bench.drive().upload_file_to_path(filename, '/Bench/files', allowduplicate=True)
+        assert int(file.get('size')) == os.path.getsize(filename)
+    return {'upload': run}
+
+def bench_download(bench):
+    size = bench.options.size*1024*1024
+    ids = bench.fake.seed(files=[{'path': '/Bench/files/download.dat', 'size': size}])
+    fileid = ids['/Bench/files/download.dat']
+    downloaddir = os.path.join(bench.workdir, 'downloads')
+    def download(ranges):
+        shutil.rmtree(downloaddir, ignore_errors=True)
+        os.makedirs(downloaddir)
+        cwd = os.getcwd()
+        os.chdir(downloaddir)
+        try:
+            bench.drive().download_file(fileid, 'download.dat', ranges=ranges, rangesize=bench.options.rangesize)
+            assert os.path.getsize('download.dat') == size
+        finally:
+            os.chdir(cwd)
+            shutil.rmtree(downloaddir, ignore_errors=True)
+    def stream():
+        with open(os.devnull, 'wb') as f:
+            written, file = bench.drive().download_to(fileid, f)
+        assert written == size
+    return {'download': lambda: download(1),
+            'download.ranges': lambda: download(bench.options.ranges),
+            'download.stream': stream}
+
+def bench_prune(bench):
+    def run():
+        gdrive = bench.drive()
+        trashed, errors = gdrive.trash_many(run.ids)
+        assert len(errors) == 0, "%d files weren't trashed" % len(errors)
+    def setup():
+        bench.fake.control('clear')
+        ids = bench.fake.seed(files=[{'path': '/Bench/prune/old%06d.tgz' % indx, 'size': 0}
+                                     for indx in range(bench.options.files)])
+        run.ids = list(ids.values())
+    return {'prune': (setup, run)}
+
+def bench_backup(bench):
+    sourcedir = os.path.join(bench.workdir, 'backupsrc')
+    os.makedirs(sourcedir, exist_ok=True)
+    for indx in range(64):
+        with open(os.path.join(sourcedir, 'file%02d.dat' % indx), 'wb') as f:
+            f.write(os.urandom(bench.options.backupsize*1024*1024 // 64))
+    def setup():
+        bench.fake.control('clear')
+        bench.fake.seed(folders=['/Backup'])
+        # one real backup to prune, plus --keep older copies of it
+        bench.run_script('drive_backup', ['-b', '/Backup', '-k', str(bench.options.keep + 2), sourcedir])
+        paths, ids, files = bench.drive().list_files_in_drive(query="name contains 'tgz'")
+        name = files[0].get('name')
+        bench.fake.seed(files=[{'path': '/Backup/%s.old%03d.tgz' % (name[:-len('.tgz')], indx), 'size': 1024,
+                                'properties': {'checksum': 'old%03d' % indx}} for indx in range(bench.options.keep)])
+        # change the directory so the next run has something new to upload
+        with open(os.path.join(sourcedir, 'changed.dat'), 'wb') as f:
+            f.write(os.urandom(1024))
+    def run():
+        bench.run_script('drive_backup', ['-b', '/Backup', '-k', '1', sourcedir])
+        paths, ids, files = bench.drive().list_files_in_drive(query="name contains 'tgz'")
+        assert len(files) == 1, "%d backups left after pruning" % len(files)
+    return {'backup': (setup, run)}
+
+def bench_helper(bench):
+    size = bench.options.size*1024*1024
+    bench.fake.seed(files=bench.list_files() + [{'path': '/Bench/files/archive.tgz', 'size': size}])
+    def listing():
+        # the matches go to the log, the settings aren't verbose
+        bench.run_script('gdrive_helper', ['-q', "name contains 'file'"])
+    def restore():
+        result = bench.run_script('gdrive_helper', ['--filterfilepath', '/Bench/files/archive.tgz', '--stdout'],
+                                  stdout=subprocess.PIPE, text=False)
+        assert len(result.stdout) == size, "restored %d of %d bytes" % (len(result.stdout), size)
+    return {'helper.list': listing, 'helper.stdout': restore}
+
+def measure(bench, name, setup, run, repeat):
+    """run a benchmark repeat times
+    returns:
+        dict of the best time and the fake's stats during that run
+    """
+    best = None
+    for indx in range(max(1, repeat)):
+        if setup is not None:
+            setup()
+        bench.fake.control('reset')
+        started = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - started
+        stats = bench.fake.control('stats')
+        if best is None or elapsed < best['seconds']:
+            best = {'seconds': elapsed,
+                    'apicalls': stats['apicalls'],
+                    'requests': stats['requests'],
+                    'connections': stats['connections'],
+                    'bytesin': stats['bytesin'],
+                    'bytesout': stats['bytesout'],
+                    'errors': stats['errors'] + stats['throttled'],
+                    'calls': stats['calls']}
+    return best
+
+def compare(results, baseline, tolerance):
+    """returns:
+        list of regressions of results against baseline
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get('results', {}).get(name)
+        if before is None:
+            continue
+        if result['seconds'] > before['seconds'] * (1 + tolerance / 100.0):
+            regressions.append("%s took %.3fs, was %.3fs" % (name, result['seconds'], before['seconds']))
+        if result['errors'] == 0 and before.get('errors', 0) == 0 and result['apicalls'] > before['apicalls']:
+            regressions.append("%s made %d API calls, was %d" % (name, result['apicalls'], before['apicalls']))
+    return regressions
+
+def main(argv=None):
+    parser = ArgumentParser(description="Benchmark GoogleDrive operations and the scripts against a fake Drive")
+    parser.add_argument("benchmarks", nargs="*", help="benchmarks to run, from %s [default: all]" % ', '.join(BENCHMARKS))
+    parser.add_argument("--files", type=int, default=2000, help="files to list and prune [default: %(default)s]")
+    parser.add_argument("--depth", type=int, default=4, help="folders deep the files and folder paths are [default: %(default)s]")
+    parser.add_argument("--paths", type=int, default=10, help="folder paths to create [default: %(default)s]")
+    parser.add_argument("--size", type=int, default=64, help="MiB to upload and download [default: %(default)s]")
+    parser.add_argument("--ranges", type=int, default=4, help="byte ranges downloaded at the same time [default: %(default)s]")
+    parser.add_argument("--rangesize", type=int, default=8, help="MiB in each byte range [default: %(default)s]")
+    parser.add_argument("--backupsize", type=int, default=16, help="MiB in the directory drive_backup backs up [default: %(default)s]")
+    parser.add_argument("--keep", type=int, default=20, help="older backups drive_backup has to prune [default: %(default)s]")
+    parser.add_argument("--latency", type=float, default=20.0, help="milliseconds the fake adds to every request [default: %(default)s]")
+    parser.add_argument("--failrate", type=float, default=0.0, help="fraction of API calls the fake fails [default: %(default)s]")
+    parser.add_argument("--quota", type=float, default=None, help="API calls per second the fake allows [default: no quota]")
+    parser.add_argument("--bandwidth", type=float, default=None, help="MiB per second of each transfer [default: no limit]")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the errors the fake injects [default: %(default)s]")
+    parser.add_argument("--backoff", type=float, default=0.05, help="retry backoff of the client in seconds [default: %(default)s]")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per benchmark, the best is reported [default: %(default)s]")
+    parser.add_argument("--save", default=None, help="write the results to this json file")
+    parser.add_argument("--baseline", default=None, help="fail on regressions against the results in this json file")
+    parser.add_argument("--tolerance", type=float, default=25.0, help="percent slower than the baseline allowed [default: %(default)s]")
+    options = parser.parse_args(argv)
+    names = options.benchmarks or BENCHMARKS
+    for name in names:
+        if name not in BENCHMARKS:
+            parser.error("unknown benchmark %s" % name)
+    fake = FakeDriveProcess(latency=options.latency, failrate=options.failrate, quota=options.quota,
+                            bandwidth=options.bandwidth, seed=options.seed).start()
+    workdir = tempfile.mkdtemp(prefix='drive_benchmark_')
+    results = {}
+    failed = False
+    try:
+        bench = Bench(fake, workdir, options)
+        for name in names:
+            fake.control('clear')
+            for label, run in globals()['bench_' + name](bench).items():
+                setup = None
+                if isinstance(run, tuple):
+                    setup, run = run
+                try:
+                    result = measure(bench, label, setup, run, options.repeat)
+                except Exception as e:
+                    # e.g. the client gave up retrying against a tight quota
+                    sys.stdout.write("%-16s FAIL: %s\n" % (label, str(e) or type(e).__name__))
+                    failed = True
+                    continue
+                results[label] = result
+                sys.stdout.write("%-16s %9.3f s %7d calls %7d requests %5d connections %9.1f MiB up %9.1f MiB down %5d errors\n"
+                                 % (label, result['seconds'], result['apicalls'], result['requests'], result['connections'],
+                                    result['bytesin'] / (1024.0*1024.0), result['bytesout'] / (1024.0*1024.0), result['errors']))
+                sys.stdout.flush()
+    finally:
+        fake.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+    settings = dict((k, v) for k, v in vars(options).items() if k not in ('benchmarks', 'save', 'baseline', 'tolerance'))
+    if options.save is not None:
+        with open(options.save, 'w') as f:
+            json.dump({'settings': settings, 'results': results}, f, indent=1)
+    if options.baseline is not None:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != settings:
+            sys.stdout.write("warning: the baseline was run with different settings\n")
+        regressions = compare(results, baseline, options.tolerance)
+        for regression in regressions:
+            sys.stdout.write("FAIL: %s\n" % regression)
+        if regressions:
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
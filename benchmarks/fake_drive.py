@@ -0,0 +1,891 @@
+# encoding: utf-8
+'''
+fake_drive -- a local stand-in for the Drive v3 REST API
+
+Keeps files in memory and answers the calls GoogleDrive, AsyncGoogleDrive and the
+scripts make: files.list (with q, fields, orderBy and paging), files.get,
+files.create, files.update, files.delete, multipart and resumable uploads, media
+downloads with byte ranges and batch requests. Latency, bandwidth, random errors
+and a per user request quota can be injected to see how a client copes with a
+slow or unreliable Drive.
+
+Clients are pointed at it by a token file and a cached discovery document whose
+rootUrl is the fake server (see configure_client), so GoogleDrive and the scripts
+talk to it unchanged.
+
+    python benchmarks/fake_drive.py [--port 8765] [--latency 20] [--failrate 0.01]
+                                    [--quota 100] [--bandwidth 50] [--privatedir DIR]
+
+A few control calls live under /_fake/: GET stats, POST reset (the stats), POST
+clear (every file), POST config with a json object of settings and POST seed with
+a json object {"folders": [path, ...], "files": [{"path": ..., "size": ...}, ...]}.
+
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import sys
+import os
+import re
+import json
+import time
+import uuid
+import random
+import hashlib
+import threading
+import email.parser
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qsl
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from argparse import ArgumentParser
+
+FOLDERTYPE = 'application/vnd.google-apps.folder'
+ROOTID = '0AFakeDriveRootFolderUk9PVA'
+# resumable uploads only take whole multiples of this, except for the last chunk
+UPLOADALIGNMENT = 256*1024
+# Drive refuses batches of more requests than this
+MAXBATCH = 100
+MAXPAGESIZE = 1000
+
+# the errors injected at random, (status, reason)
+ERRORS = ((500, 'internalError'), (503, 'backendError'), (403, 'userRateLimitExceeded'), (429, 'rateLimitExceeded'))
+
+STATUSTEXT = {200: 'OK', 204: 'No Content', 206: 'Partial Content', 308: 'Resume Incomplete', 400: 'Bad Request',
+              403: 'Forbidden', 404: 'Not Found', 416: 'Requested Range Not Satisfiable', 429: 'Too Many Requests',
+              500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+def now():
+    """returns:
+        the current time the way Drive writes it, e.g. 2026-10-17T12:00:00.000Z
+    """
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3] + 'Z'
+
+def normalize_time(value):
+    """returns:
+        RFC 3339 time value with microseconds and without a zone, so times compare as strings
+    """
+    value = value.rstrip('Z')
+    if '.' in value:
+        value, fraction = value.split('.', 1)
+    else:
+        fraction = ''
+    return "%s.%s" % (value, (fraction + '000000')[:6])
+
+def split_fields(fields):
+    """returns:
+        list of (field, subfields or None) of a fields parameter like nextPageToken,files(id,name)
+    """
+    result = []
+    depth = 0
+    start = 0
+    for indx, c in enumerate(fields + ','):
+        if c == '(':
+            depth = depth + 1
+        elif c == ')':
+            depth = depth - 1
+        elif c == ',' and depth == 0:
+            part = fields[start:indx].strip()
+            start = indx + 1
+            if '(' in part:
+                name, sub = part.split('(', 1)
+                result.append((name.strip(), sub[:-1]))
+            elif '/' in part:
+                name, sub = part.split('/', 1)
+                result.append((name.strip(), sub))
+            elif part:
+                result.append((part, None))
+    return result
+
+def select(resource, fields):
+    """returns:
+        the parts of resource (a dict or a list of them) named in fields
+    """
+    if isinstance(resource, list):
+        return [select(item, fields) for item in resource]
+    if fields is None or fields.strip() == '*':
+        return resource
+    selected = {}
+    for name, sub in split_fields(fields):
+        if name in resource:
+            selected[name] = resource[name] if sub is None else select(resource[name], sub)
+    return selected
+
+class QueryError(Exception):
+    pass
+
+class Query(object):
+    '''
+    A files.list q parameter parsed into a predicate over file resources. Handles
+    and, or, not, parentheses, 'id' in parents, comparisons of name, mimeType,
+    modifiedTime, createdTime and trashed, and name (or fullText) contains.
+    '''
+    tokenpattern = re.compile(r"\s*(?:'((?:[^'\\]|\\.)*)'|(!=|<=|>=|=|<|>|\(|\))|([A-Za-z_][\w.]*))")
+    timefields = ('modifiedTime', 'createdTime', 'viewedByMeTime')
+
+    def __init__(self, q):
+        self.tokens = self.tokenize(q or '')
+        self.pos = 0
+        if not self.tokens:
+            self.predicate = lambda file: True
+            return
+        self.predicate = self.parse_or()
+        if self.pos != len(self.tokens):
+            raise QueryError("Invalid Value at '%s'" % self.tokens[self.pos][1])
+
+    def tokenize(self, q):
+        tokens = []
+        pos = 0
+        q = q.rstrip()
+        while pos < len(q):
+            m = self.tokenpattern.match(q, pos)
+            if m is None or m.end() == pos:
+                raise QueryError("Invalid Value at '%s'" % q[pos:])
+            if m.group(1) is not None:
+                tokens.append(('string', re.sub(r"\\(.)", r"\1", m.group(1))))
+            elif m.group(2) is not None:
+                tokens.append(('op', m.group(2)))
+            else:
+                tokens.append(('word', m.group(3)))
+            pos = m.end()
+        return tokens
+
+    def peek(self, kind=None, value=None):
+        if self.pos >= len(self.tokens):
+            return None
+        token = self.tokens[self.pos]
+        if (kind is not None and token[0] != kind) or (value is not None and token[1] != value):
+            return None
+        return token
+
+    def take(self, kind=None, value=None):
+        token = self.peek(kind, value)
+        if token is None:
+            raise QueryError("Invalid Value, expected %s" % (value or kind))
+        self.pos = self.pos + 1
+        return token
+
+    def parse_or(self):
+        terms = [self.parse_and()]
+        while self.peek('word', 'or'):
+            self.take()
+            terms.append(self.parse_and())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda file: any(term(file) for term in terms)
+
+    def parse_and(self):
+        terms = [self.parse_not()]
+        while self.peek('word', 'and'):
+            self.take()
+            terms.append(self.parse_not())
+        if len(terms) == 1:
+            return terms[0]
+        return lambda file: all(term(file) for term in terms)
+
+    def parse_not(self):
+        if self.peek('word', 'not'):
+            self.take()
+            term = self.parse_not()
+            return lambda file: not term(file)
+        return self.parse_term()
+
+    def parse_term(self):
+        if self.peek('op', '('):
+            self.take()
+            term = self.parse_or()
+            self.take('op', ')')
+            return term
+        if self.peek('string'):
+            value = self.take()[1]
+            self.take('word', 'in')
+            collection = self.take('word')[1]
+            if collection != 'parents':
+                # owners, writers and readers, everything belongs to the one fake user
+                return lambda file: True
+            if value == 'root':
+                value = ROOTID
+            return lambda file: value in file.get('parents', [])
+        field = self.take('word')[1]
+        if self.peek('op') and not self.peek('op', ')'):
+            op = self.take()[1]
+        elif self.peek('word', 'contains'):
+            op = self.take()[1]
+        else:
+            # a bare boolean field, e.g. not trashed
+            return lambda file: bool(file.get(field))
+        token = self.take()
+        if token[0] == 'word' and token[1] in ('true', 'false'):
+            value = token[1] == 'true'
+        elif token[0] == 'string':
+            value = token[1]
+        else:
+            raise QueryError("Invalid Value '%s' for %s" % (token[1], field))
+        return self.comparison(field, op, value)
+
+    def comparison(self, field, op, value):
+        if op == 'contains':
+            if field == 'fullText':
+                field = 'name'
+            return lambda file: value in str(file.get(field, ''))
+        if field in self.timefields:
+            value = normalize_time(value)
+            get = lambda file: normalize_time(file.get(field, ''))
+        elif isinstance(value, bool):
+            get = lambda file: bool(file.get(field))
+        else:
+            get = lambda file: file.get(field)
+        ops = {'=': lambda a, b: a == b, '!=': lambda a, b: a != b,
+               '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+               '>': lambda a, b: a > b, '>=': lambda a, b: a >= b}
+        compare = ops[op]
+        def term(file):
+            actual = get(file)
+            if actual is None:
+                return op == '!='
+            return compare(actual, value)
+        return term
+
+    def __call__(self, file):
+        return self.predicate(file)
+
+class FakeDrive(object):
+    '''
+    The state of the fake Drive and the routing of its API calls. Every call made
+    directly or inside a batch goes through call(), top level http requests through
+    request().
+    latency: seconds added to every http request
+    failrate: fraction of API calls that fail with a random one of ERRORS, upload
+    chunks that are hit may instead only be partly stored
+    lostrate: fraction of API calls that are carried out but answered with a 503,
+    like a response lost on the way back
+    quota: API calls per second allowed (in bursts of up to one second's worth),
+    calls over it fail with 403 userRateLimitExceeded. None for no quota
+    bandwidth: bytes per second each upload chunk or download is held to, None for no limit
+    '''
+    def __init__(self, latency=0.0, failrate=0.0, quota=None, bandwidth=None, seed=None, verbose=False, lostrate=0.0):
+        self.latency = latency
+        self.failrate = failrate
+        self.lostrate = lostrate
+        self.quota = quota
+        self.bandwidth = bandwidth
+        self.verbose = verbose
+        self.random = random.Random(seed)
+        self.baseurl = None
+        self.lock = threading.RLock()
+        self.clear()
+        self.reset()
+
+    def clear(self):
+        with self.lock:
+            self.files = {ROOTID: {'kind': 'drive#file', 'id': ROOTID, 'name': 'My Drive', 'mimeType': FOLDERTYPE,
+                                   'parents': [], 'trashed': False, 'createdTime': now(), 'modifiedTime': now()}}
+            self.content = {}
+            self.children = {ROOTID: set()}
+            self.sessions = {}
+
+    def reset(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'calls': {}, 'errors': 0, 'throttled': 0, 'partial': 0,
+                          'bytesin': 0, 'bytesout': 0, 'connections': 0}
+            self.tokens = self.quota or 0
+            self.refilled = time.monotonic()
+
+    def configure(self, settings):
+        with self.lock:
+            for name in ('latency', 'failrate', 'lostrate', 'quota', 'bandwidth', 'verbose'):
+                if name in settings:
+                    setattr(self, name, settings[name])
+            if 'seed' in settings:
+                self.random.seed(settings['seed'])
+            self.tokens = self.quota or 0
+
+    def connected(self):
+        with self.lock:
+            self.stats['connections'] = self.stats['connections'] + 1
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['calls'] = dict(self.stats['calls'])
+            stats['apicalls'] = sum(stats['calls'].values()) - stats['calls'].get('batch', 0)
+            stats['files'] = len(self.files) - 1
+            return stats
+
+    # responses
+
+    def json_response(self, status, resource, headers=None):
+        headers = dict(headers or {})
+        headers['Content-Type'] = 'application/json; charset=UTF-8'
+        return status, headers, json.dumps(resource).encode('utf-8')
+
+    def error(self, status, reason, message, domain='global'):
+        return self.json_response(status, {'error': {'errors': [{'domain': domain, 'reason': reason, 'message': message}],
+                                                     'code': status, 'message': message}})
+
+    def not_found(self, fileid):
+        return self.error(404, 'notFound', "File not found: %s." % fileid)
+
+    # injected trouble
+
+    def over_quota(self):
+        if self.quota is None:
+            return False
+        t = time.monotonic()
+        self.tokens = min(self.quota, self.tokens + (t - self.refilled) * self.quota)
+        self.refilled = t
+        if self.tokens < 1:
+            return True
+        self.tokens = self.tokens - 1
+        return False
+
+    def inject(self):
+        """returns:
+            an error response if this call is throttled or picked to fail, else None
+        """
+        with self.lock:
+            if self.over_quota():
+                self.stats['throttled'] = self.stats['throttled'] + 1
+                return self.error(403, 'userRateLimitExceeded', "User Rate Limit Exceeded", domain='usageLimits')
+            if self.failrate and self.random.random() < self.failrate:
+                self.stats['errors'] = self.stats['errors'] + 1
+                status, reason = self.random.choice(ERRORS)
+                return self.error(status, reason, "injected %s" % reason)
+        return None
+
+    def transfer(self, nbytes):
+        """hold a media transfer of nbytes to the bandwidth"""
+        if self.bandwidth and nbytes:
+            time.sleep(nbytes / float(self.bandwidth))
+
+    # files
+
+    def resolve(self, fileid):
+        if fileid == 'root':
+            return ROOTID
+        return fileid
+
+    def add(self, metadata, content=None):
+        """store a new file (or folder without content) described by metadata
+        returns:
+            the file resource
+        """
+        fileid = uuid.uuid4().hex[:28]
+        created = now()
+        file = {'kind': 'drive#file',
+                'id': fileid,
+                'name': metadata.get('name', 'Untitled'),
+                'mimeType': metadata.get('mimeType', 'application/octet-stream'),
+                'parents': [self.resolve(parent) for parent in (metadata.get('parents') or [ROOTID])],
+                'trashed': False,
+                'createdTime': metadata.get('createdTime', created),
+                'modifiedTime': metadata.get('modifiedTime', created)}
+        for name in ('description', 'properties', 'appProperties'):
+            if metadata.get(name) is not None:
+                file[name] = dict(metadata[name]) if isinstance(metadata[name], dict) else metadata[name]
+        if file['mimeType'] != FOLDERTYPE:
+            content = content or b''
+            self.content[fileid] = content
+            file['size'] = str(len(content))
+            file['md5Checksum'] = hashlib.md5(content).hexdigest()
+        else:
+            self.children[fileid] = set()
+        self.files[fileid] = file
+        for parent in file['parents']:
+            self.children.setdefault(parent, set()).add(fileid)
+        return file
+
+    def missing_parent(self, metadata):
+        for parent in metadata.get('parents') or []:
+            if self.resolve(parent) not in self.files:
+                return parent
+        return None
+
+    def remove(self, fileid):
+        file = self.files.pop(fileid)
+        self.content.pop(fileid, None)
+        for parent in file.get('parents', []):
+            self.children.get(parent, set()).discard(fileid)
+        for child in list(self.children.pop(fileid, ())):
+            if child in self.files:
+                self.remove(child)
+
+    def candidates(self, query):
+        """returns:
+            the files a query can match, only the children of the folder when the query
+            is a plain 'id' in parents and ...
+        """
+        m = re.match(r"\s*'([^']*)'\s+in\s+parents(\s+and\s|\s*$)", query or '')
+        if m is not None:
+            return [self.files[fileid] for fileid in self.children.get(self.resolve(m.group(1)), ())]
+        return [file for file in self.files.values() if file['id'] != ROOTID]
+
+    def list(self, params):
+        try:
+            query = Query(params.get('q'))
+        except QueryError as e:
+            return self.error(400, 'invalid', str(e))
+        files = [file for file in self.candidates(params.get('q')) if query(file)]
+        orderby = params.get('orderBy')
+        if orderby:
+            for key in reversed([k.strip() for k in orderby.split(',') if k.strip()]):
+                field, _, direction = key.partition(' ')
+                if field == 'folder':
+                    files.sort(key=lambda file: file.get('mimeType') != FOLDERTYPE, reverse=direction == 'desc')
+                else:
+                    files.sort(key=lambda file: str(file.get(field, '')), reverse=direction == 'desc')
+        else:
+            files.sort(key=lambda file: file['createdTime'])
+        start = int(params.get('pageToken') or 0)
+        pagesize = min(MAXPAGESIZE, int(params.get('pageSize') or 100))
+        response = {'kind': 'drive#fileList', 'incompleteSearch': False, 'files': files[start:start + pagesize]}
+        if start + pagesize < len(files):
+            response['nextPageToken'] = str(start + pagesize)
+        fields = params.get('fields', 'kind,nextPageToken,incompleteSearch,files(%s)' % ','.join(('kind', 'id', 'name', 'mimeType')))
+        return self.json_response(200, select(response, fields))
+
+    def get(self, fileid, params, headers):
+        fileid = self.resolve(fileid)
+        file = self.files.get(fileid)
+        if file is None:
+            return self.not_found(fileid)
+        if params.get('alt') != 'media':
+            return self.json_response(200, select(file, params.get('fields', 'kind,id,name,mimeType')))
+        if file['mimeType'] == FOLDERTYPE:
+            return self.error(403, 'fileNotDownloadable', "Only files with binary content can be downloaded.")
+        content = self.content[fileid]
+        m = re.match(r'bytes=(\d*)-(\d*)$', headers.get('range', ''))
+        if m is None:
+            return 200, {'Content-Type': file['mimeType']}, content
+        if m.group(1) == '':
+            # a suffix range, the last n bytes
+            start = max(0, len(content) - int(m.group(2)))
+            end = len(content) - 1
+        else:
+            start = int(m.group(1))
+            end = min(len(content) - 1, int(m.group(2))) if m.group(2) else len(content) - 1
+        if start >= len(content) or start > end:
+            return 416, {'Content-Range': 'bytes */%d' % len(content)}, b''
+        return 206, {'Content-Type': file['mimeType'],
+                     'Content-Range': 'bytes %d-%d/%d' % (start, end, len(content))}, content[start:end + 1]
+
+    def create(self, params, body):
+        metadata = json.loads(body or b'{}')
+        parent = self.missing_parent(metadata)
+        if parent is not None:
+            return self.not_found(parent)
+        file = self.add(metadata)
+        return self.json_response(200, select(file, params.get('fields', 'kind,id,name,mimeType')))
+
+    def update(self, fileid, params, body):
+        fileid = self.resolve(fileid)
+        file = self.files.get(fileid)
+        if file is None:
+            return self.not_found(fileid)
+        metadata = json.loads(body or b'{}')
+        for name in ('name', 'mimeType', 'description', 'trashed', 'modifiedTime', 'starred'):
+            if name in metadata:
+                file[name] = metadata[name]
+        for name in ('properties', 'appProperties'):
+            if name in metadata:
+                # a null value deletes the property
+                merged = dict(file.get(name) or {})
+                merged.update(metadata[name] or {})
+                file[name] = dict((k, v) for k, v in merged.items() if v is not None)
+        removeparents = [self.resolve(p) for p in params.get('removeParents', '').split(',') if p]
+        addparents = [self.resolve(p) for p in params.get('addParents', '').split(',') if p]
+        for parent in addparents:
+            if parent not in self.files:
+                return self.not_found(parent)
+        for parent in removeparents:
+            if parent in file['parents']:
+                file['parents'].remove(parent)
+                self.children.get(parent, set()).discard(fileid)
+        for parent in addparents:
+            if parent not in file['parents']:
+                file['parents'].append(parent)
+                self.children.setdefault(parent, set()).add(fileid)
+        return self.json_response(200, select(file, params.get('fields', 'kind,id,name,mimeType')))
+
+    def delete(self, fileid):
+        fileid = self.resolve(fileid)
+        if fileid not in self.files or fileid == ROOTID:
+            return self.not_found(fileid)
+        self.remove(fileid)
+        return 204, {}, b''
+
+    # uploads
+
+    def parse_multipart(self, contenttype, body):
+        """returns:
+            list of the payloads (bytes) of a multipart body
+        """
+        message = email.parser.BytesParser().parsebytes(b'Content-Type: ' + contenttype.encode('latin-1') + b'\r\n\r\n' + body)
+        if not message.is_multipart():
+            raise ValueError("not a multipart body")
+        return [part.get_payload(decode=True) for part in message.get_payload()]
+
+    def upload(self, params, headers, body):
+        uploadtype = params.get('uploadType', 'media')
+        fields = params.get('fields', 'kind,id,name,mimeType')
+        if uploadtype == 'resumable':
+            metadata = json.loads(body or b'{}')
+            parent = self.missing_parent(metadata)
+            if parent is not None:
+                return self.not_found(parent)
+            sessionid = uuid.uuid4().hex
+            total = headers.get('x-upload-content-length')
+            self.sessions[sessionid] = {'metadata': metadata, 'fields': fields, 'data': bytearray(),
+                                        'total': int(total) if total else None}
+            location = "%supload/drive/v3/files?uploadType=resumable&upload_id=%s" % (self.baseurl, sessionid)
+            return self.json_response(200, {}, headers={'Location': location})
+        if uploadtype == 'multipart':
+            try:
+                parts = self.parse_multipart(headers.get('content-type', ''), body)
+                metadata = json.loads(parts[0] or b'{}')
+                content = parts[1] if len(parts) > 1 else b''
+            except (ValueError, IndexError) as e:
+                return self.error(400, 'badContent', "unable to parse the multipart body: %s" % str(e))
+        else:
+            metadata = {}
+            content = body
+        parent = self.missing_parent(metadata)
+        if parent is not None:
+            return self.not_found(parent)
+        file = self.add(metadata, content)
+        return self.json_response(200, select(file, fields))
+
+    def upload_chunk(self, sessionid, headers, body, partial):
+        """store a chunk of a resumable upload, partial ones keep only part of it"""
+        session = self.sessions.get(sessionid)
+        if session is None:
+            return self.error(404, 'notFound', "upload session %s not found" % sessionid)
+        data = session['data']
+        contentrange = headers.get('content-range')
+        if contentrange is None:
+            start, total = 0, len(body)
+        else:
+            m = re.match(r'bytes (\*|(\d+)-(\d+))/(\*|\d+)$', contentrange.strip())
+            if m is None:
+                return self.error(400, 'badContent', "invalid Content-Range %s" % contentrange)
+            start = int(m.group(2)) if m.group(2) is not None else None
+            total = int(m.group(4)) if m.group(4) != '*' else None
+        if total is not None:
+            session['total'] = total
+        if start is not None and start <= len(data) <= start + len(body):
+            keep = body[len(data) - start:]
+            if partial and len(keep) > UPLOADALIGNMENT:
+                self.stats['partial'] = self.stats['partial'] + 1
+                keep = keep[:len(keep) // 2 - (len(keep) // 2) % UPLOADALIGNMENT]
+            data.extend(keep)
+        if session['total'] is not None and len(data) >= session['total']:
+            del self.sessions[sessionid]
+            file = self.add(session['metadata'], bytes(data[:session['total']]))
+            return self.json_response(200, select(file, session['fields']))
+        headers = {}
+        if data:
+            headers['Range'] = 'bytes=0-%d' % (len(data) - 1)
+        return 308, headers, b''
+
+    # batches
+
+    def batch(self, headers, body):
+        contenttype = headers.get('content-type', '')
+        m = re.search(r'boundary="?([^";]+)"?', contenttype)
+        if m is None:
+            return self.error(400, 'badContent', "batch request without a boundary")
+        message = email.parser.BytesParser().parsebytes(b'Content-Type: ' + contenttype.encode('latin-1') + b'\r\n\r\n' + body)
+        parts = message.get_payload() if message.is_multipart() else []
+        if len(parts) > MAXBATCH:
+            return self.error(400, 'limitExceeded', "A maximum of %d requests can be batched" % MAXBATCH)
+        boundary = "batch_%s" % uuid.uuid4().hex
+        out = []
+        for part in parts:
+            request = part.get_payload(decode=True)
+            head, _, partbody = request.replace(b'\r\n', b'\n').partition(b'\n\n')
+            lines = head.decode('latin-1').split('\n')
+            method, target = lines[0].split(' ')[:2]
+            partheaders = dict((k.strip().lower(), v.strip()) for k, _, v in (line.partition(':') for line in lines[1:] if line))
+            status, respheaders, content = self.call(method, target, partheaders, partbody)
+            # unfold the header, the client folds long Content-IDs
+            contentid = re.sub(r'\r?\n', '', part.get('Content-ID') or '').strip().strip('<>')
+            respheaders = dict(respheaders)
+            respheaders['Content-Length'] = str(len(content))
+            out.append(("--%s\r\nContent-Type: application/http\r\nContent-ID: <response-%s>\r\n\r\n"
+                        "HTTP/1.1 %d %s\r\n%s\r\n" % (boundary, contentid,
+                                                     status, STATUSTEXT.get(status, ''),
+                                                     ''.join("%s: %s\r\n" % item for item in respheaders.items()))).encode('latin-1')
+                       + content + b'\r\n')
+        out.append(("--%s--\r\n" % boundary).encode('latin-1'))
+        return 200, {'Content-Type': 'multipart/mixed; boundary=%s' % boundary}, b''.join(out)
+
+    # routing
+
+    def operation(self, method, path, params):
+        """returns:
+            the name the stats count a call under
+        """
+        if path.startswith('/batch'):
+            return 'batch'
+        if path.startswith('/upload/'):
+            return 'upload' if 'upload_id' in params else 'upload.start'
+        if path.rstrip('/') == '/drive/v3/files':
+            return 'list' if method == 'GET' else 'create'
+        if path.startswith('/drive/v3/files/'):
+            if method == 'GET':
+                return 'download' if params.get('alt') == 'media' else 'get'
+            return {'PATCH': 'update', 'PUT': 'update', 'DELETE': 'delete'}.get(method, method.lower())
+        return 'other'
+
+    def call(self, method, target, headers, body):
+        """answer one API call, directly or from inside a batch
+        returns:
+            (status, response headers, response body)
+        """
+        url = urlsplit(target)
+        params = dict(parse_qsl(url.query, keep_blank_values=True))
+        path = url.path
+        operation = self.operation(method, path, params)
+        with self.lock:
+            self.stats['calls'][operation] = self.stats['calls'].get(operation, 0) + 1
+        if operation == 'batch':
+            return self.batch(headers, body)
+        partial = False
+        error = self.inject()
+        if error is not None:
+            if operation != 'upload' or self.random.random() < 0.5:
+                return error
+            # a flaky link, the server only got part of the chunk
+            partial = True
+        self.transfer(len(body) if operation == 'upload' else 0)
+        with self.lock:
+            m = re.match(r'/drive/v3/files/([^/]+)$', path)
+            if operation == 'list':
+                response = self.list(params)
+            elif operation == 'create':
+                response = self.create(params, body)
+            elif operation in ('get', 'download') and m is not None:
+                response = self.get(m.group(1), params, headers)
+            elif operation == 'update' and m is not None:
+                response = self.update(m.group(1), params, body)
+            elif operation == 'delete' and m is not None:
+                response = self.delete(m.group(1))
+            elif operation == 'upload.start' and method == 'POST':
+                response = self.upload(params, headers, body)
+            elif operation == 'upload' and method in ('PUT', 'POST'):
+                response = self.upload_chunk(params['upload_id'], headers, body, partial)
+            else:
+                response = self.error(404, 'notFound', "no route for %s %s" % (method, path))
+        if operation == 'download':
+            self.transfer(len(response[2]))
+        with self.lock:
+            if self.lostrate and self.random.random() < self.lostrate:
+                self.stats['errors'] = self.stats['errors'] + 1
+                return self.error(503, 'backendError', "injected lost response")
+        return response
+
+    def control(self, method, path, body):
+        """answer the /_fake/ calls the benchmarks use to set up and inspect the fake"""
+        command = path[len('/_fake/'):].strip('/')
+        if command == 'stats':
+            return self.json_response(200, self.snapshot())
+        if method != 'POST':
+            return self.error(404, 'notFound', "no control %s %s" % (method, command))
+        settings = json.loads(body or b'{}')
+        if command == 'reset':
+            self.reset()
+        elif command == 'clear':
+            self.clear()
+        elif command == 'config':
+            self.configure(settings)
+        elif command == 'seed':
+            return self.json_response(200, self.seed(settings.get('folders', []), settings.get('files', [])))
+        else:
+            return self.error(404, 'notFound', "no control %s" % command)
+        return self.json_response(200, self.snapshot())
+
+    def folder(self, path):
+        """returns:
+            id of the folder at path, creating the missing folders
+        """
+        parent = ROOTID
+        for name in [name for name in path.split('/') if name]:
+            match = None
+            for child in self.children.get(parent, ()):
+                file = self.files[child]
+                if file['name'] == name and file['mimeType'] == FOLDERTYPE and not file['trashed']:
+                    match = child
+                    break
+            if match is None:
+                match = self.add({'name': name, 'mimeType': FOLDERTYPE, 'parents': [parent]})['id']
+            parent = match
+        return parent
+
+    def seed(self, folders, files):
+        """create folders and files straight into the fake, without API calls
+        returns:
+            dict of path -> id of everything created
+        """
+        ids = {}
+        with self.lock:
+            for path in folders:
+                ids[path] = self.folder(path)
+            for spec in files:
+                parentpath, name = spec['path'].rsplit('/', 1)
+                metadata = dict((k, v) for k, v in spec.items() if k not in ('path', 'size', 'content'))
+                metadata['name'] = name
+                metadata['parents'] = [self.folder(parentpath)]
+                content = spec.get('content')
+                content = content.encode('utf-8') if content is not None else bytes(int(spec.get('size', 0)))
+                ids[spec['path']] = self.add(metadata, content)['id']
+        return ids
+
+    def request(self, method, target, headers, body):
+        """answer a top level http request"""
+        path = urlsplit(target).path
+        if path.startswith('/_fake/'):
+            return self.control(method, path, body)
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.stats['requests'] = self.stats['requests'] + 1
+            self.stats['bytesin'] = self.stats['bytesin'] + len(body)
+        response = self.call(method, target, headers, body)
+        with self.lock:
+            self.stats['bytesout'] = self.stats['bytesout'] + len(response[2])
+        return response
+
+class FakeDriveHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body go out in separate writes, don't let them wait for delayed acks
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.drive.connected()
+
+    def log_message(self, format, *args):
+        if self.server.drive.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        headers = dict((k.lower(), v) for k, v in self.headers.items())
+        status, respheaders, content = self.server.drive.request(self.command, self.path, headers, body)
+        self.send_response(status, STATUSTEXT.get(status))
+        for name, value in respheaders.items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(content)
+
+    do_GET = do_HEAD = do_POST = do_PUT = do_PATCH = do_DELETE = respond
+
+class FakeDriveServer(ThreadingHTTPServer):
+    '''
+    Serves a FakeDrive on host:port (port 0 picks a free one) from a background thread
+    '''
+    daemon_threads = True
+
+    def __init__(self, drive=None, host='127.0.0.1', port=0):
+        ThreadingHTTPServer.__init__(self, (host, port), FakeDriveHandler)
+        self.drive = drive if drive is not None else FakeDrive()
+        self.url = "http://%s:%d/" % (self.server_address[0], self.server_address[1])
+        self.drive.baseurl = self.url
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.serve_forever, name='fake-drive', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+def configure_client(privatedir, url, settings=None):
+    """write the files GoogleDrive and the scripts need to talk to the fake at url
+    into privatedir: a token that never expires, the discovery document cached
+    next to it with the fake as rootUrl, a dummy key file and email secrets and a
+    settings.json for the scripts, updated with settings
+    returns:
+        (path of the settings file, path of the token file)
+    """
+    packagedir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'google_drive_utilities')
+    if packagedir not in sys.path:
+        sys.path.insert(0, packagedir)
+    from googleapiclient.discovery_cache import get_static_doc
+    from google_drive import client_version
+    os.makedirs(privatedir, exist_ok=True)
+    scopes = ['https://www.googleapis.com/auth/drive']
+    tokenfile = os.path.join(privatedir, 'token.json')
+    with open(tokenfile, 'w') as f:
+        json.dump({'token': 'fake-drive-token', 'refresh_token': 'fake-drive-refresh', 'client_id': 'fake-drive',
+                   'client_secret': 'fake-drive', 'token_uri': url + 'token', 'scopes': scopes,
+                   'expiry': '2099-01-01T00:00:00Z'}, f)
+    document = json.loads(get_static_doc('drive', 'v3'))
+    document['rootUrl'] = url
+    document['mtlsRootUrl'] = url
+    document['baseUrl'] = url + document['servicePath']
+    with open(tokenfile + '.discovery.json', 'w') as f:
+        json.dump({'clientversion': client_version(), 'fetched': time.time() + 365*24*60*60, 'document': document}, f)
+    with open(os.path.join(privatedir, 'credentials.json'), 'w') as f:
+        json.dump({'installed': {'client_id': 'fake-drive', 'client_secret': 'fake-drive'}}, f)
+    with open(os.path.join(privatedir, 'secrets.json'), 'w') as f:
+        json.dump({'EMAIL_HOST': 'localhost', 'EMAIL_USER': '', 'EMAIL_PORT': 25, 'EMAIL_USE_TLS': 'False',
+                   'EMAIL_PASS': '', 'EMAIL_FROM_USER': ''}, f)
+    scriptsettings = {'privatedir': privatedir,
+                      'google_keyfile': 'credentials.json',
+                      'google_tokenfile': 'token.json',
+                      'scopes': scopes,
+                      'verbose': False,
+                      'logfile': os.path.join(privatedir, 'scripts.log'),
+                      'email': '',
+                      'testlog': False,
+                      'database_secretfile': 'secrets.json'}
+    scriptsettings.update(settings or {})
+    settingsfile = os.path.join(privatedir, 'settings.json')
+    with open(settingsfile, 'w') as f:
+        json.dump(scriptsettings, f, indent=1)
+    return settingsfile, tokenfile
+
+def main(argv=None):
+    parser = ArgumentParser(description="Serve a fake Drive v3 API from memory")
+    parser.add_argument("--host", default='127.0.0.1', help="address to listen on [default: %(default)s]")
+    parser.add_argument("--port", type=int, default=0, help="port to listen on, 0 picks a free one [default: %(default)s]")
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds added to every request [default: %(default)s]")
+    parser.add_argument("--failrate", type=float, default=0.0, help="fraction of API calls that fail [default: %(default)s]")
+    parser.add_argument("--lostrate", type=float, default=0.0, help="fraction of API calls carried out whose response is lost [default: %(default)s]")
+    parser.add_argument("--quota", type=float, default=None, help="API calls per second before calls fail with userRateLimitExceeded [default: no quota]")
+    parser.add_argument("--bandwidth", type=float, default=None, help="MiB per second for each upload chunk or download [default: no limit]")
+    parser.add_argument("--seed", type=int, default=None, help="seed of the injected errors")
+    parser.add_argument("--privatedir", default=None, help="write a token, discovery cache and settings.json for the scripts into this directory")
+    parser.add_argument("--verbose", action='store_true', default=False, help="log every request to stderr [default: %(default)s]")
+    args = parser.parse_args(argv)
+    bandwidth = args.bandwidth * 1024 * 1024 if args.bandwidth else None
+    drive = FakeDrive(latency=args.latency / 1000.0, failrate=args.failrate, lostrate=args.lostrate, quota=args.quota, bandwidth=bandwidth,
+                      seed=args.seed, verbose=args.verbose)
+    server = FakeDriveServer(drive, host=args.host, port=args.port)
+    if args.privatedir is not None:
+        settingsfile, tokenfile = configure_client(args.privatedir, server.url)
+        sys.stderr.write("scripts settings in %s\n" % settingsfile)
+    # the first line of output is the url, for whoever started us
+    sys.stdout.write("%s\n" % server.url)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
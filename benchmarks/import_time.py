@@ -0,0 +1,124 @@
+# encoding: utf-8
+'''
+import_time -- measure how long the package modules and CLI scripts take to import
+
+Runs each target in a fresh interpreter with python -X importtime and reports the
+cumulative import time of the target and the slowest modules it pulls in. It fails
+if a target imports one of the heavy google client modules (they should only be
+loaded on the code path that talks to Drive) or goes over --budget milliseconds.
+
+    python benchmarks/import_time.py [--budget 50] [--repeat 5] [--top 10]
+
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import sys
+import os
+import subprocess
+from argparse import ArgumentParser
+
+TOPDIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGEDIR = os.path.join(TOPDIR, 'google_drive_utilities')
+SCRIPTSDIR = os.path.join(TOPDIR, 'scripts')
+
+# modules that must not be imported just by loading a target
+HEAVY = ('googleapiclient', 'google.auth', 'google.oauth2', 'google_auth_httplib2', 'httplib2')
+
+MODULES = ['google_drive', 'async_google_drive', 'http_pool', 'rate_limit', 'backup_archive', 'dir_hash', 'hash_cache']
+SCRIPTS = ['drive_backup', 'gdrive_helper']
+
+# load a script as a module without running main(), then list the heavy modules it loaded
+LOADER = '''
+import sys
+import importlib.util
+spec = importlib.util.spec_from_file_location(%r, %r)
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+sys.stdout.write(' '.join(sorted(m for m in sys.modules if m.startswith(%r))))
+'''
+
+def target_code(name):
+    """returns:
+        python source that imports the target name and prints the heavy modules it loaded
+    """
+    if name in SCRIPTS:
+        return LOADER % (name, os.path.join(SCRIPTSDIR, name + '.py'), HEAVY)
+    return ("import sys\nimport %s\nsys.stdout.write(' '.join(sorted(m for m in sys.modules if m.startswith(%r))))\n"
+            % (name, HEAVY))
+
+def parse_importtime(output):
+    """returns:
+        list of (cumulative microseconds, self microseconds, module) from -X importtime output
+    """
+    times = []
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            # the header line
+            continue
+        # one space after the separator, then two more per level of nesting
+        times.append((int(fields[1]), int(fields[0]), fields[2][1:].rstrip()))
+    return times
+
+def startup_modules(env):
+    """returns:
+        set of modules the interpreter imports before running any code
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'pass'],
+                            env=env, capture_output=True, text=True, check=False)
+    return set(module.strip() for cumulative, selftime, module in parse_importtime(result.stderr))
+
+def measure(name):
+    """import the target in a fresh interpreter
+    returns:
+        (cumulative milliseconds of the target, list of import times, heavy modules loaded)
+    """
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([PACKAGEDIR] + ([env['PYTHONPATH']] if env.get('PYTHONPATH') else []))
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', target_code(name)],
+                            env=env, capture_output=True, text=True, check=False)
+    if result.returncode != 0:
+        raise RuntimeError("unable to import %s: %s" % (name, result.stderr.strip().splitlines()[-1]))
+    startup = startup_modules(env)
+    times = [t for t in parse_importtime(result.stderr) if t[2].strip() not in startup]
+    toplevel = [t for t in times if not t[2].startswith(' ')]
+    if name in SCRIPTS:
+        # scripts are exec'd rather than imported, so add up their top level imports
+        total = sum(t[0] for t in toplevel)
+    else:
+        total = sum(t[0] for t in toplevel if t[2] == name)
+    heavy = result.stdout.split()
+    return total / 1000.0, times, heavy
+
+def main(argv=None):
+    parser = ArgumentParser(description="Measure package and script import times")
+    parser.add_argument("targets", nargs="*", help="modules or scripts to measure [default: all]")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per target, the best is reported [default: %(default)s]")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list per target [default: %(default)s]")
+    parser.add_argument("--budget", type=float, default=None, help="fail if a target takes longer than this many milliseconds")
+    args = parser.parse_args(argv)
+    targets = args.targets or MODULES + SCRIPTS
+    failed = False
+    for name in targets:
+        best = None
+        for indx in range(max(1, args.repeat)):
+            total, times, heavy = measure(name)
+            if best is None or total < best[0]:
+                best = (total, times, heavy)
+        total, times, heavy = best
+        sys.stdout.write("%-16s %8.1f ms\n" % (name, total))
+        for cumulative, selftime, module in sorted(times, reverse=True)[:args.top]:
+            sys.stdout.write("    %8.1f ms %8.1f ms  %s\n" % (cumulative / 1000.0, selftime / 1000.0, module))
+        if heavy:
+            sys.stdout.write("    FAIL: imports %s\n" % ', '.join(heavy))
+            failed = True
+        if args.budget is not None and total > args.budget:
+            sys.stdout.write("    FAIL: over budget of %.1f ms\n" % args.budget)
+            failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
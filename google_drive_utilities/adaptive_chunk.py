@@ -0,0 +1,80 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+# resumable uploads only accept chunks that are a multiple of 256 KiB (except the last)
+ALIGNMENT = 256*1024
+
+def align(nbytes):
+    """round nbytes down to a multiple of ALIGNMENT, but never below one ALIGNMENT"""
+    return max(ALIGNMENT, int(nbytes) - int(nbytes) % ALIGNMENT)
+
+class AdaptiveChunker(object):
+    '''
+    Picks the size of the next chunk of a transfer so that each chunk takes about
+    target seconds. It keeps a moving average of the throughput measured from the
+    time each chunk took (transfer plus round trip latency) and sizes the next chunk
+    from it, growing at most twofold per chunk. Every error halves the chunk size
+    so less has to be sent again on a flaky link. Sizes stay 256 KiB aligned and
+    between minimum and maximum bytes.
+    '''
+    def __init__(self, initial=16*1024*1024, minimum=ALIGNMENT, maximum=256*1024*1024, target=4.0, smoothing=0.5):
+        '''
+        Constructor
+        '''
+        self.minimum = align(minimum)
+        self.maximum = max(self.minimum, align(maximum))
+        self.target = target
+        self.smoothing = smoothing
+        self.size = self.clamp(initial)
+        # bytes per second, None until the first chunk is measured
+        self.throughput = None
+        self.chunks = 0
+        self.errors = 0
+
+    def clamp(self, nbytes):
+        return min(self.maximum, max(self.minimum, align(nbytes)))
+
+    def record(self, nbytes, seconds):
+        """account for a chunk of nbytes that took seconds and size the next one
+        returns:
+            the size of the next chunk
+        """
+        if nbytes <= 0 or seconds <= 0:
+            return self.size
+        self.chunks = self.chunks + 1
+        rate = nbytes / seconds
+        if self.throughput is None:
+            self.throughput = rate
+        else:
+            self.throughput = self.smoothing * rate + (1 - self.smoothing) * self.throughput
+        self.size = self.clamp(min(self.throughput * self.target, 2 * self.size))
+        return self.size
+
+    def failed(self):
+        """a chunk failed, fall back to a smaller one
+        returns:
+            the size of the next chunk
+        """
+        self.errors = self.errors + 1
+        self.size = self.clamp(self.size // 2)
+        return self.size
+
+    def __str__(self):
+        throughput = 0.0
+        if self.throughput is not None:
+            throughput = self.throughput / (1024.0*1024.0)
+        return "chunk size %.2f MiB after %d chunks (%.1f MiB/s) and %d errors" % (self.size / (1024.0*1024.0), self.chunks,
+                                                                                 throughput, self.errors)
+
+def transfer_chunker(chunk, chunkseconds=4.0, maxchunk=256):
+    """chunk sizer for one transfer that starts with chunk MiB chunks and aims for
+    chunkseconds per chunk, up to maxchunk MiB
+    returns:
+        AdaptiveChunker, one that keeps chunk fixed if chunkseconds is None
+    """
+    initial = chunk*1024*1024
+    if chunkseconds is None:
+        return AdaptiveChunker(initial, minimum=initial, maximum=initial)
+    return AdaptiveChunker(initial, maximum=max(initial, maxchunk*1024*1024), target=chunkseconds)
@@ -0,0 +1,702 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import sys
+import os
+import json
+import time
+import random
+import asyncio
+import email.utils
+from datetime import timezone
+from lazy_import import lazy_import
+from google_drive import GoogleDrive, GoogleDriveException, PathCache
+from adaptive_chunk import transfer_chunker
+# aiohttp is only needed by the asyncio client, so it is an optional dependency
+aiohttp = lazy_import('aiohttp')
+oauth2credentials = lazy_import('google.oauth2.credentials')
+authrequests = lazy_import('google.auth.transport.requests')
+
+FOLDERTYPE = 'application/vnd.google-apps.folder'
+
+class AsyncHttpError(GoogleDriveException):
+    '''Drive answered an AsyncGoogleDrive request with an error status.'''
+    def __init__(self, status, content, headers, uri=''):
+        self.status = status
+        self.content = content
+        # lower case header names like the httplib2 responses GoogleDrive sees
+        self.resp = headers
+        self.uri = uri
+        self.reason = "HTTP %d" % status
+        try:
+            self.reason = json.loads(content.decode('utf-8'))['error']['message']
+        except (ValueError, KeyError, TypeError, UnicodeError):
+            pass
+        super(AsyncHttpError, self).__init__("%s returned %d: %s" % (uri, status, self.reason))
+
+class AsyncGoogleDrive(object):
+    '''
+    asyncio counterpart of GoogleDrive. The operations are coroutines that talk to
+    the Drive v3 REST API through one aiohttp session, so thousands of calls can be
+    in flight from a single thread. At most concurrency requests are sent at once
+    over a pool of at most poolsize connections.
+
+        async with AsyncGoogleDrive(keyfile, tokenfile, scopes) as gdrive:
+            paths, ids, files = await gdrive.list_files_in_drive(query="name contains 'tgz'")
+    '''
+    verbose = False
+    baseurl = 'https://www.googleapis.com/'
+
+    def __init__(self, keyfile=None, tokenfile=None, scopes=None, verbose=False, usefolderindex=True,
+                 pathcachesize=10000, pathcachettl=300, retries=6, backoff=1.0, maxbackoff=64.0, ratelimiter=None,
+                 concurrency=100, poolsize=100, timeout=120, credentials=None, baseurl=None, chunkseconds=4.0, maxchunk=256):
+        '''
+        Constructor
+        keyfile, tokenfile, scopes, usefolderindex, pathcachesize, pathcachettl,
+        retries, backoff, maxbackoff, ratelimiter, chunkseconds, maxchunk: as for GoogleDrive.
+        concurrency: most requests in flight at once.
+        poolsize, timeout: most open connections and the read timeout in seconds.
+        credentials: google.auth credentials to use instead of reading tokenfile.
+        baseurl: root of the API, for talking to something other than Google.
+        '''
+        self.keyfile = keyfile
+        self.tokenfile = tokenfile
+        self.scopes = scopes
+        self.verbose = verbose
+        self.usefolderindex = usefolderindex
+        self.retries = retries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        self.ratelimiter = ratelimiter
+        self.concurrency = concurrency
+        self.poolsize = poolsize
+        self.timeout = timeout
+        self.chunkseconds = chunkseconds
+        self.maxchunk = maxchunk
+        self.credentials = credentials
+        if baseurl is not None:
+            self.baseurl = baseurl
+        self.session = None
+        self.semaphore = None
+        self.refreshlock = None
+        self.rootlock = None
+        self.indexlock = None
+        self.folderlock = None
+        self.root = None
+        # folder id -> (name, first parent id)
+        self.folderindex = {}
+        self.folderindexloaded = False
+        # time.monotonic() the folder index was last loaded (or emptied), None if never
+        self.folderindextime = None
+        self.folderindexttl = pathcachettl
+        # folder id -> task fetching it, so concurrent lookups share one request
+        self.pendingfolders = {}
+        self.pathcache = PathCache(maxsize=pathcachesize, ttl=pathcachettl)
+        self.retrycounts = {'retries': 0, 'giveups': 0}
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    async def open(self):
+        """Load the credentials and open the HTTP session, must be called from the event loop"""
+        if self.session is not None:
+            return
+        if self.credentials is None:
+            if self.tokenfile is None or not os.path.exists(self.tokenfile):
+                raise GoogleDriveException("unable to find token file %s" % self.tokenfile)
+            try:
+                self.credentials = oauth2credentials.Credentials.from_authorized_user_file(self.tokenfile, self.scopes)
+            except Exception as e:
+                raise GoogleDriveException("problem getting credentials %s" % str(e))
+        try:
+            connector = aiohttp.TCPConnector(limit=self.poolsize)
+        except ImportError:
+            raise GoogleDriveException("AsyncGoogleDrive needs the aiohttp package, pip install aiohttp")
+        self.session = aiohttp.ClientSession(connector=connector,
+                                             timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=self.timeout))
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.refreshlock = asyncio.Lock()
+        self.rootlock = asyncio.Lock()
+        self.indexlock = asyncio.Lock()
+        self.folderlock = asyncio.Lock()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def authorization(self, force=False):
+        """Refresh the credentials if they have expired (in a worker thread, google.auth blocks)
+        Returns:
+            headers that authorize a request
+        """
+        async with self.refreshlock:
+            if force or not self.credentials.valid:
+                try:
+                    await asyncio.to_thread(self.credentials.refresh, authrequests.Request())
+                except Exception as e:
+                    raise GoogleDriveException("Unable to refresh token '%s'\n run get_auth_token.pl script to generate one" % str(e))
+        headers = {}
+        self.credentials.apply(headers)
+        return headers
+
+    def retry_reason(self, e, idempotent=True):
+        """Classifies an exception raised by a request
+        idempotent: False if carrying the request out twice does harm, see GoogleDrive.retry_reason
+        Returns:
+            a short reason string if the request should be retried else None
+        """
+        if isinstance(e, AsyncHttpError):
+            if e.status == 429 or (idempotent and e.status in (500, 502, 503, 504)):
+                return str(e.status)
+            if e.status == 403:
+                for reason in (GoogleDrive.ratelimitreasons if idempotent else GoogleDrive.rejectedreasons):
+                    if reason.encode() in e.content:
+                        return reason
+            return None
+        if isinstance(e, (ConnectionRefusedError, aiohttp.ClientConnectorError)):
+            # never got to Drive
+            return type(e).__name__
+        if idempotent and isinstance(e, (asyncio.TimeoutError, ConnectionError, aiohttp.ClientConnectionError, aiohttp.ClientPayloadError)):
+            return type(e).__name__
+        return None
+
+    def retry_delay(self, attempt, e=None):
+        """Seconds to wait before retry number attempt (starting at 0)"""
+        delay = random.uniform(0, min(self.maxbackoff, self.backoff * (2 ** attempt)))
+        retryafter = getattr(e, 'resp', {}).get('retry-after')
+        if retryafter is not None:
+            try:
+                delay = max(delay, float(retryafter))
+            except ValueError:
+                # a date that doesn't parse (some proxies send garbage) leaves the backoff delay
+                try:
+                    when = email.utils.parsedate_to_datetime(retryafter)
+                except (TypeError, ValueError):
+                    when = None
+                if when is not None:
+                    if when.tzinfo is None:
+                        # timestamp() takes a naive datetime to be local time, HTTP dates are UTC
+                        when = when.replace(tzinfo=timezone.utc)
+                    delay = max(delay, when.timestamp() - time.time())
+        return delay
+
+    async def wait_to_retry(self, e, attempt, description='', idempotent=True):
+        """Sleeps before retry number attempt (starting at 0) after the exception e,
+        or raises e again if it isn't transient or we are out of retries
+        """
+        reason = self.retry_reason(e, idempotent=idempotent)
+        if reason is None:
+            raise e
+        if attempt >= self.retries:
+            self.retrycounts['giveups'] = self.retrycounts['giveups'] + 1
+            raise e
+        delay = self.retry_delay(attempt, e)
+        self.retrycounts['retries'] = self.retrycounts['retries'] + 1
+        self.retrycounts[reason] = self.retrycounts.get(reason, 0) + 1
+        if self.verbose:
+            sys.stdout.write("%s failed (%s), retry %d of %d in %.1f seconds\n" % (description, reason, attempt + 1, self.retries, delay))
+        await asyncio.sleep(delay)
+
+    async def throttle(self, requests=1, nbytes=0):
+        """Waits until the rate limiter lets requests API calls transferring nbytes through"""
+        if self.ratelimiter is not None:
+            # the limiter blocks, keep it off the event loop
+            await asyncio.to_thread(self.ratelimiter.acquire, requests, nbytes)
+
+    async def send(self, method, url, params=None, body=None, headers=None, ok=(200,), nbytes=0):
+        """Sends one request, refreshing the credentials once if they are rejected
+        Returns:
+            status, lower case headers and body of a response whose status is in ok
+        """
+        if self.session is None:
+            raise GoogleDriveException("AsyncGoogleDrive object not opened yet")
+        await self.throttle(nbytes=nbytes)
+        force = False
+        while True:
+            allheaders = await self.authorization(force=force)
+            allheaders.update(headers or {})
+            async with self.semaphore:
+                async with self.session.request(method, url, params=params, data=body, headers=allheaders,
+                                                allow_redirects=False) as resp:
+                    content = await resp.read()
+                    status = resp.status
+                    respheaders = dict((key.lower(), value) for key, value in resp.headers.items())
+            if status == 401 and not force:
+                force = True
+                continue
+            if status not in ok:
+                raise AsyncHttpError(status, content, respheaders, uri=url)
+            return status, respheaders, content
+
+    async def request(self, method, path, params=None, body=None, headers=None, ok=(200,), nbytes=0, description='', idempotent=True):
+        """Sends a request to path (relative to baseurl) retrying it on transient errors
+        idempotent: False if carrying the request out twice does harm
+        Returns:
+            status, lower case headers and body of the response
+        """
+        url = path if path.startswith('http') else self.baseurl + path.lstrip('/')
+        attempt = 0
+        while True:
+            try:
+                return await self.send(method, url, params=params, body=body, headers=headers, ok=ok, nbytes=nbytes)
+            except Exception as e:
+                await self.wait_to_retry(e, attempt, description or "%s %s" % (method, path), idempotent=idempotent)
+                attempt = attempt + 1
+
+    async def api(self, method, path, params=None, resource=None, idempotent=True):
+        """Calls a Drive v3 method with an optional JSON body
+        Returns:
+            the decoded response, None if it had no body
+        """
+        body = None
+        headers = None
+        if resource is not None:
+            body = json.dumps(resource)
+            headers = {'Content-Type': 'application/json; charset=UTF-8'}
+        status, respheaders, content = await self.request(method, 'drive/v3/' + path, params=params, body=body,
+                                                          headers=headers, ok=(200, 204), idempotent=idempotent)
+        if len(content) == 0:
+            return None
+        return json.loads(content.decode('utf-8'))
+
+    def retry_summary(self):
+        return "retries " + ' '.join("%s=%d" % (key, value) for key, value in sorted(self.retrycounts.items()))
+
+    async def get_root(self, verbose=False):
+        if self.root is None:
+            # only the first of many concurrent callers looks it up
+            async with self.rootlock:
+                if self.root is None:
+                    try:
+                        self.root = await self.api('GET', 'files/root', params={'fields': 'id,name'})
+                    except AsyncHttpError:
+                        msg = "unable to determine root directory"
+                        if verbose:
+                            sys.stdout.write("%s\n" % msg)
+                        raise GoogleDriveException(msg)
+        return self.root
+
+    async def iter_pages(self, query, fields="files(id,name,size,modifiedTime,parents,properties)", page_size=1000, orderBy=None, verbose=False):
+        """Follows nextPageToken through every page of results for query
+        Yields:
+                list of file resources, one list per page
+        """
+        if 'nextPageToken' not in fields:
+            fields = "nextPageToken," + fields
+        params = {'q': query, 'fields': fields, 'pageSize': page_size}
+        if orderBy is not None:
+            params['orderBy'] = orderBy
+        while True:
+            try:
+                response = await self.api('GET', 'files', params=params)
+            except AsyncHttpError as e:
+                msg = "unable to list files from query '%s': %s" %(query, e.reason)
+                if verbose:
+                    sys.stdout.write("%s\n" % msg)
+                raise GoogleDriveException(msg)
+            yield response.get('files', [])
+            pagetoken = response.get('nextPageToken')
+            if pagetoken is None:
+                break
+            params['pageToken'] = pagetoken
+
+    async def iter_files(self, query=None, pathquery=None, fields="files(id,name,size,modifiedTime,parents,properties)", includetrashed=False, verbose=False, orderBy=None, page_size=1000):
+        """Queries Google Drive for all files satisfying query, resolving the paths
+        of each page concurrently
+        Yields:
+                (path, id, file resource) tuples
+        """
+        if pathquery is not None and query is not None:
+            raise GoogleDriveException("You can't specify path and pathquery at the same time")
+        if pathquery is not None:
+            filename = pathquery.split('/')[-1]
+            query = "name = '%s'" % filename
+        if query is None or len(query) == 0:
+            raise GoogleDriveException("You must specify a query or a pathquery")
+        if not includetrashed:
+            query = query + " and not trashed"
+        async for fileobjects in self.iter_pages(query, fields=fields, page_size=page_size, orderBy=orderBy, verbose=verbose):
+            paths = await asyncio.gather(*[self.get_path(file=file, verbose=verbose) for file in fileobjects])
+            for file, (pathlist, pathstring) in zip(fileobjects, paths):
+                if pathquery is None or pathquery == pathstring:
+                    yield pathstring, pathlist[-1], file
+        if verbose:
+            sys.stdout.write("%s\n" % self.pathcache)
+
+    async def list_files_in_drive(self, query=None, pathquery=None, fields="files(id,name,size,modifiedTime,parents,properties)", includetrashed=False, verbose=False, orderBy=None):
+        """Queries Google Drive for all files satisfying query
+        Returns:
+                list of paths, list of ids and list of file resources
+        """
+        files = []
+        paths = []
+        ids = []
+        async for path, fileid, file in self.iter_files(query=query, pathquery=pathquery, fields=fields,
+                                                        includetrashed=includetrashed, verbose=verbose, orderBy=orderBy):
+            ids.append(fileid)
+            paths.append(path)
+            files.append(file)
+        return paths, ids, files
+
+    async def load_folder_index(self, verbose=False):
+        """Load every folder in the drive into the folder index
+        (id -> (name, first parent id)) using paged list calls
+        Returns:
+            the folder index dictionary
+        """
+        folderindex = {}
+        # start from scratch, so only folders added while we are loading are kept
+        self.folderindex = {}
+        started = time.monotonic()
+        async for folders in self.iter_pages("mimeType='%s'" % FOLDERTYPE, fields='files(id,name,parents)', verbose=verbose):
+            for folder in folders:
+                parents = folder.get('parents')
+                folderindex[folder.get('id')] = (folder.get('name'), parents[0] if parents else None)
+        # keep anything added while we were loading
+        folderindex.update(self.folderindex)
+        self.folderindex = folderindex
+        self.folderindexloaded = True
+        self.folderindextime = started
+        if verbose:
+            sys.stdout.write("Loaded %d folders into the folder index\n" % len(self.folderindex))
+        return self.folderindex
+
+    def forget_folders(self, fileids):
+        """Drops fileids from the folder index and the path cache after they were
+        trashed or deleted, so their old paths don't resolve any more"""
+        forgotten = [fileid for fileid in fileids if self.folderindex.pop(fileid, None) is not None]
+        if len(forgotten) > 0:
+            self.pathcache.clear()
+
+    def folder_index_expired(self):
+        """True when the folder index is older than pathcachettl, see GoogleDrive.refresh_folder_index"""
+        return (self.folderindextime is None or
+                (self.folderindexttl is not None and time.monotonic() - self.folderindextime > self.folderindexttl))
+
+    async def fetch_folder(self, folderid, verbose=False):
+        try:
+            folder = await self.api('GET', 'files/%s' % folderid, params={'fields': 'name,id,parents'})
+        except AsyncHttpError as e:
+            msg = "unable to find folder from id '%s': %s" % (folderid, e.reason)
+            if verbose:
+                sys.stdout.write("%s\n" % msg)
+            raise GoogleDriveException(msg)
+        parents = folder.get('parents')
+        entry = (folder.get('name'), parents[0] if parents else None)
+        self.folderindex[folderid] = entry
+        return entry
+
+    async def get_folder(self, folderid, verbose=False):
+        """Look up a folder in the folder index, fetching it from the drive if it isn't there
+        Returns:
+            (name, first parent id) tuple
+        """
+        if self.folder_index_expired():
+            # only one task loads the listing, the others wait for it
+            async with self.indexlock:
+                if self.folder_index_expired():
+                    if self.usefolderindex:
+                        await self.load_folder_index(verbose=verbose)
+                    else:
+                        self.folderindex = {}
+                        self.folderindextime = time.monotonic()
+                    self.pathcache.clear()
+        entry = self.folderindex.get(folderid)
+        if entry is not None:
+            return entry
+        task = self.pendingfolders.get(folderid)
+        if task is None:
+            task = asyncio.ensure_future(self.fetch_folder(folderid, verbose=verbose))
+            self.pendingfolders[folderid] = task
+            task.add_done_callback(lambda done: self.pendingfolders.pop(folderid, None))
+        return await asyncio.shield(task)
+
+    async def get_path(self, file=None, fileid=None, verbose=False):
+        """ return the path to the file"""
+        if fileid is None and file is None:
+            raise GoogleDriveException("no fileid or file object passed into get_path command")
+        if file is not None and fileid is not None:
+            raise GoogleDriveException("both fileid and file object passed into get_path command. you must specify one or the other")
+        if file is None:
+            try:
+                file = await self.api('GET', 'files/%s' % fileid, params={'fields': 'name,id,parents'})
+            except AsyncHttpError:
+                msg = "unable to find file from id '%s'" % str(fileid)
+                if verbose:
+                    sys.stdout.write("%s\n" % msg)
+                raise GoogleDriveException(msg)
+        rootid = (await self.get_root()).get('id')
+        parents = file.get('parents')
+        # only return path traced through the first parent listed for each file
+        parentid = None
+        if parents is not None and rootid not in parents:
+            parentid = parents[0]
+        # walk up until we reach the root or a folder whose path is already known
+        ancestors = []
+        pathlist = []
+        path = ''
+        while parentid is not None and parentid != rootid:
+            cached = self.pathcache.get(parentid)
+            if cached is not None:
+                pathlist, path = cached
+                break
+            name, nextparentid = await self.get_folder(parentid, verbose=verbose)
+            ancestors.append((parentid, name))
+            parentid = nextparentid
+        for folderid, name in reversed(ancestors):
+            pathlist = pathlist + [folderid]
+            path = path + '/' + name
+            self.pathcache.put(folderid, (pathlist, path))
+        return pathlist + [file.get('id')], path + '/' + file.get('name')
+
+    async def create_folder(self, name, parentid):
+        """Creates the folder name in the folder parentid, looking for the folder a
+        failed create may have made anyway before creating it again
+        Returns:
+            folder resource with id and name
+        """
+        folder_metadata = {
+        'name' : name,
+        'mimeType' : FOLDERTYPE,
+        'parents'  : [parentid],
+        }
+        query = "name = '%s' and '%s' in parents and mimeType = '%s' and trashed = false" % (
+            name.replace('\\', '\\\\').replace("'", "\\'"), parentid, FOLDERTYPE)
+        attempt = 0
+        while True:
+            try:
+                return await self.api('POST', 'files', params={'fields': 'id,name'}, resource=folder_metadata, idempotent=False)
+            except Exception as e:
+                # raises e unless it is transient and there are retries left
+                await self.wait_to_retry(e, attempt, 'POST files')
+                attempt = attempt + 1
+            response = await self.api('GET', 'files', params={'q': query, 'fields': 'files(id,name)'})
+            if len(response.get('files', [])) > 0:
+                return response.get('files')[0]
+
+    async def create_folder_path(self, path=None, verbose=False):
+        """Will create a new folderpath, including all missing folders. Concurrent
+        calls are serialized so they don't create the same folder twice
+        Returns:
+            path string, id, and folder
+        """
+        if path is None:
+            raise GoogleDriveException("You need to specify a path in order to create it")
+        async with self.folderlock:
+            folder = await self.get_root()
+            builtpath = ''
+            for dirname in path.split('/'):
+                if len(dirname) == 0:
+                    continue
+                parentid = folder.get('id')
+                builtpath = builtpath + '/' + dirname
+                existingpaths, existingids, existingdirs = await self.list_files_in_drive(pathquery=builtpath, fields="files(id,name,parents,mimeType)")
+                existingfolders = [existing for existing in existingdirs if existing.get("mimeType") == FOLDERTYPE]
+                if len(existingids) > 0 and len(existingfolders) == 0:
+                    raise GoogleDriveException("The path [%s] contains a component that is currently a file and we would have to overwrite it as a directory" % builtpath)
+                if len(existingfolders) > 0:
+                    # the path directory exists already
+                    folder = existingfolders[0]
+                    if verbose:
+                        sys.stdout.write("%s already exists\n" % builtpath)
+                    continue
+                try:
+                    folder = await self.create_folder(dirname, parentid)
+                except AsyncHttpError as e:
+                    raise GoogleDriveException("[%s] unable to create folder path %s" % (builtpath, e.reason))
+                self.folderindex[folder.get('id')] = (dirname, parentid)
+        return path, folder.get("id"), folder
+
+    async def remove(self, fileid, trash=True):
+        if trash:
+            file = await self.api('PATCH', 'files/%s' % fileid, params={'fields': 'id,name'}, resource={'trashed': True})
+        else:
+            await self.api('DELETE', 'files/%s' % fileid)
+            file = {'id': fileid}
+        self.forget_folders([fileid])
+        return file
+
+    async def delete_file_path(self, path=None, trash=True, verbose=False):
+        """Will delete (or trash) the file at path
+        Returns:
+            path, id and file resource
+        """
+        pathlist, fileids, files = await self.list_files_in_drive(pathquery=path, verbose=verbose)
+        if len(fileids) > 1:
+            raise GoogleDriveException("more than one file found (%s). You can only delete file paths that resolve to a single file" % path)
+        if len(fileids) == 0:
+            raise GoogleDriveException("unable to find filepath %s to delete" % path)
+        try:
+            await self.remove(fileids[0], trash=trash)
+        except AsyncHttpError as e:
+            raise GoogleDriveException("unable to delete filepath %s. %s" % (path, e.reason))
+        return pathlist[0], fileids[0], files[0]
+
+    async def delete_file_id(self, fileid=None, trash=True, verbose=False):
+        """Will delete (or trash) the file with fileid
+        Returns:
+            path, id and file resource
+        """
+        try:
+            file = await self.api('GET', 'files/%s' % fileid, params={'fields': 'id,name,parents'})
+            pathlist, path = await self.get_path(file=file, verbose=verbose)
+            await self.remove(fileid, trash=trash)
+        except AsyncHttpError as e:
+            raise GoogleDriveException("unable to delete fileid=%s: %s" % (fileid, e.reason))
+        return path, fileid, file
+
+    async def upload_file_to_path(self, filename='', parentpath='', verbose=False, allowduplicate=False, chunk=16, checksum=None):
+        """Uploads the file into parentpath through a resumable upload session,
+        resuming from what the server kept after a failed chunk
+        Returns:
+                path, id and file resource
+        """
+        name = os.path.basename(filename)
+        if parentpath not in ('/', ''):
+            pathlist, parentids, parents = await self.list_files_in_drive(pathquery=parentpath)
+            if len(parentids) == 0:
+                raise GoogleDriveException("Unable to find path %s" % parentpath)
+            if len(parentids) > 1:
+                raise GoogleDriveException("There are %d folders at the path '%s' we don't know where to upload the file." % (len(parentids), parentpath))
+        else:
+            parentpath = ''
+            parentids = [(await self.get_root()).get('id')]
+        existingpaths, existingids, existingfiles = await self.list_files_in_drive(pathquery="%s/%s" % (parentpath, name))
+        if len(existingids) > 0 and not allowduplicate:
+            raise GoogleDriveException("file %s/%s already exists" % (parentpath, name))
+        file_metadata = {
+              'name' : name,
+              'parents': parentids
+        }
+        if checksum is not None:
+            file_metadata['properties'] = { 'checksum': checksum}
+        try:
+            f = open(filename, 'rb')
+        except FileNotFoundError:
+            msg = "Unable to find file '%s' to upload" % filename
+            if verbose:
+                sys.stdout.write("%s\n" % msg)
+            raise GoogleDriveException(msg)
+        chunker = transfer_chunker(chunk, chunkseconds=self.chunkseconds, maxchunk=self.maxchunk)
+        try:
+            total = os.fstat(f.fileno()).st_size
+            status, headers, content = await self.request('POST', 'upload/drive/v3/files',
+                                                          params={'uploadType': 'resumable', 'fields': 'name,id,size,parents'},
+                                                          body=json.dumps(file_metadata),
+                                                          headers={'Content-Type': 'application/json; charset=UTF-8',
+                                                                   'X-Upload-Content-Length': str(total)},
+                                                          description='upload %s' % filename)
+            if 'location' not in headers:
+                raise GoogleDriveException("unable to upload file %s: no upload session was started" % filename)
+            sessionuri = headers['location']
+            offset = 0
+            attempt = 0
+            file = None
+            while file is None:
+                body = await asyncio.to_thread(os.pread, f.fileno(), chunker.size, offset)
+                if len(body) == 0:
+                    contentrange = 'bytes */%d' % total
+                else:
+                    contentrange = 'bytes %d-%d/%d' % (offset, offset + len(body) - 1, total)
+                started = time.time()
+                try:
+                    status, headers, content = await self.send('PUT', sessionuri, body=body, headers={'Content-Range': contentrange},
+                                                               ok=(200, 201, 308), nbytes=len(body))
+                    attempt = 0
+                except Exception as e:
+                    chunker.failed()
+                    await self.wait_to_retry(e, attempt, 'upload %s' % filename)
+                    attempt = attempt + 1
+                    # ask the server how much of the upload it kept and carry on from there
+                    status, headers, content = await self.request('PUT', sessionuri, headers={'Content-Range': 'bytes */%d' % total},
+                                                                  ok=(200, 201, 308), description='upload %s' % filename)
+                if status in (200, 201):
+                    file = json.loads(content.decode('utf-8'))
+                else:
+                    received = offset
+                    offset = 0
+                    if 'range' in headers:
+                        offset = int(headers['range'].split('-')[-1]) + 1
+                    if attempt == 0:
+                        chunker.record(offset - received, time.time() - started)
+                    if verbose:
+                        sys.stdout.write("Uploaded %d%%.\r" % int(100.0 * offset / max(total, 1)))
+                        sys.stdout.flush()
+            if verbose:
+                sys.stdout.write("Uploaded 100%% of file %s\n" % filename)
+        except AsyncHttpError as e:
+            msg = "unable to upload file %s: %s" % (filename, e.reason)
+            if verbose:
+                sys.stdout.write("%s\n" % msg)
+            raise GoogleDriveException(msg)
+        finally:
+            f.close()
+        return parentpath + '/' + name, file.get('id'), file
+
+    async def download_file(self, fileid, fileName, verbose=False, chunksize=1):
+        """Downloads the fileid file into the current directory under its Drive name
+        (with (n) added if that is taken), resuming from the last byte received after errors
+        Returns:
+                local file name, id and file resource
+        """
+        if fileid is None or fileName is None:
+            return None
+        try:
+            file = await self.api('GET', 'files/%s' % fileid, params={'fields': 'id,name,size'})
+        except AsyncHttpError as e:
+            msg = "unable to access file ID %s %s" % (fileid, e.reason)
+            if verbose:
+                sys.stdout.write("%s\n" % msg)
+            raise GoogleDriveException(msg)
+        indx = 1
+        name, ext = os.path.splitext(file.get('name'))
+        newname = name
+        # nothing awaits between the check and the open, so other downloads can't take the name
+        while os.path.isfile(newname + ext):
+            newname = "%s(%d)" % (name, indx)
+            indx = indx +1
+        fh = open(newname + ext, 'wb')
+        if verbose:
+            sys.stdout.write("Downloading file %s, id=%s\n" % (newname + ext, fileid))
+        received = 0
+        attempt = 0
+        url = self.baseurl + 'drive/v3/files/%s' % fileid
+        try:
+            while True:
+                try:
+                    headers = await self.authorization()
+                    if received > 0:
+                        headers['Range'] = 'bytes=%d-' % received
+                    await self.throttle()
+                    async with self.semaphore:
+                        async with self.session.get(url, params={'alt': 'media'}, headers=headers) as resp:
+                            if resp.status not in (200, 206):
+                                raise AsyncHttpError(resp.status, await resp.read(),
+                                                     dict((key.lower(), value) for key, value in resp.headers.items()), uri=url)
+                            if received > 0 and resp.status == 200:
+                                # the range was ignored, start the file again
+                                await asyncio.to_thread(fh.truncate, 0)
+                                fh.seek(0)
+                                received = 0
+                            async for data in resp.content.iter_chunked(chunksize*1024*1024):
+                                await asyncio.to_thread(fh.write, data)
+                                received = received + len(data)
+                    break
+                except Exception as e:
+                    await self.wait_to_retry(e, attempt, 'download %s' % fileid)
+                    attempt = attempt + 1
+        except Exception as e:
+            fh.close()
+            os.remove(fh.name)
+            raise GoogleDriveException("failed to download file %s: %s" % (fh.name, getattr(e, 'reason', str(e))))
+        fh.close()
+        if verbose:
+            sys.stdout.write("Download Complete!\n")
+        return newname + ext, fileid, file
@@ -0,0 +1,272 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import os
+import io
+import json
+import tarfile
+import fnmatch
+import threading
+from compression import ParallelGzipWriter, default_level, compress_writer, decompress_reader
+
+# member at the top of an incremental archive listing the files deleted since the backup before it
+DELETED_MEMBER = '.drive_backup_deleted.json'
+
+class ArchiveException(Exception):
+    '''Generic exception to raise archiving errors.'''
+    def __init__(self, msg):
+        super(ArchiveException).__init__(type(self))
+        self.msg = "E: %s" % msg
+    def __str__(self):
+        return self.msg
+    def __unicode__(self):
+        return self.msg
+
+def exclude_patterns(parentname, excludefolders=None):
+    """turn --excludefolders paths into member name patterns, the same way
+    drive_backup.py turns them into tar --exclude arguments"""
+    patterns = []
+    if excludefolders is not None:
+        for excludefolder in excludefolders:
+            patterns.append(excludefolder.replace(parentname, '')[1:])
+    return patterns
+
+def is_excluded(name, patterns):
+    """tar --exclude style match: a pattern matches the member name or any
+    trailing part of it that starts at a path component"""
+    parts = name.split('/')
+    for pattern in patterns:
+        for indx in range(len(parts)):
+            if fnmatch.fnmatchcase('/'.join(parts[indx:]), pattern):
+                return True
+    return False
+
+def iter_members(parentname, dirname, patterns):
+    """walk parentname/dirname following symbolic links (like tar --dereference)
+    yields:
+        (path, member name) for every directory and file that isn't excluded,
+        in sorted order
+    """
+    top = os.path.join(parentname, dirname)
+    visited = set()
+    for dirpath, dirnames, filenames in os.walk(top, followlinks=True):
+        arcdir = dirname + dirpath[len(top):]
+        yield dirpath, arcdir
+        realpath = os.path.realpath(dirpath)
+        if realpath in visited:
+            # symbolic link loop, don't descend again
+            dirnames[:] = []
+            continue
+        visited.add(realpath)
+        dirnames[:] = sorted(d for d in dirnames if not is_excluded(arcdir + '/' + d, patterns))
+        for filename in sorted(filenames):
+            arcname = arcdir + '/' + filename
+            if not is_excluded(arcname, patterns):
+                yield os.path.join(dirpath, filename), arcname
+
+def add_member(tar, path, arcname, prepare=None):
+    """add one file or directory to tar, reading the file before its header is written
+    prepare: called with the path and tarinfo of a regular file before it is added
+    returns:
+        None if added else the reason it was skipped
+    """
+    try:
+        tarinfo = tar.gettarinfo(path, arcname)
+        if tarinfo is None:
+            return "unsupported file type"
+        if tarinfo.isreg():
+            if prepare is not None:
+                prepare(path, tarinfo)
+            with open(path, 'rb') as f:
+                tar.addfile(tarinfo, f)
+        else:
+            tar.addfile(tarinfo)
+    except (OSError, ValueError) as e:
+        # unreadable files and names too long for ustar are skipped like tar does
+        return str(e)
+    return None
+
+def add_data(tar, arcname, data):
+    """add a regular file holding data to tar"""
+    tarinfo = tarfile.TarInfo(arcname)
+    tarinfo.size = len(data)
+    tarinfo.mode = 0o644
+    tar.addfile(tarinfo, io.BytesIO(data))
+
+def deletion_list(deleted):
+    """returns:
+        (member name, contents) of the member recording the deleted member names
+    """
+    return DELETED_MEMBER, json.dumps(deleted).encode('utf-8')
+
+def write_tar(fileobj, parentname, dirname, excludefolders=None, compresslevel=6, members=None, extra=None, codec='gzip', jobs=1,
+              probe=None):
+    """write a gzipped ustar archive of parentname/dirname to fileobj, equivalent to
+    tar --dereference --format ustar -czf - --directory parentname dirname
+    fileobj only needs a write method, it is never seeked
+    members: (path, member name) pairs to archive instead of everything under
+    parentname/dirname, e.g. the files that changed since the last backup
+    extra: (member name, bytes) pairs written ahead of the files
+    codec: gzip, zstd or None for a plain tar, e.g. for a chunk store to deduplicate
+    compresslevel: level of the codec, None for its default
+    jobs: cores compressing
+    probe: CompressibilityProbe picking the files stored without compression, only
+    gzip can switch compression on and off between members. It is left with the
+    bytes into and out of the compressor.
+    returns:
+        list of (member name, reason) for members that had to be skipped
+    """
+    if members is None:
+        members = iter_members(parentname, dirname, exclude_patterns(parentname, excludefolders))
+    skipped = []
+    gz = fileobj
+    prepare = None
+    if codec == 'gzip' and probe is not None:
+        if compresslevel is None:
+            compresslevel = default_level(codec)
+        gz = ParallelGzipWriter(fileobj, compresslevel=compresslevel, jobs=jobs)
+        def prepare(path, tarinfo):
+            gz.set_level(compresslevel if probe.check(path, tarinfo.size) else 0)
+    elif codec is not None:
+        gz = compress_writer(fileobj, codec=codec, compresslevel=compresslevel, jobs=jobs)
+    try:
+        # ustar so changed file attributes that don't change file contents don't change the archive
+        tar = tarfile.open(fileobj=gz, mode='w|', format=tarfile.USTAR_FORMAT, dereference=True)
+        try:
+            for arcname, data in (extra or []):
+                add_data(tar, arcname, data)
+            for path, arcname in members:
+                reason = add_member(tar, path, arcname, prepare)
+                if reason is not None:
+                    skipped.append((arcname, reason))
+        finally:
+            tar.close()
+    finally:
+        if gz is not fileobj:
+            gz.close()
+    if prepare is not None:
+        probe.insize = gz.size
+        probe.outsize = gz.written
+    return skipped
+
+class ArchiveStream(object):
+    '''
+    Runs write_tar in a background thread and exposes the archive as a
+    readable stream, so it can be uploaded without a staging file.
+    '''
+    def __init__(self, parentname, dirname, excludefolders=None, compresslevel=6, members=None, extra=None, codec='gzip', jobs=1,
+                 probe=None):
+        readfd, writefd = os.pipe()
+        self.reader = os.fdopen(readfd, 'rb')
+        self.writer = os.fdopen(writefd, 'wb')
+        self.name = os.path.join(parentname, dirname)
+        self.error = None
+        self.skipped = []
+        self.thread = threading.Thread(target=self.run, args=(parentname, dirname),
+                                       kwargs={'excludefolders': excludefolders, 'compresslevel': compresslevel,
+                                               'members': members, 'extra': extra, 'codec': codec, 'jobs': jobs,
+                                               'probe': probe})
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self, parentname, dirname, **options):
+        try:
+            self.skipped = write_tar(self.writer, parentname, dirname, **options)
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                self.writer.close()
+            except OSError:
+                pass
+
+    def read(self, size=-1):
+        data = self.reader.read(size)
+        if size < 0 or len(data) < size:
+            # end of the archive, make sure it wasn't cut short
+            self.thread.join()
+            if self.error is not None:
+                raise ArchiveException("unable to archive %s: %s" % (self.name, str(self.error)))
+        return data
+
+    def close(self):
+        self.reader.close()
+        self.thread.join()
+
+def inside(destination, name):
+    """returns:
+        the path of member name under destination or None if it would land outside it
+    """
+    top = os.path.realpath(destination)
+    path = os.path.realpath(os.path.join(top, name))
+    if path == top or not path.startswith(top + os.path.sep):
+        return None
+    return path
+
+def extract_archive(fileobj, destination, codec='gzip'):
+    """extract an archive written by tar or write_tar into destination,
+    overwriting files that are already there. Members that would land outside
+    destination are skipped.
+    codec: what the archive is compressed with, None for a plain tar
+    returns:
+        the member names listed as deleted if it is an incremental archive else []
+    """
+    deleted = []
+    mode = 'r|'
+    if codec == 'gzip':
+        mode = 'r|gz'
+    elif codec is not None:
+        fileobj = decompress_reader(fileobj, codec)
+    with tarfile.open(fileobj=fileobj, mode=mode) as tar:
+        for tarinfo in tar:
+            if tarinfo.name == DELETED_MEMBER:
+                deleted = json.loads(tar.extractfile(tarinfo).read().decode('utf-8'))
+                continue
+            path = inside(destination, tarinfo.name)
+            if path is None or not (tarinfo.isreg() or tarinfo.isdir()):
+                # backups are made with --dereference, anything else didn't come from one
+                continue
+            if tarinfo.isdir():
+                os.makedirs(path, exist_ok=True)
+                continue
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            if os.path.islink(path):
+                os.remove(path)
+            with open(path, 'wb') as f:
+                source = tar.extractfile(tarinfo)
+                data = source.read(1024*1024)
+                while data:
+                    f.write(data)
+                    data = source.read(1024*1024)
+            os.chmod(path, tarinfo.mode & 0o7777)
+            os.utime(path, (tarinfo.mtime, tarinfo.mtime))
+    return deleted
+
+def remove_members(destination, names):
+    """delete the files an incremental archive lists as deleted from destination and
+    any directories that are left empty by that
+    returns:
+        number of files removed
+    """
+    removed = 0
+    top = os.path.realpath(destination)
+    for name in names:
+        path = inside(destination, name)
+        if path is None:
+            continue
+        try:
+            os.remove(path)
+            removed = removed + 1
+        except OSError:
+            continue
+        parent = os.path.dirname(path)
+        while parent != top and parent.startswith(top + os.path.sep):
+            try:
+                os.rmdir(parent)
+            except OSError:
+                # not empty
+                break
+            parent = os.path.dirname(parent)
+    return removed
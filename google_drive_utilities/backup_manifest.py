@@ -0,0 +1,76 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import os
+import json
+
+class BackupManifest(object):
+    '''
+    What the newest backup of a directory contains: the md5 of every file in it,
+    keyed by tar member name, together with the name of that backup, the full
+    backup its chain starts from and how many incrementals have been stacked on
+    that full. Incremental backups are made by diffing a new listing against it.
+    '''
+    def __init__(self, backuproot, files=None, last=None, full=None, incrementals=0, checksum=None):
+        '''
+        Constructor
+        files: dictionary of member name -> hex md5 digest
+        last: name of the backup on Drive this manifest describes
+        full: name of the full backup the chain of incrementals starts from
+        '''
+        self.backuproot = backuproot
+        self.files = files if files is not None else {}
+        self.last = last
+        self.full = full
+        self.incrementals = incrementals
+        self.checksum = checksum
+
+    @classmethod
+    def filename(cls, manifestdir, backuproot):
+        return os.path.join(manifestdir, "%s.json" % backuproot)
+
+    @classmethod
+    def load(cls, manifestdir, backuproot):
+        """returns:
+            the manifest saved for backuproot or None if there isn't a readable one
+        """
+        try:
+            with open(cls.filename(manifestdir, backuproot)) as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if entries.get('backuproot') != backuproot:
+            return None
+        return cls(backuproot, files=entries.get('files'), last=entries.get('last'), full=entries.get('full'),
+                   incrementals=entries.get('incrementals', 0), checksum=entries.get('checksum'))
+
+    def save(self, manifestdir):
+        if not os.path.isdir(manifestdir):
+            os.makedirs(manifestdir, exist_ok=True)
+        filename = self.filename(manifestdir, self.backuproot)
+        # write then rename so a crash never leaves half a manifest
+        tmpfile = "%s.%d" % (filename, os.getpid())
+        with open(tmpfile, 'w') as f:
+            json.dump({'backuproot': self.backuproot,
+                       'last': self.last,
+                       'full': self.full,
+                       'incrementals': self.incrementals,
+                       'checksum': self.checksum,
+                       'files': self.files}, f)
+        os.replace(tmpfile, filename)
+
+    def diff(self, files):
+        """compare a new member name -> digest listing with this manifest
+        returns:
+            sorted lists of the member names that were changed or added and of
+            those that were deleted
+        """
+        changed = sorted(name for name, digest in files.items() if self.files.get(name) != digest)
+        deleted = sorted(name for name in self.files if name not in files)
+        return changed, deleted
+
+    def __str__(self):
+        return "manifest of %s: %d files, last=%s, full=%s, incrementals=%d" % (self.backuproot, len(self.files),
+                                                                               self.last, self.full, self.incrementals)
@@ -0,0 +1,452 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import sys
+import math
+import gzip
+import json
+import time
+import zlib
+import sqlite3
+import hashlib
+import threading
+from calendar import timegm
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+class ChunkStoreException(Exception):
+    '''Generic exception to raise chunk store errors.'''
+    def __init__(self, msg):
+        super(ChunkStoreException).__init__(type(self))
+        self.msg = "E: %s" % msg
+    def __str__(self):
+        return self.msg
+    def __unicode__(self):
+        return self.msg
+
+class ContentChunker(object):
+    '''
+    Splits a stream into content defined chunks. A chunk ends where the window of
+    bytes before it hashes to a value with its low bits clear, so the boundaries
+    move with the data when bytes are inserted or removed and the same run of
+    data gives the same chunks wherever it turns up.
+    The window hash is only evaluated where the anchor byte occurs, found with
+    bytes.find, so the scan runs at C speed instead of one Python step per byte.
+    Data without the anchor byte (e.g. runs of zeros) is cut at maxsize.
+    '''
+    window = 48
+    # common in text and about one byte in 256 of binary data
+    anchor = b'\n'
+
+    def __init__(self, minsize=1024*1024, avgsize=4*1024*1024, maxsize=16*1024*1024):
+        '''
+        Constructor
+        '''
+        if not self.window <= minsize <= avgsize <= maxsize:
+            raise ChunkStoreException("chunk sizes must satisfy %d <= minsize <= avgsize <= maxsize" % self.window)
+        self.minsize = minsize
+        self.avgsize = avgsize
+        self.maxsize = maxsize
+        # a boundary every 2**bits anchors puts the average near avgsize for binary data
+        bits = int(round(math.log2(max(1.0, (avgsize - minsize) / 256.0))))
+        self.mask = (1 << bits) - 1
+
+    def boundary(self, buffer):
+        """returns:
+            length of the first chunk in buffer or None if buffer is too short to tell
+        """
+        end = min(len(buffer), self.maxsize)
+        start = self.minsize - 1
+        while True:
+            indx = buffer.find(self.anchor, start, end)
+            if indx < 0:
+                break
+            if zlib.crc32(buffer[indx + 1 - self.window:indx + 1]) & self.mask == 0:
+                return indx + 1
+            start = indx + 1
+        if len(buffer) >= self.maxsize:
+            return self.maxsize
+        return None
+
+    def chunks(self, stream):
+        """read stream (anything with a read method) to the end
+        yields:
+            the chunks, as bytes
+        """
+        buffer = bytearray()
+        eof = False
+        while True:
+            while not eof and len(buffer) < self.maxsize:
+                data = stream.read(self.maxsize - len(buffer))
+                if not data:
+                    eof = True
+                else:
+                    buffer.extend(data)
+            if len(buffer) == 0:
+                return
+            cut = self.boundary(buffer)
+            if cut is None:
+                # the end of the stream ends the last chunk
+                cut = len(buffer)
+            yield bytes(buffer[:cut])
+            del buffer[:cut]
+
+class ChunkIndex(object):
+    '''
+    Local SQLite copy of the listing of a chunk folder on Drive: the hash, file id
+    and size of every chunk in it. It is filled from one listing of the folder and
+    kept current as chunks are uploaded and collected, so whether a chunk has to be
+    uploaded is answered without an API call. Resync it now and then in case the
+    folder was changed behind its back; ChunkStore.store also checks that the
+    chunks it reuses from the index are still there.
+    '''
+    # chunks in each page of the folder listing
+    pagesize = 1000
+
+    def __init__(self, dbfile):
+        '''
+        Constructor
+        '''
+        self.dbfile = dbfile
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(dbfile, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS chunks (
+                                       digest TEXT PRIMARY KEY,
+                                       id TEXT,
+                                       size INTEGER,
+                                       stored INTEGER)''')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value TEXT)')
+        self.connection.commit()
+
+    def synced(self, folderid):
+        """returns:
+            the time the index was last synced with folderid or None if it never was
+        """
+        with self.lock:
+            rows = dict(self.connection.execute('SELECT name, value FROM meta').fetchall())
+        if rows.get('folderid') != folderid or rows.get('synced') is None:
+            return None
+        return float(rows['synced'])
+
+    def sync(self, gdrive, folderid, verbose=False):
+        """replace the index with a listing of the chunks in folderid
+        returns:
+            number of chunks in the folder
+        """
+        entries = []
+        for files in gdrive.iter_pages("'%s' in parents and not trashed" % folderid, fields="files(id,name,size,properties)",
+                                       page_size=self.pagesize, verbose=verbose):
+            for file in files:
+                properties = file.get('properties') or {}
+                entries.append((file.get('name'), file.get('id'), int(properties.get('size', 0)), int(file.get('size') or 0)))
+        with self.lock:
+            self.connection.execute('DELETE FROM chunks')
+            self.connection.executemany('INSERT OR REPLACE INTO chunks (digest, id, size, stored) VALUES (?, ?, ?, ?)', entries)
+            self.connection.executemany('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)',
+                                        [('folderid', folderid), ('synced', repr(time.time()))])
+            self.connection.commit()
+        return len(entries)
+
+    def get(self, digest):
+        """returns:
+            (file id, size, stored size) of the chunk or None if it isn't in the folder
+        """
+        with self.lock:
+            row = self.connection.execute('SELECT id, size, stored FROM chunks WHERE digest = ?', (digest,)).fetchone()
+            if row is None:
+                self.misses = self.misses + 1
+            else:
+                self.hits = self.hits + 1
+        return row
+
+    def add(self, digest, fileid, size, stored):
+        with self.lock:
+            self.connection.execute('INSERT OR REPLACE INTO chunks (digest, id, size, stored) VALUES (?, ?, ?, ?)',
+                                    (digest, fileid, size, stored))
+            self.connection.commit()
+
+    def remove(self, digests):
+        with self.lock:
+            self.connection.executemany('DELETE FROM chunks WHERE digest = ?', [(digest,) for digest in digests])
+            self.connection.commit()
+
+    def ids(self):
+        """returns:
+            dict of sha256 -> file id of every chunk in the index
+        """
+        with self.lock:
+            return dict(self.connection.execute('SELECT digest, id FROM chunks').fetchall())
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM chunks').fetchone()[0]
+
+    def __str__(self):
+        return "chunk index %d chunks, hits=%d misses=%d" % (len(self), self.hits, self.misses)
+
+class ChunkReader(object):
+    '''
+    File like object reading the concatenation of an iterator of chunks
+    '''
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.buffer = b''
+        self.offset = 0
+
+    def read(self, size=-1):
+        parts = []
+        while size != 0:
+            if self.offset >= len(self.buffer):
+                self.buffer = next(self.chunks, b'')
+                self.offset = 0
+                if len(self.buffer) == 0:
+                    break
+            if size < 0:
+                part = self.buffer[self.offset:]
+            else:
+                part = self.buffer[self.offset:self.offset + size]
+                size = size - len(part)
+            self.offset = self.offset + len(part)
+            parts.append(part)
+        return b''.join(parts)
+
+def write_snapshot(chunks, **info):
+    """returns:
+        gzipped json of a snapshot: info plus the [sha256, size] of every chunk, in order
+    """
+    snapshot = dict(info)
+    snapshot['version'] = 1
+    snapshot['size'] = sum(size for digest, size in chunks)
+    snapshot['chunks'] = chunks
+    return gzip.compress(json.dumps(snapshot).encode('utf-8'), mtime=0)
+
+def read_snapshot(data):
+    """returns:
+        the dictionary written by write_snapshot
+    """
+    try:
+        snapshot = json.loads(gzip.decompress(data).decode('utf-8'))
+    except (OSError, ValueError) as e:
+        raise ChunkStoreException("unreadable snapshot: %s" % str(e))
+    if snapshot.get('version') != 1:
+        raise ChunkStoreException("unsupported snapshot version %s" % snapshot.get('version'))
+    return snapshot
+
+def modified_time(file):
+    """returns:
+        modifiedTime of a file resource in seconds since the epoch, 0 if it has none
+    """
+    modified = file.get('modifiedTime')
+    if modified is None:
+        return 0
+    return timegm(time.strptime(modified[:19], '%Y-%m-%dT%H:%M:%S'))
+
+class ChunkStore(object):
+    '''
+    Deduplicating store of content defined chunks in one Drive folder. Every
+    distinct chunk is uploaded once, zlib compressed and named by the sha256 of
+    its contents, so data repeated within a backup, across directories or from
+    one day to the next only costs an upload the first time it is seen.
+    A chunk folder has a single writer: collect_garbage assumes no backup on another
+    host is storing into the same folder while it runs, as it can't see the chunks
+    such a backup is about to reuse.
+    '''
+    def __init__(self, gdrive, folderid, index, jobs=4, maxinflight=32, compresslevel=6, verbose=False):
+        '''
+        Constructor
+        jobs: chunks uploaded or downloaded at the same time
+        maxinflight: chunks read ahead of the uploads, bounds the memory used
+        '''
+        self.gdrive = gdrive
+        self.folderid = folderid
+        self.index = index
+        self.jobs = jobs
+        self.maxinflight = maxinflight
+        self.compresslevel = compresslevel
+        self.verbose = verbose
+        self.lock = threading.Lock()
+        # digest -> future of chunks being uploaded, shared by every caller of store
+        self.pending = {}
+        self.chunks = 0
+        self.duplicates = 0
+        self.uploaded = 0
+        self.nbytes = 0
+        self.storedbytes = 0
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+
+    def upload(self, digest, chunk):
+        """returns:
+            bytes uploaded for the chunk
+        """
+        try:
+            # zlib lets go of the GIL, so the upload threads compress in parallel
+            data = zlib.compress(chunk, self.compresslevel)
+            # a duplicate chunk is the same bytes under the same name, either copy will do
+            # and collect_garbage trashes the one the index doesn't point to
+            file = self.gdrive.upload_bytes(data, digest, [self.folderid], properties={'size': str(len(chunk))},
+                                            allowduplicate=True, verbose=self.verbose)
+            self.index.add(digest, file.get('id'), len(chunk), len(data))
+            with self.lock:
+                self.uploaded = self.uploaded + 1
+                self.storedbytes = self.storedbytes + len(data)
+            return len(data)
+        finally:
+            with self.lock:
+                self.pending.pop(digest, None)
+
+    def store(self, stream, chunker):
+        """split stream into chunks and upload the ones the store doesn't have yet
+        returns:
+            list of [sha256, size] of the chunks in stream, in order, the number of
+            chunks uploaded and the bytes they took
+        """
+        chunks = []
+        waiting = []
+        # digest -> file id of the chunks the index says are already in the folder
+        reused = {}
+        inflight = threading.BoundedSemaphore(self.maxinflight)
+        for chunk in chunker.chunks(stream):
+            digest = hashlib.sha256(chunk).hexdigest()
+            chunks.append([digest, len(chunk)])
+            inflight.acquire()
+            with self.lock:
+                self.chunks = self.chunks + 1
+                self.nbytes = self.nbytes + len(chunk)
+                future = self.pending.get(digest)
+                if future is not None:
+                    # another directory is uploading the same chunk, wait for it before the snapshot
+                    waiting.append((future, False))
+                else:
+                    entry = self.index.get(digest)
+                    if entry is None:
+                        future = self.executor.submit(self.upload, digest, chunk)
+                        self.pending[digest] = future
+                        future.add_done_callback(lambda future: inflight.release())
+                        waiting.append((future, True))
+                        continue
+                    reused[digest] = entry[0]
+                self.duplicates = self.duplicates + 1
+            inflight.release()
+        uploaded = 0
+        uploadedbytes = 0
+        for future, mine in waiting:
+            nbytes = future.result()
+            if mine:
+                uploaded = uploaded + 1
+                uploadedbytes = uploadedbytes + nbytes
+        missing = self.verify(reused)
+        if len(missing) > 0:
+            raise ChunkStoreException("%d chunks the index listed are gone from the chunk folder, they were dropped from the index"
+                                      % len(missing))
+        return chunks, uploaded, uploadedbytes
+
+    def verify(self, reused):
+        """check that chunks taken from the index are still in the chunk folder, in
+        case they were trashed behind its back. Those that are gone are dropped from
+        the index, so storing the stream again uploads them.
+        reused: dict of sha256 -> file id of the chunks
+        returns:
+            list of the sha256 of the chunks that are gone
+        """
+        if len(reused) == 0:
+            return []
+        # a listing costs a page per pagesize chunks in the whole folder, asking about
+        # the reused chunks a round trip per batchsize of them, take the cheaper one
+        batches = math.ceil(len(reused) / float(self.gdrive.batchsize))
+        pages = math.ceil(len(self.index) / float(self.index.pagesize))
+        if pages < batches:
+            self.index.sync(self.gdrive, self.folderid, verbose=self.verbose)
+            present = self.index.ids()
+            return [digest for digest, fileid in reused.items() if present.get(digest) != fileid]
+        digests = dict((fileid, digest) for digest, fileid in reused.items())
+        files, errors = self.gdrive.get_many(list(digests), fields='id,trashed,parents', verbose=self.verbose)
+        missing = []
+        for fileid, digest in digests.items():
+            e = errors.get(fileid)
+            if e is not None and getattr(getattr(e, 'resp', None), 'status', None) != 404:
+                raise ChunkStoreException("unable to check chunk %s: %s" % (digest, getattr(e, 'reason', str(e))))
+            file = files.get(fileid)
+            if file is None or file.get('trashed') or self.folderid not in file.get('parents', []):
+                missing.append(digest)
+        self.index.remove(missing)
+        return missing
+
+    def fetch(self, digest):
+        """returns:
+            the contents of the chunk, checked against its hash
+        """
+        entry = self.index.get(digest)
+        if entry is None:
+            raise ChunkStoreException("chunk %s is missing from the chunk folder" % digest)
+        chunk = zlib.decompress(self.gdrive.download_bytes(entry[0], verbose=self.verbose))
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise ChunkStoreException("chunk %s is corrupt" % digest)
+        return chunk
+
+    def iter_chunks(self, chunks):
+        """download chunks ([sha256, size] pairs), jobs of them at a time
+        yields:
+            their contents, in order
+        """
+        ahead = deque()
+        for digest, size in chunks:
+            ahead.append(self.executor.submit(self.fetch, digest))
+            if len(ahead) >= 2 * self.jobs:
+                yield ahead.popleft().result()
+        while ahead:
+            yield ahead.popleft().result()
+
+    def collect_garbage(self, referenced, grace=24*60*60):
+        """trash the chunks that no snapshot in referenced (a set of sha256) uses.
+        Chunks modified in the last grace seconds are kept, they may belong to a
+        backup that is still running. Of the chunks still in use only the copy the
+        index points to is kept, an upload retried after its response was lost can
+        leave a second file with the same name.
+        returns:
+            number of unused chunks trashed and number of duplicate copies trashed
+        """
+        unused = []
+        digests = []
+        copies = {}
+        cutoff = time.time() - grace
+        for files in self.gdrive.iter_pages("'%s' in parents and not trashed" % self.folderid,
+                                            fields="files(id,name,size,modifiedTime,properties)", verbose=self.verbose):
+            for file in files:
+                if file.get('name') not in referenced and modified_time(file) < cutoff:
+                    unused.append(file.get('id'))
+                    digests.append(file.get('name'))
+                else:
+                    copies.setdefault(file.get('name'), []).append(file)
+        ids = self.index.ids()
+        duplicates = []
+        for digest, files in copies.items():
+            if len(files) < 2:
+                continue
+            keep = [file for file in files if file.get('id') == ids.get(digest)]
+            if len(keep) == 0:
+                # the index lost track of this chunk, keep the first copy and point it there
+                keep = files[:1]
+                properties = keep[0].get('properties') or {}
+                self.index.add(digest, keep[0].get('id'), int(properties.get('size', 0)), int(keep[0].get('size') or 0))
+            duplicates.extend(file.get('id') for file in files if file.get('id') != keep[0].get('id'))
+        if len(unused) + len(duplicates) == 0:
+            return 0, 0
+        trashed, errors = self.gdrive.trash_many(unused + duplicates, verbose=self.verbose)
+        for fileid, e in errors.items():
+            if self.verbose:
+                sys.stdout.write("unable to trash chunk fileid=%s: %s\n" % (fileid, getattr(e, 'reason', str(e))))
+        self.index.remove([digest for fileid, digest in zip(unused, digests) if fileid in trashed])
+        trashed = set(trashed)
+        return len([fileid for fileid in unused if fileid in trashed]), len([fileid for fileid in duplicates if fileid in trashed])
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
+    def __str__(self):
+        return "chunk store %d chunks (%.1f MiB), %d duplicates, %d uploaded (%.1f MiB)" % (self.chunks, self.nbytes / (1024.0*1024.0),
+                                                                                            self.duplicates, self.uploaded,
+                                                                                            self.storedbytes / (1024.0*1024.0))
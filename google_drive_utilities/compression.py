@@ -0,0 +1,349 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import os
+import time
+import gzip
+import zlib
+import struct
+import concurrent.futures as concurrentfutures
+from collections import deque
+from lazy_import import lazy_import
+# zstandard is only needed by the zstd codec, so it is an optional dependency
+zstandard = lazy_import('zstandard')
+
+CODECS = ('gzip', 'zstd')
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+
+# already compressed formats, deflating them again gains next to nothing
+INCOMPRESSIBLE_EXTENSIONS = frozenset((
+    'jpg', 'jpeg', 'png', 'gif', 'webp', 'heic', 'heif', 'avif', 'jxl',
+    'mp3', 'm4a', 'aac', 'ogg', 'oga', 'opus', 'flac', 'wma',
+    'mp4', 'm4v', 'mov', 'mkv', 'webm', 'avi', 'wmv', 'flv', '3gp',
+    'zip', 'gz', 'tgz', 'bz2', 'tbz2', 'xz', 'txz', 'zst', 'lz4', '7z', 'rar', 'cab',
+    'jar', 'apk', 'whl', 'deb', 'rpm', 'dmg', 'docx', 'xlsx', 'pptx', 'odt', 'ods', 'odp', 'epub'))
+# (offset, signature) of the same formats, for files without a telling extension
+INCOMPRESSIBLE_MAGIC = (
+    (0, b'\xff\xd8\xff'),            # jpeg
+    (0, b'\x89PNG\r\n\x1a\n'),       # png
+    (0, b'GIF8'),                     # gif
+    (0, b'\x1f\x8b'),                 # gzip
+    (0, b'PK\x03\x04'),               # zip and the formats built on it
+    (0, b'BZh'),                      # bzip2
+    (0, b'\xfd7zXZ\x00'),             # xz
+    (0, b'\x28\xb5\x2f\xfd'),         # zstd
+    (0, b'7z\xbc\xaf\x27\x1c'),       # 7z
+    (0, b'Rar!\x1a\x07'),             # rar
+    (0, b'ID3'),                      # mp3
+    (0, b'OggS'),                     # ogg
+    (0, b'fLaC'),                     # flac
+    (0, b'\x1a\x45\xdf\xa3'),         # matroska and webm
+    (4, b'ftyp'),                     # mp4, mov, heic
+)
+
+class CompressionException(Exception):
+    '''Generic exception to raise compression errors.'''
+    def __init__(self, msg):
+        super(CompressionException).__init__(type(self))
+        self.msg = "E: %s" % msg
+    def __str__(self):
+        return self.msg
+    def __unicode__(self):
+        return self.msg
+
+class ParallelGzipWriter(object):
+    '''
+    Writes one gzip member the way pigz does: the input is cut into blocks that
+    are deflated on a pool of threads, each primed with the 32 KiB before it as
+    its dictionary and ended with a sync flush so the blocks join up into a single
+    deflate stream. zlib lets go of the GIL while it compresses, so the blocks
+    really are compressed in parallel, and anything that reads gzip reads the result.
+    '''
+    # gzip header without a name and with mtime 0, the same as GzipFile(filename='', mtime=0)
+    header = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x00\xff'
+
+    def __init__(self, fileobj, compresslevel=6, jobs=None, blocksize=1024*1024):
+        '''
+        Constructor
+        fileobj: where the gzip stream goes, it only needs a write method
+        jobs: threads compressing, defaults to the number of cpus
+        '''
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.jobs = jobs
+        self.blocksize = blocksize
+        self.executor = concurrentfutures.ThreadPoolExecutor(max_workers=jobs)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.dictionary = b''
+        self.level = compresslevel
+        self.crc = 0
+        self.size = 0
+        self.written = len(self.header)
+        self.closed = False
+        self.fileobj.write(self.header)
+
+    def compress_block(self, block, level, dictionary):
+        if len(dictionary) > 0 and level > 0:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL,
+                                          zlib.Z_DEFAULT_STRATEGY, dictionary)
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        return compressor.compress(block) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def output(self, data):
+        self.fileobj.write(data)
+        self.written = self.written + len(data)
+
+    def submit(self, block):
+        self.crc = zlib.crc32(block, self.crc)
+        self.size = self.size + len(block)
+        self.pending.append(self.executor.submit(self.compress_block, block, self.level, self.dictionary))
+        self.dictionary = block[-32768:]
+        # keep every thread busy but only a couple of blocks per thread in memory
+        while len(self.pending) > 2 * self.jobs:
+            self.output(self.pending.popleft().result())
+
+    def set_level(self, level):
+        """compress what is written from now on at level, 0 stores it as is. The
+        data buffered so far is cut off into a block at the level it was written at.
+        """
+        if level == self.level:
+            return
+        if len(self.buffer) > 0:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        self.level = level
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError("write to a closed ParallelGzipWriter")
+        self.buffer.extend(data)
+        while len(self.buffer) >= self.blocksize:
+            block = bytes(self.buffer[:self.blocksize])
+            del self.buffer[:self.blocksize]
+            self.submit(block)
+        return len(data)
+
+    def close(self):
+        """finish the gzip member, fileobj is left open"""
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            if len(self.buffer) > 0:
+                self.submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.output(self.pending.popleft().result())
+            # an empty final block ends the deflate stream
+            self.output(zlib.compressobj(self.compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS).flush())
+            self.output(struct.pack('<II', self.crc & 0xffffffff, self.size & 0xffffffff))
+        finally:
+            self.executor.shutdown(wait=True)
+
+class CompressibilityProbe(object):
+    '''
+    Decides which files are worth compressing. Files of at least minsize are
+    stored as is when their extension or their first bytes say they are already
+    compressed, or when deflating a sample of them at compresslevel doesn't
+    shrink it below threshold. It keeps count of what it decided and estimates
+    the compression time skipped from what the samples took, so each archive
+    can report what it saved.
+    '''
+    def __init__(self, compresslevel=6, minsize=256*1024, samplesize=64*1024, threshold=0.95):
+        '''
+        Constructor
+        threshold: compressed/original size of the samples above which a file is stored
+        '''
+        self.compresslevel = compresslevel
+        self.minsize = minsize
+        self.samplesize = samplesize
+        self.threshold = threshold
+        self.files = 0
+        self.nbytes = 0
+        # reason -> number of files stored as is
+        self.reasons = {}
+        self.storedfiles = 0
+        self.storedbytes = 0
+        # bytes compressing the sampled files that were stored would have saved
+        self.lostbytes = 0
+        self.sampledbytes = 0
+        self.sampleseconds = 0.0
+        self.probeseconds = 0.0
+        # bytes into and out of the compressor, set when the archive is finished
+        self.insize = 0
+        self.outsize = 0
+
+    def sample(self, data):
+        """returns:
+            compressed/original size of data at compresslevel
+        """
+        started = time.perf_counter()
+        compressed = zlib.compress(data, self.compresslevel)
+        self.sampleseconds = self.sampleseconds + time.perf_counter() - started
+        self.sampledbytes = self.sampledbytes + len(data)
+        return len(compressed) / len(data)
+
+    def reason(self, path, size):
+        """returns:
+            why the file at path should be stored as is or None if it should be compressed
+        """
+        if size < self.minsize:
+            # too small to be worth switching the compression level for
+            return None
+        if os.path.splitext(path)[1][1:].lower() in INCOMPRESSIBLE_EXTENSIONS:
+            return 'extension'
+        with open(path, 'rb') as f:
+            head = f.read(self.samplesize)
+            for offset, signature in INCOMPRESSIBLE_MAGIC:
+                if head[offset:offset + len(signature)] == signature:
+                    return 'magic'
+            # the start of a file is often a header, so sample the middle as well
+            f.seek(size // 2)
+            middle = f.read(self.samplesize)
+        ratio = self.sample(head + middle)
+        if ratio < self.threshold:
+            return None
+        self.lostbytes = self.lostbytes + int(size * max(0.0, 1.0 - ratio))
+        return 'sample'
+
+    def check(self, path, size):
+        """returns:
+            True if the file at path should be compressed
+        """
+        started = time.perf_counter()
+        try:
+            reason = self.reason(path, size)
+        except OSError:
+            # let the archiver find out it can't be read
+            reason = None
+        self.probeseconds = self.probeseconds + time.perf_counter() - started
+        self.files = self.files + 1
+        self.nbytes = self.nbytes + size
+        if reason is None:
+            return True
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        self.storedfiles = self.storedfiles + 1
+        self.storedbytes = self.storedbytes + size
+        return False
+
+    def seconds_saved(self):
+        """returns:
+            estimate of the compression time skipped by storing files as is, less the
+            time spent probing
+        """
+        if self.storedbytes == 0:
+            return -self.probeseconds
+        if self.sampledbytes == 0:
+            # nothing sampled yet, time compressing incompressible data once
+            self.sample(os.urandom(self.samplesize))
+        return self.storedbytes * self.sampleseconds / self.sampledbytes - self.probeseconds
+
+    def ratio(self):
+        if self.insize == 0:
+            return 1.0
+        return self.outsize / self.insize
+
+    def __str__(self):
+        reasons = ', '.join("%d by %s" % (count, reason) for reason, count in sorted(self.reasons.items()))
+        return ("stored %d of %d files as is (%.1f of %.1f MiB%s), archive ratio %.3f, saved about %.2fs of compression"
+                " for about %.1f MiB" % (self.storedfiles, self.files, self.storedbytes/1024/1024, self.nbytes/1024/1024,
+                                        ": " + reasons if reasons else "", self.ratio(), self.seconds_saved(),
+                                        self.lostbytes/1024/1024))
+
+def default_level(codec):
+    return DEFAULT_LEVELS.get(codec, 6)
+
+def check_codec(codec):
+    """raise CompressionException if codec is unknown or its package isn't installed"""
+    if codec not in CODECS:
+        raise CompressionException("unknown compression codec %s, use one of %s" % (codec, ', '.join(CODECS)))
+    if codec == 'zstd':
+        try:
+            zstandard.ZstdCompressor
+        except ImportError:
+            raise CompressionException("the zstd codec needs the zstandard package, pip install zstandard")
+
+def compress_writer(fileobj, codec='gzip', compresslevel=None, jobs=1):
+    """returns:
+        a writer compressing everything written to it into fileobj, closing it
+        finishes the compressed stream but leaves fileobj open. With jobs > 1 the
+        compression is spread over that many cores.
+    """
+    if compresslevel is None:
+        compresslevel = default_level(codec)
+    if codec == 'gzip':
+        if jobs == 1:
+            return gzip.GzipFile(filename='', mode='wb', fileobj=fileobj, compresslevel=compresslevel, mtime=0)
+        return ParallelGzipWriter(fileobj, compresslevel=compresslevel, jobs=jobs)
+    if codec == 'zstd':
+        try:
+            compressor = zstandard.ZstdCompressor(level=compresslevel, threads=jobs if jobs > 1 else 0, write_checksum=True)
+        except ImportError:
+            raise CompressionException("the zstd codec needs the zstandard package, pip install zstandard")
+        return compressor.stream_writer(fileobj, closefd=False)
+    raise CompressionException("unknown compression codec %s, use one of %s" % (codec, ', '.join(CODECS)))
+
+def decompress_reader(fileobj, codec='gzip'):
+    """returns:
+        a reader of the decompressed contents of fileobj, which only needs a read method
+    """
+    if codec == 'gzip':
+        return gzip.GzipFile(fileobj=fileobj, mode='rb')
+    if codec == 'zstd':
+        try:
+            return zstandard.ZstdDecompressor().stream_reader(fileobj, closefd=False)
+        except ImportError:
+            raise CompressionException("the zstd codec needs the zstandard package, pip install zstandard")
+    raise CompressionException("unknown compression codec %s, use one of %s" % (codec, ', '.join(CODECS)))
+
+class Decompressor(object):
+    '''
+    Incremental decompressor: decompress takes successive pieces of a compressed
+    stream and returns the data decompressed from them so far. gzip carries on
+    into the next member, since gzip readers treat concatenated members as one
+    stream. Corrupt data raises CompressionException whatever the codec.
+    '''
+    def __init__(self, codec='gzip'):
+        self.codec = codec
+        self.expander = self.start()
+
+    def start(self):
+        if self.codec == 'gzip':
+            return zlib.decompressobj(16 + zlib.MAX_WBITS)
+        if self.codec == 'zstd':
+            try:
+                return zstandard.ZstdDecompressor().decompressobj()
+            except ImportError:
+                raise CompressionException("the zstd codec needs the zstandard package, pip install zstandard")
+        raise CompressionException("unknown compression codec %s, use one of %s" % (self.codec, ', '.join(CODECS)))
+
+    def decompress(self, data):
+        parts = []
+        try:
+            while data:
+                parts.append(self.expander.decompress(data))
+                if self.codec != 'gzip' or not self.expander.eof:
+                    break
+                data = self.expander.unused_data
+                self.expander = self.start()
+        except Exception as e:
+            # only look for zstandard's error when it is the codec, it may not be installed
+            if isinstance(e, zlib.error) or (self.codec == 'zstd' and isinstance(e, zstandard.ZstdError)):
+                raise CompressionException("corrupt %s data: %s" % (self.codec, str(e)))
+            raise
+        return b''.join(parts)
+
+def decompressed_name(name):
+    """returns:
+        the name of the decompressed file: archive.tgz -> archive.tar, file.gz -> file
+    """
+    for extension, replacement in (('.tgz', '.tar'), ('.gz', ''), ('.zst', '')):
+        if name.endswith(extension) and len(name) > len(extension):
+            return name[:-len(extension)] + replacement
+    return name + '.out'
@@ -0,0 +1,165 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import os
+import sys
+import locale
+import fnmatch
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+def collation_key(path):
+    """sort key that orders paths the way coreutils sort does in the current LC_COLLATE locale"""
+    try:
+        return (0, locale.strxfrm(path))
+    except (UnicodeError, ValueError):
+        return (1, path)
+
+def md5sum_line(digest, path):
+    """format a line the way md5sum prints it, escaping backslashes and newlines in the name"""
+    if '\\' in path or '\n' in path:
+        return "\\%s  %s\n" % (digest, path.replace('\\', '\\\\').replace('\n', '\\n'))
+    return "%s  %s\n" % (digest, path)
+
+class DirectoryHasher(object):
+    '''
+    In process replacement for
+        find -L directory -not -path "exclude/*" -type f | sort | xargs -n 1 md5sum | md5sum
+    xargs splits the names it reads on whitespace and treats quotes and backslashes
+    specially, so the pipeline never hashed such names as they are. Only directories
+    whose paths have no whitespace, quote or backslash characters give the checksum
+    the pipeline gave.
+    '''
+    def __init__(self, excludefolders=None, jobs=None, sortkey=None, buffersize=1024*1024, cache=None, verbose=False):
+        '''
+        Constructor
+        excludefolders: paths whose contents are skipped (find -not -path "<path>/*")
+        jobs: number of threads reading files, defaults to twice the number of cpus
+        sortkey: key used to order the paths, collation_key matches sort(1)
+        cache: optional HashCache, only files whose stat metadata changed are re-read
+        '''
+        self.patterns = []
+        if excludefolders is not None:
+            self.patterns = ["%s/*" % excludefolder for excludefolder in excludefolders]
+        if jobs is None:
+            jobs = min(32, 2 * (os.cpu_count() or 1))
+        self.jobs = jobs
+        self.sortkey = sortkey
+        self.buffersize = buffersize
+        self.cache = cache
+        self.verbose = verbose
+
+    def is_excluded(self, path):
+        for pattern in self.patterns:
+            # find -path patterns let * match /
+            if fnmatch.fnmatchcase(path, pattern):
+                return True
+        return False
+
+    def iter_files(self, directory):
+        """walk directory following symbolic links, the way find -L -type f does
+        yields:
+            (path, stat result) for every regular file that isn't excluded
+        """
+        # (device, inode) of the directories being walked, to spot symbolic link loops
+        stack = [(directory, frozenset())]
+        while stack:
+            dirpath, ancestors = stack.pop()
+            try:
+                st = os.stat(dirpath)
+                key = (st.st_dev, st.st_ino)
+                if key in ancestors:
+                    if self.verbose:
+                        sys.stderr.write("file system loop detected at %s\n" % dirpath)
+                    continue
+                ancestors = ancestors | {key}
+                with os.scandir(dirpath) as entries:
+                    entries = list(entries)
+            except OSError as e:
+                if self.verbose:
+                    sys.stderr.write("unable to read directory %s: %s\n" % (dirpath, e.strerror))
+                continue
+            for entry in entries:
+                path = os.path.join(dirpath, entry.name)
+                try:
+                    if entry.is_dir(follow_symlinks=True):
+                        # nothing below an excluded directory can match, so don't descend into it
+                        if not self.is_excluded(path + '/'):
+                            stack.append((path, ancestors))
+                    elif entry.is_file(follow_symlinks=True):
+                        if not self.is_excluded(path):
+                            yield path, entry.stat(follow_symlinks=True)
+                except OSError:
+                    # broken symbolic links aren't regular files
+                    continue
+
+    def hash_file(self, path):
+        """returns:
+            hex md5 digest of the file at path or None if it can't be read
+        """
+        try:
+            with open(path, 'rb') as f:
+                if hasattr(hashlib, 'file_digest'):
+                    return hashlib.file_digest(f, 'md5').hexdigest()
+                digest = hashlib.md5()
+                data = f.read(self.buffersize)
+                while data:
+                    digest.update(data)
+                    data = f.read(self.buffersize)
+                return digest.hexdigest()
+        except OSError as e:
+            if self.verbose:
+                sys.stderr.write("md5sum: %s: %s\n" % (path, e.strerror))
+            return None
+
+    def hash_files(self, paths):
+        """hash paths from a pool of threads
+        returns:
+            dictionary of path -> hex digest, paths that can't be read are left out
+        """
+        digests = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            for path, digest in zip(paths, executor.map(self.hash_file, paths)):
+                if digest is not None:
+                    digests[path] = digest
+        return digests
+
+    def hash_directory(self, directory):
+        """returns:
+            aggregate checksum (formatted like md5sum of stdin: '<hex>  -') and
+            the md5sum listing of every file it covers
+        """
+        return self.summarize(self.digest_directory(directory))
+
+    def digest_directory(self, directory):
+        """returns:
+            dictionary of path -> hex digest of every file hash_directory covers
+        """
+        files = list(self.iter_files(directory))
+        if self.cache is None:
+            return self.hash_files([path for path, st in files])
+        cached = self.cache.load(directory)
+        digests = {}
+        changed = []
+        for path, st in files:
+            digest = self.cache.lookup(cached, path, st)
+            if digest is None:
+                changed.append((path, st))
+            else:
+                digests[path] = digest
+        hashed = self.hash_files([path for path, st in changed])
+        digests.update(hashed)
+        self.cache.update(directory, [(path, st, hashed[path]) for path, st in changed if path in hashed],
+                          [path for path, st in files])
+        return digests
+
+    def summarize(self, digests):
+        """returns:
+            aggregate checksum and md5sum listing of a path -> digest dictionary
+        """
+        paths = sorted(digests, key=self.sortkey)
+        lines = ''.join(md5sum_line(digests[path], path) for path in paths)
+        checksum = hashlib.md5(os.fsencode(lines)).hexdigest()
+        return "%s  -" % checksum, lines
@@ -8,13 +8,44 @@ import sys
 import os
 import io
 import re
-from google.auth.transport.requests import Request
-from google.auth.exceptions import RefreshError
-from google.oauth2.credentials import Credentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload, MediaFileUpload
-from googleapiclient.errors import HttpError
-from pickle import NONE
+import json
+import time
+import uuid
+import mimetypes
+import random
+import ssl
+import socket
+import hashlib
+import threading
+import concurrent.futures as concurrentfutures
+from email import utils as emailutils
+from collections import OrderedDict
+from datetime import timezone
+from urllib.parse import urljoin
+from lazy_import import lazy_import
+from http_pool import PooledHttp
+from upload_journal import UploadJournal
+from adaptive_chunk import transfer_chunker
+from instrumentation import ApiCall
+from compression import Decompressor, decompress_reader, decompressed_name, CompressionException
+# the google client libraries take a long time to import, only load them when they are used
+authrequests = lazy_import('google.auth.transport.requests')
+autherrors = lazy_import('google.auth.exceptions')
+oauth2credentials = lazy_import('google.oauth2.credentials')
+discovery = lazy_import('googleapiclient.discovery')
+apierrors = lazy_import('googleapiclient.errors')
+authhttplib2 = lazy_import('google_auth_httplib2')
+httplib2 = lazy_import('httplib2')
+
+def client_version():
+    """version of the installed google api client"""
+    try:
+        from googleapiclient.version import __version__
+        return __version__
+    except ImportError:
+        # older clients kept the version in the package itself
+        import googleapiclient
+        return getattr(googleapiclient, '__version__', 'unknown')
 
 class GoogleDriveException(Exception):
     '''Generic exception to raise GoogleDrive errors.'''
@@ -26,34 +57,299 @@ class GoogleDriveException(Exception):
     def __unicode__(self):
         return self.msg
 
+class PathCache(object):
+    '''
+    Size bounded LRU cache of resolved folder paths with a time to live.
+    Keeps hit/miss counters so the savings can be logged.
+    '''
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses = self.misses + 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits = self.hits + 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+                self.evictions = self.evictions + 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self.entries)}
+
+    def __str__(self):
+        return "path cache hits=%(hits)d misses=%(misses)d evictions=%(evictions)d size=%(size)d" % self.stats()
+
+class StreamReader(object):
+    '''
+    Reads exact byte counts from a file object or from an iterator of bytes.
+    '''
+    def __init__(self, stream):
+        if hasattr(stream, 'read'):
+            self.stream = stream
+            self.iterator = None
+        else:
+            self.stream = None
+            self.iterator = iter(stream)
+        self.buffer = b''
+
+    def read(self, size):
+        """Returns size bytes, or fewer only when the stream is exhausted"""
+        parts = [self.buffer]
+        have = len(self.buffer)
+        while have < size:
+            if self.stream is not None:
+                data = self.stream.read(size - have)
+                if not data:
+                    break
+            else:
+                data = next(self.iterator, None)
+                if data is None:
+                    break
+            parts.append(data)
+            have = have + len(data)
+        data = b''.join(parts)
+        self.buffer = data[size:]
+        return data[:size]
+
+class ByteBudget(object):
+    '''
+    Limits the number of bytes in flight across threads. A single request
+    larger than the whole budget is let through on its own.
+    '''
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, nbytes):
+        nbytes = min(nbytes, self.limit)
+        with self.condition:
+            while self.used > 0 and self.used + nbytes > self.limit:
+                self.condition.wait()
+            self.used = self.used + nbytes
+        return nbytes
+
+    def release(self, nbytes):
+        with self.condition:
+            self.used = self.used - nbytes
+            self.condition.notify_all()
+
 class GoogleDrive(object):
     '''
     classdocs
     '''
-    service = None
     verbose = False
+    # cached discovery documents older than this many seconds are fetched again
+    discoverymaxage = 7*24*60*60
+    # the Drive batch endpoint accepts at most 100 calls per request
+    batchsize = 100
     settingsfile = ''
     settings = {}
     database_secrets = {}
 
-    def __init__(self, keyfile=None, tokenfile=None, scopes=None, verbose=False):
+    def __init__(self, keyfile=None, tokenfile=None, scopes=None, verbose=False, usefolderindex=True,
+                 pathcachesize=10000, pathcachettl=300, retries=6, backoff=1.0, maxbackoff=64.0, ratelimiter=None,
+                 lazy=True, http=None, poolsize=10, timeout=120, resumeuploads=True, chunkseconds=4.0, maxchunk=256,
+                 hooks=None):
         '''
         Constructor
+        usefolderindex: load every folder (id -> name, parent id) in a few paged
+        list calls the first time a path has to be resolved, so that get_path
+        doesn't need an API call per ancestor folder.
+        pathcachesize, pathcachettl: bounds of the memo of resolved folder paths
+        shared by every get_path call on this instance. The folder index is
+        reloaded once it is older than pathcachettl as well.
+        retries, backoff, maxbackoff: every API call is retried up to retries times
+        on rate limit, server and connection errors, waiting a random (full jitter)
+        time of up to backoff * 2**attempt seconds, capped at maxbackoff, or as long
+        as the server asks for in Retry-After.
+        ratelimiter: optional rate_limit.RateLimiter every API call (and the bytes
+        it transfers) has to get past first, it may be shared with other instances.
+        lazy: build the service and look up the root folder the first time they are
+        needed instead of in the constructor.
+        http: transport used by every API call from every thread, e.g. an
+        http_pool.PooledHttp shared with other instances.
+        poolsize, timeout: without http, build a PooledHttp keeping up to poolsize
+        keep-alive connections open with a timeout seconds read timeout. poolsize=0
+        goes back to a separate httplib2 transport per thread.
+        resumeuploads: journal the resumable sessions of file uploads next to the
+        token file, so uploading the same unchanged file again after the process
+        died continues from what the server already has.
+        chunkseconds, maxchunk: transfers start with the chunk size they are given
+        and then size every chunk to take about chunkseconds, up to maxchunk MiB,
+        using smaller chunks after errors. chunkseconds=None keeps the size fixed.
+        hooks: callables that are passed an instrumentation.ApiCall (method, latency,
+        bytes, retries and status) after every API call, e.g. an
+        instrumentation.Metrics. More can be added with add_hook.
         '''
         super(GoogleDrive).__init__(type(self))
+        self._service = None
+        self._root = None
+        self.setuplock = threading.RLock()
         self.keyfile = keyfile
         self.tokenfile = tokenfile
         self.scopes = scopes
         self.verbose = verbose
-        self.root = None
-        if self.keyfile is not None and self.tokenfile is not None and self.scopes is not None:
+        self.credentials = None
+        self.http = http
+        self.poolsize = poolsize
+        self.timeout = timeout
+        # httplib2 isn't thread safe, so without a pooled transport threads other
+        # than the one that built the service each get their own authorized transport
+        self.servicethread = None
+        self.threadlocal = threading.local()
+        self.namelock = threading.Lock()
+        self.usefolderindex = usefolderindex
+        # folder id -> (name, first parent id)
+        self.folderindex = {}
+        self.folderindexloaded = False
+        # time.monotonic() the folder index was last loaded (or emptied), None if never
+        self.folderindextime = None
+        self.folderindexttl = pathcachettl
+        self.folderindexlock = threading.Lock()
+        self.pathcache = PathCache(maxsize=pathcachesize, ttl=pathcachettl)
+        self.retries = retries
+        self.backoff = backoff
+        self.maxbackoff = maxbackoff
+        # reason -> number of retries, plus 'retries' and 'giveups' totals
+        self.retrycounts = {'retries': 0, 'giveups': 0}
+        self.retrylock = threading.Lock()
+        self.ratelimiter = ratelimiter
+        self.hooks = list(hooks or [])
+        self.chunkseconds = chunkseconds
+        self.maxchunk = maxchunk
+        self.journal = None
+        if resumeuploads and self.tokenfile is not None:
+            self.journal = UploadJournal(self.cache_file('uploads.json'))
+        if self.configured() and not lazy:
             self.setup()
         return None
 
+    def configured(self):
+        return self.keyfile is not None and self.tokenfile is not None and self.scopes is not None
+
+    @property
+    def service(self):
+        """The Drive service, built on first use"""
+        if self._service is None and self.configured():
+            with self.setuplock:
+                if self._service is None:
+                    self.get_service(self.keyfile, self.tokenfile, self.scopes, verbose=self.verbose)
+        return self._service
+
+    @service.setter
+    def service(self, service):
+        self._service = service
+
+    @property
+    def root(self):
+        """The root folder resource, looked up on first use"""
+        if self._root is None and self.service is not None:
+            with self.setuplock:
+                if self._root is None:
+                    self._root = self.load_root(verbose=self.verbose)
+        return self._root
+
+    @root.setter
+    def root(self, root):
+        self._root = root
+
     def setup(self):
         self.get_service(self.keyfile, self.tokenfile, self.scopes, verbose=self.verbose)
-        self.root = self.get_root(verbose=self.verbose)
+        self.root = self.load_root(verbose=self.verbose)
         return self.service
+
+    def cache_file(self, name):
+        """Path of a cache file kept next to the token file, None without a token file"""
+        if self.tokenfile is None:
+            return None
+        return "%s.%s" % (self.tokenfile, name)
+
+    def write_cache_file(self, name, contents):
+        cachefile = self.cache_file(name)
+        if cachefile is None:
+            return
+        try:
+            # write then rename so concurrent runs never read half a file
+            tmpfile = "%s.%d" % (cachefile, os.getpid())
+            with open(tmpfile, 'w') as f:
+                json.dump(contents, f)
+            os.replace(tmpfile, cachefile)
+        except OSError:
+            pass
+
+    def read_cache_file(self, name):
+        cachefile = self.cache_file(name)
+        if cachefile is None:
+            return None
+        try:
+            with open(cachefile) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def load_root(self, verbose=False):
+        """Get the root folder, from the cache next to the token file if it is there
+        Returns:
+            root folder resource (at least its id)
+        """
+        rootdir = self.read_cache_file('root.json')
+        if rootdir is not None and rootdir.get('id') is not None:
+            return rootdir
+        rootdir = self.get_root(verbose=verbose)
+        self.write_cache_file('root.json', {'id': rootdir.get('id'), 'name': rootdir.get('name')})
+        return rootdir
+
+    def build_service(self, credentials, http=None, verbose=False):
+        """Build the drive v3 service from the discovery document cached next to the
+        token file, fetching and caching it if it's missing, stale or was cached by a
+        different version of the API client. With http the service sends its requests
+        through it, otherwise through an httplib2 transport authorized with credentials
+        Returns:
+            the service
+        """
+        if http is not None:
+            # build() takes either an authorized transport or credentials, not both
+            credentials = None
+        cached = self.read_cache_file('discovery.json')
+        if cached is not None and cached.get('clientversion') == client_version() and \
+                time.time() - cached.get('fetched', 0) < self.discoverymaxage:
+            try:
+                return discovery.build_from_document(cached.get('document'), credentials=credentials, http=http)
+            except Exception as e:
+                if verbose:
+                    sys.stdout.write("ignoring unusable cached discovery document: %s\n" % str(e))
+        service = discovery.build(serviceName="drive", version="v3", credentials=credentials,
+                        http=http, cache_discovery=False)
+        self.write_cache_file('discovery.json', {'clientversion': client_version(),
+                                                 'fetched': time.time(),
+                                                 'document': service._rootDesc})
+        return service
     
     def get_service(self, keyfile, tokenfile, scopes, verbose=False):
         """Get a service that commelse:
@@ -70,15 +366,15 @@ class GoogleDrive(object):
         try:
             credentials = None
             if os.path.exists(tokenfile):
-                credentials = Credentials.from_authorized_user_file(tokenfile, scopes)
+                credentials = oauth2credentials.Credentials.from_authorized_user_file(tokenfile, scopes)
             # If there are no (valid) credentials available, let the user log in.
             if not credentials or not credentials.valid:
                 if credentials and credentials.expired and credentials.refresh_token:
                     try:
-                        credentials.refresh(Request())
+                        credentials.refresh(authrequests.Request())
                         if verbose:
                             sys.stdout.write("Credentials refreshed!\n")
-                    except RefreshError as e:
+                    except autherrors.RefreshError as e:
                         msg = "Unable to refresh token '%s'\n run get_auth_token.pl script to generate one" % e.args[0]
                         if verbose:
                             sys.stderr(msg + "\n")
@@ -92,19 +388,235 @@ class GoogleDrive(object):
         # Build the service object for use with any API
         if verbose:
             sys.stdout.write("Acquiring service...\n")
-        self.service = build(serviceName="drive", version="v3", credentials=credentials,
-                                  cache_discovery=False)
+        self.credentials = credentials
+        if self.http is None and self.poolsize > 0:
+            self.http = PooledHttp(credentials, poolsize=self.poolsize, timeout=self.timeout)
+        self.service = self.build_service(credentials, http=self.http, verbose=verbose)
+        self.servicethread = threading.get_ident()
 
         if verbose:
             sys.stdout.write("Service acquired!\n")
         return self.service
 
+    def get_http(self):
+        """Get the transport to use from the calling thread
+        Returns:
+            the shared pooled transport if there is one, None in the thread that
+            built the service (use the service's own transport) else an authorized
+            transport private to this thread
+        """
+        if self.http is not None:
+            return self.http
+        if threading.get_ident() == self.servicethread:
+            return None
+        http = getattr(self.threadlocal, 'http', None)
+        if http is None:
+            http = authhttplib2.AuthorizedHttp(self.credentials, http=httplib2.Http(timeout=self.timeout))
+            self.threadlocal.http = http
+        return http
+
+    # reasons Drive gives with a 403 when the request should be slowed down and retried
+    ratelimitreasons = ('userRateLimitExceeded', 'rateLimitExceeded', 'backendError', 'sharingRateLimitExceeded')
+    # the rate limit reasons that mean the request was turned away without being carried out
+    rejectedreasons = ('userRateLimitExceeded', 'rateLimitExceeded', 'sharingRateLimitExceeded')
+    # methods that make something new each time they are carried out
+    nonidempotent = ('drive.files.create', 'drive.files.copy')
+
+    def retry_reason(self, e, idempotent=True):
+        """Classifies an exception raised by an API call
+        idempotent: False if carrying the call out twice does harm, e.g. creates a
+        second file. Only errors showing the call wasn't carried out are retried then,
+        a 5xx or a lost connection may come after Drive did it.
+        Returns:
+            a short reason string if the call should be retried else None
+        """
+        if isinstance(e, apierrors.HttpError):
+            status = e.resp.status
+            if status == 429 or (idempotent and status in (500, 502, 503, 504)):
+                return str(status)
+            if status == 403:
+                for reason in (self.ratelimitreasons if idempotent else self.rejectedreasons):
+                    if reason.encode() in e.content:
+                        return reason
+            return None
+        if isinstance(e, (ConnectionRefusedError, httplib2.ServerNotFoundError)):
+            # never got to Drive
+            return type(e).__name__
+        if idempotent and isinstance(e, (socket.timeout, ConnectionError, ssl.SSLError, httplib2.HttpLib2Error)):
+            return type(e).__name__
+        return None
+
+    def retry_delay(self, attempt, e=None):
+        """Seconds to wait before retry number attempt (starting at 0)"""
+        delay = random.uniform(0, min(self.maxbackoff, self.backoff * (2 ** attempt)))
+        resp = getattr(e, 'resp', None)
+        if resp is not None and resp.get('retry-after') is not None:
+            retryafter = resp.get('retry-after')
+            try:
+                delay = max(delay, float(retryafter))
+            except ValueError:
+                # a date that doesn't parse (some proxies send garbage) leaves the backoff delay
+                try:
+                    when = emailutils.parsedate_to_datetime(retryafter)
+                except (TypeError, ValueError):
+                    when = None
+                if when is not None:
+                    if when.tzinfo is None:
+                        # timestamp() takes a naive datetime to be local time, HTTP dates are UTC
+                        when = when.replace(tzinfo=timezone.utc)
+                    delay = max(delay, when.timestamp() - time.time())
+        return delay
+
+    def count_retry(self, reason):
+        with self.retrylock:
+            self.retrycounts['retries'] = self.retrycounts['retries'] + 1
+            self.retrycounts[reason] = self.retrycounts.get(reason, 0) + 1
+
+    def throttle(self, requests=1, nbytes=0):
+        """Waits until the rate limiter lets requests API calls transferring nbytes through"""
+        if self.ratelimiter is not None:
+            self.ratelimiter.acquire(requests=requests, nbytes=nbytes)
+
+    def call_with_retry(self, function, description='', requests=1, nbytes=0, idempotent=True):
+        """Calls function, retrying it with exponential backoff and jitter while
+        it raises retryable errors. Every attempt counts as requests API calls
+        transferring nbytes against the rate limiter.
+        idempotent: False if calling function twice does harm, see retry_reason
+        Returns:
+            whatever function returns
+        """
+        attempt = 0
+        waited = 0.0
+        started = time.time()
+        self.threadlocal.transferred = None
+        while True:
+            self.throttle(requests=requests, nbytes=nbytes)
+            try:
+                result = function()
+            except Exception as e:
+                try:
+                    waited = waited + self.wait_to_retry(e, attempt, description, idempotent=idempotent)
+                except Exception:
+                    self.record_call(description, started, waited, requests, nbytes, attempt, e)
+                    raise
+                attempt = attempt + 1
+                continue
+            self.record_call(description, started, waited, requests, nbytes, attempt)
+            return result
+
+    def transferred(self, nbytes):
+        """Called from inside a function given to call_with_retry with the number of
+        bytes it really moved, when that isn't the nbytes it was called with"""
+        self.threadlocal.transferred = nbytes
+
+    def add_hook(self, hook):
+        """hook will be passed an instrumentation.ApiCall after every API call"""
+        self.hooks.append(hook)
+
+    def record_call(self, description, started, waited, requests, nbytes, retries, e=None):
+        """Tells the hooks about an API call that started at started and failed with e
+        unless it's None"""
+        if not self.hooks:
+            return
+        transferred = getattr(self.threadlocal, 'transferred', None)
+        if transferred is not None:
+            nbytes = transferred
+        status = 'ok'
+        if e is not None:
+            resp = getattr(e, 'resp', None)
+            status = str(getattr(resp, 'status', None) or type(e).__name__)
+        call = ApiCall(description.split(' ', 1)[0] or 'call', description, started, time.time() - started,
+                       waited=waited, requests=requests, nbytes=nbytes, retries=retries, status=status)
+        for hook in list(self.hooks):
+            try:
+                hook(call)
+            except Exception as e:
+                # a broken hook mustn't break the call it is measuring
+                if self.verbose:
+                    sys.stdout.write("instrumentation hook failed: %s\n" % str(e))
+
+    def wait_to_retry(self, e, attempt, description='', idempotent=True):
+        """Sleeps before retry number attempt (starting at 0) after the exception e,
+        or raises e again if it isn't transient or we are out of retries
+        Returns:
+            the seconds slept
+        """
+        reason = self.retry_reason(e, idempotent=idempotent)
+        if reason is None:
+            raise e
+        if attempt >= self.retries:
+            with self.retrylock:
+                self.retrycounts['giveups'] = self.retrycounts['giveups'] + 1
+            raise e
+        delay = self.retry_delay(attempt, e)
+        self.count_retry(reason)
+        if self.verbose:
+            sys.stdout.write("%s failed (%s), retry %d of %d in %.1f seconds\n" % (description, reason, attempt + 1, self.retries, delay))
+        time.sleep(delay)
+        return delay
+
+    def execute_request(self, request, idempotent=None):
+        """Executes an API request on the transport belonging to the calling thread,
+        retrying it on transient errors
+        idempotent: whether carrying the request out twice is harmless, by default
+        everything but creates and copies are
+        Returns:
+            the decoded response
+        """
+        methodid = getattr(request, 'methodId', '')
+        if idempotent is None:
+            idempotent = methodid not in self.nonidempotent
+        return self.call_with_retry(lambda: request.execute(http=self.get_http()), methodid, idempotent=idempotent)
+
+    def create_once(self, create, name, parentid, description='', nbytes=0, fields='id,name', made=None):
+        """Calls create, which makes the file name in the folder parentid, retrying it
+        on transient errors. A create that failed with a 5xx or a lost connection may
+        have gone through anyway, so before each retry look for the file it made.
+        made: called with a file of that name found in parentid, True if the failed
+        create made it
+        Returns:
+            whatever create returns or the file the failed create made
+        """
+        query = "name = '%s' and '%s' in parents and trashed = false" % (name.replace('\\', '\\\\').replace("'", "\\'"), parentid)
+        attempt = 0
+        while True:
+            try:
+                return self.call_with_retry(create, description, nbytes=nbytes, idempotent=False)
+            except Exception as e:
+                # raises e unless it is transient and there are retries left
+                self.wait_to_retry(e, attempt, description)
+                attempt = attempt + 1
+            response = self.execute_request(self.service.files().list(q=query, fields='files(%s)' % fields))
+            for file in response.get('files', []):
+                if made is None or made(file):
+                    return file
+
+    def create_folder(self, name, parentid):
+        """Creates the folder name in the folder parentid, without making a second
+        one when a create that seemed to fail went through
+        Returns:
+            folder resource with id and name
+        """
+        folder_metadata = {
+        'name' : name,
+        'mimeType' : 'application/vnd.google-apps.folder',
+        'parents'  : [parentid],
+        }
+        request = self.service.files().create(body=folder_metadata, fields='id, name')
+        return self.create_once(lambda: request.execute(http=self.get_http()), name, parentid, 'drive.files.create',
+                                fields='id,name,mimeType',
+                                made=lambda file: file.get('mimeType') == 'application/vnd.google-apps.folder')
+
+    def retry_summary(self):
+        with self.retrylock:
+            return "retries " + ' '.join("%s=%d" % (key, value) for key, value in sorted(self.retrycounts.items()))
+
     def get_root(self, verbose=False):
         if self.service is None:
             raise GoogleDriveException("GoogleDrive object not initialized yet")
         try:
-            rootdir = self.service.files().get(fileId='root').execute()
-        except HttpError:
+            rootdir = self.execute_request(self.service.files().get(fileId='root'))
+        except apierrors.HttpError:
             msg = "unable to determine root directory"
             if verbose:
                 sys.stdout.write("%s\n" % msg)
@@ -129,9 +641,9 @@ class GoogleDrive(object):
             parentpath = builtpath
             builtpath = builtpath + '/' + dirname
             existingpath = ''
-            existingpaths, existingids, existingdirs = self.list_files_in_drive(pathquery=builtpath, verbose=False)
+            existingpaths, existingids, existingdirs = self.list_files_in_drive(pathquery=builtpath, fields="files(id,name,parents,mimeType)", verbose=False)
             for indx, existingpath in enumerate(existingpaths):
-                isdir = self.service.files().get(fileId=existingids[indx], fields='id,name,mimeType').execute().get("mimeType") == 'application/vnd.google-apps.folder'
+                isdir = existingdirs[indx].get("mimeType") == 'application/vnd.google-apps.folder'
                 if existingpath == builtpath and isdir:
                     # the path directory exists already
                     folder = existingdirs[indx]
@@ -142,21 +654,21 @@ class GoogleDrive(object):
                     raise GoogleDriveException("The path [%s] contains a component that is currently a file and we would have to overwrite it as a directory" % builtpath)
                 # otherwise create the folder
             if existingpath != builtpath:
-                existingpaths, existingids, existingdirs = self.list_files_in_drive(pathquery=parentpath, verbose=False)
+                if parentpath == '':
+                    # My Drive itself never turns up in a name query
+                    existingids = [self.root.get('id')]
+                else:
+                    existingpaths, existingids, existingdirs = self.list_files_in_drive(pathquery=parentpath, verbose=False)
                 if len(existingids) == 0:
                     raise GoogleDriveException("Unable to find parent id for [%s]. unable to create the folder path [%s]" % (parentpath, builtpath))
                 if len(existingids) > 1:
                     raise GoogleDriveException("Unable to find unique parent id for [%s]. unable to create the folder path [%s]" % (parentpath, builtpath))
-                folder_metadata = {
-                'name' : dirname,
-                'mimeType' : 'application/vnd.google-apps.folder',
-                'parents'  : [existingids[0]],
-                }
                 try:
-                    folder = self.service.files().create(body=folder_metadata, fields='id, name').execute()
-                except HttpError as e:
+                    folder = self.create_folder(dirname, existingids[0])
+                except apierrors.HttpError as e:
                     msg = "[%s] unable to create folder path %s" % (builtpath, e.reason)
                     raise GoogleDriveException(msg)
+                self.folderindex[folder.get('id')] = (dirname, existingids[0])
         return path, folder.get("id"), folder
 
     def delete_file_path(self, path=None, trash=True, verbose=False):
@@ -175,10 +687,11 @@ class GoogleDrive(object):
                 raise GoogleDriveException(msg)
             if trash:
                 body = {'trashed' : True }
-                file = self.service.files().update(fileId=fileids[0], body=body).execute()
+                file = self.execute_request(self.service.files().update(fileId=fileids[0], body=body))
             else:
-                file = self.service.files().delete(fileId=fileids[0], fields='name').execute()
-        except HttpError as e:
+                file = self.execute_request(self.service.files().delete(fileId=fileids[0], fields='name'))
+            self.forget_folders([fileids[0]])
+        except apierrors.HttpError as e:
             msg = "unable to delete filepath %s. %s" % (path, e.reason)
             raise GoogleDriveException(msg)
         return pathlist[0], fileids[0], files[0]
@@ -191,30 +704,119 @@ class GoogleDrive(object):
         if self.service is None:
             raise GoogleDriveException("GoogleDrive object not initialized yet")
         try:
-            file = self.service.files().get(fileId=fileid).execute()
+            file = self.execute_request(self.service.files().get(fileId=fileid, fields='id,name,parents'))
             pathlist, path = self.get_path(file=file)
             if trash:
                 body = {'trashed' : True }
-                file = self.service.files().update(fileId=fileid, body=body).execute()
+                file = self.execute_request(self.service.files().update(fileId=fileid, body=body))
             else:
-                file = self.service.files().delete(fileId=fileid, fields='name').execute()
+                file = self.execute_request(self.service.files().delete(fileId=fileid, fields='name'))
+            self.forget_folders([fileid])
             if file is None:
                 msg = "unable to find fileid=%s to delete" % fileid
                 raise GoogleDriveException(msg)
-        except HttpError as e:
+        except apierrors.HttpError as e:
             msg = "unable to delete fileid=%s: %s" % (fileid, e.reason)
             raise GoogleDriveException(msg)
         return path, fileid, file
 
-    def upload_file_to_path(self, filename='', parentpath='', verbose=False, allowduplicate=False, chunk=16, checksum=None):
-        """Uploads the file to the specified folder id on the said Google Drive
+    def execute_batch(self, requests, verbose=False):
+        """Sends (key, request) pairs through the Drive batch endpoint,
+        batchsize requests per round trip. Keys must be unique.
         Returns:
-                file resource
+            dict of key -> response for the calls that succeeded and
+            dict of key -> HttpError for the calls that failed
         """
         if self.service is None:
             raise GoogleDriveException("GoogleDrive object not initialized yet")
+        results = {}
+        errors = {}
+        def callback(requestid, response, exception):
+            if exception is not None:
+                errors[requestid] = exception
+            else:
+                results[requestid] = response
+        attempt = 0
+        while True:
+            for start in range(0, len(requests), self.batchsize):
+                batch = self.service.new_batch_http_request(callback=callback)
+                for key, request in requests[start:start + self.batchsize]:
+                    batch.add(request, request_id=key)
+                try:
+                    self.call_with_retry(lambda: batch.execute(http=self.get_http()), 'batch',
+                                         requests=len(requests[start:start + self.batchsize]))
+                except apierrors.HttpError as e:
+                    msg = "unable to execute batch request: %s" % e.reason
+                    if verbose:
+                        sys.stdout.write("%s\n" % msg)
+                    raise GoogleDriveException(msg)
+            # send the calls that failed with transient errors again
+            retry = [(key, request) for key, request in requests if key in errors and self.retry_reason(errors[key]) is not None]
+            if len(retry) == 0 or attempt >= self.retries:
+                break
+            delay = max(self.retry_delay(attempt, errors[key]) for key, request in retry)
+            for key, request in retry:
+                self.count_retry(self.retry_reason(errors.pop(key)))
+            time.sleep(delay)
+            requests = retry
+            attempt = attempt + 1
+        if verbose and len(errors) > 0:
+            for key, e in errors.items():
+                sys.stdout.write("batch request for %s failed: %s\n" % (key, getattr(e, 'reason', str(e))))
+        return results, errors
+
+    def get_many(self, fileids, fields='id,name,parents,mimeType', verbose=False):
+        """Gets the metadata of many files in as few round trips as possible
+        Returns:
+            dict of fileid -> file resource, dict of fileid -> HttpError
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        fileids = list(OrderedDict.fromkeys(fileids))
+        requests = [(fileid, self.service.files().get(fileId=fileid, fields=fields)) for fileid in fileids]
+        return self.execute_batch(requests, verbose=verbose)
+
+    def trash_many(self, fileids, verbose=False):
+        """Moves many files to the trash in as few round trips as possible
+        Returns:
+            dict of fileid -> file resource, dict of fileid -> HttpError
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        fileids = list(OrderedDict.fromkeys(fileids))
+        body = {'trashed' : True }
+        requests = [(fileid, self.service.files().update(fileId=fileid, body=body, fields='id,name')) for fileid in fileids]
+        results, errors = self.execute_batch(requests, verbose=verbose)
+        self.forget_folders(results)
+        return results, errors
+
+    def delete_many(self, fileids, verbose=False):
+        """Permanently deletes many files in as few round trips as possible
+        Returns:
+            dict of fileid -> response, dict of fileid -> HttpError
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        fileids = list(OrderedDict.fromkeys(fileids))
+        requests = [(fileid, self.service.files().delete(fileId=fileid)) for fileid in fileids]
+        results, errors = self.execute_batch(requests, verbose=verbose)
+        self.forget_folders(results)
+        return results, errors
+
+    def chunker(self, chunk):
+        """Get the chunk sizer for one transfer starting with chunk MiB chunks
+        Returns:
+            AdaptiveChunker, one that keeps chunk fixed if chunkseconds is None
+        """
+        return transfer_chunker(chunk, chunkseconds=self.chunkseconds, maxchunk=self.maxchunk)
+
+    def get_upload_parent(self, parentpath, name, allowduplicate=False):
+        """Finds the folder to upload name into and makes sure name isn't already there
+        Returns:
+                parent path ('' for the root) and a list holding the parent folder id
+        """
         # get parentpath ids
-        if parentpath != '/':
+        if parentpath not in ('/', ''):
             pathlist, parentids, parents = self.list_files_in_drive(pathquery=parentpath)
             if len(parentids) == 0:
                 raise GoogleDriveException("Unable to find path %s" % parentpath)
@@ -223,36 +825,120 @@ class GoogleDrive(object):
         else:
             parentpath = ''
             parentids = [self.root.get('id')]
-        existingpaths, existingfiles, files = self.list_files_in_drive(pathquery="%s/%s" %(parentpath, filename))
+        existingpaths, existingfiles, files = self.list_files_in_drive(pathquery="%s/%s" %(parentpath, name))
         if len(existingfiles) > 0 and not allowduplicate:
-            msg = "file %s/%s already exists" % (parentpath, filename)
+            msg = "file %s/%s already exists" % (parentpath, name)
             raise GoogleDriveException(msg)
+        return parentpath, parentids
+
+    def upload_file_to_path(self, filename='', parentpath='', verbose=False, allowduplicate=False, chunk=16, checksum=None, properties=None):
+        """Uploads the file to the specified folder id on the said Google Drive
+        properties: optional dictionary of custom file properties set along with checksum
+        Returns:
+                file resource
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        journalpath = parentpath
+        parentpath, parentids = self.get_upload_parent(parentpath, os.path.basename(filename), allowduplicate=allowduplicate)
         file_metadata = {
               'name' : os.path.basename(filename),
               'parents': parentids
         }
+        properties = dict(properties or {})
         if checksum is not None:
-            file_metadata['properties'] = { 'checksum': checksum}
+            properties['checksum'] = checksum
+        if properties:
+            file_metadata['properties'] = properties
         try:
-            media = MediaFileUpload(filename, resumable=True, chunksize=chunk*1024*1024)
+            f = open(filename, 'rb')
         except FileNotFoundError :
             msg="Unable to find file '%s' to upload" % filename
             if verbose:
                 sys.stdout.write("%s\n" % msg)
             raise GoogleDriveException(msg)
-                
+        size = os.fstat(f.fileno()).st_size
+        mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        chunker = self.chunker(chunk)
+        http = self.get_authorized_http()
+        entry = None
+        if self.journal is not None:
+            entry = self.journal.get(filename, journalpath, checksum=checksum)
+        sessionuri = None
+        journaled = False
+        def query():
+            # ask the server how much of the upload it kept
+            return self.call_with_retry(lambda: self.put_upload(http, sessionuri, b'', 'bytes */%d' % size), 'upload %s' % filename)
         try:
-            request = self.service.files().create(body=file_metadata, media_body=media, fields='name,id,size,parents')
-            file = None
-            while file is None:
-                status, file = request.next_chunk()
-                if verbose and status is not None:
-                    sys.stdout.write("Uploaded %d%%.\r" % int(status.progress() * 100))
-                    sys.stdout.flush()
+            with f:
+                resp = None
+                if entry is not None:
+                    # carry on with the session an earlier run started
+                    sessionuri = entry.get('sessionuri')
+                    journaled = True
+                    if verbose:
+                        sys.stdout.write("Resuming upload of %s at about %d bytes\n" % (filename, entry.get('offset', 0)))
+                    try:
+                        resp, content = query()
+                    except apierrors.HttpError as e:
+                        if e.resp.status not in (404, 410):
+                            raise
+                        # the server has forgotten the old session, start again
+                        if verbose:
+                            sys.stdout.write("Upload session of %s has expired, starting again\n" % filename)
+                        self.journal.remove(filename)
+                        sessionuri = None
+                        journaled = False
+                if sessionuri is None:
+                    sessionuri = self.call_with_retry(lambda: self.start_upload(http, file_metadata, mimetype), 'upload %s' % filename)
+                    if self.journal is not None:
+                        self.journal.put(filename, sessionuri, journalpath, checksum=checksum)
+                        journaled = True
+                offset = 0
+                file = None
+                attempt = 0
+                while file is None:
+                    if resp is not None:
+                        if resp.status in (200, 201):
+                            file = json.loads(content.decode('utf-8'))
+                            break
+                        # the server tells us how much it kept, resend anything it didn't
+                        offset = 0
+                        if 'range' in resp:
+                            offset = int(resp['range'].split('-')[-1]) + 1
+                        if journaled:
+                            self.journal.update(filename, offset)
+                        if verbose and size > 0:
+                            sys.stdout.write("Uploaded %d%%.\r" % int(100.0 * offset / size))
+                            sys.stdout.flush()
+                    f.seek(offset)
+                    body = f.read(chunker.size)
+                    if len(body) == 0:
+                        contentrange = 'bytes */%d' % size
+                    else:
+                        contentrange = 'bytes %d-%d/%d' % (offset, offset + len(body) - 1, size)
+                    started = time.time()
+                    try:
+                        self.throttle(nbytes=len(body))
+                        resp, content = self.put_upload(http, sessionuri, body, contentrange)
+                        self.record_call('upload %s' % filename, started, 0.0, 1, len(body), attempt)
+                        if attempt == 0:
+                            chunker.record(len(body), time.time() - started)
+                        attempt = 0
+                    except Exception as e:
+                        chunker.failed()
+                        try:
+                            self.wait_to_retry(e, attempt, 'upload %s' % filename)
+                        except Exception:
+                            self.record_call('upload %s' % filename, started, 0.0, 1, len(body), attempt, e)
+                            raise
+                        attempt = attempt + 1
+                        resp, content = query()
+            if journaled:
+                self.journal.remove(filename)
             if verbose:
-                sys.stdout.write("Uploaded 100%% of file %s\n" % filename)
-            #file = self.service.files().create(body=file_metadata, media_body=media, fields='name,id,size,parents').execute()
-        except HttpError as e:
+                sys.stdout.write("Uploaded 100%% of file %s, %s\n" % (filename, chunker))
+        except apierrors.HttpError as e:
             msg = "unable to upload file %s: %s" % (filename, e.reason)
             if verbose:
                 sys.stdout.write("%s\n" % msg)
@@ -260,8 +946,201 @@ class GoogleDrive(object):
 
         return parentpath + '/' + file_metadata['name'], file.get('id'), file
 
-    def download_file(self, fileid, fileName, verbose=False):
+    def get_authorized_http(self):
+        """Get an authorized transport for requests made outside the generated API methods"""
+        http = self.get_http()
+        if http is None:
+            http = self.service._http
+        return http
+
+    def media_url(self, path):
+        """Get the absolute url of a media endpoint, e.g. /upload/drive/v3/files"""
+        return urljoin(self.service._baseUrl, path)
+
+    def start_upload(self, http, file_metadata, mimetype):
+        """Starts a resumable upload session for a new file described by file_metadata
+        Returns:
+                the session uri the contents are PUT to
+        """
+        resp, content = http.request(self.media_url('/upload/drive/v3/files?uploadType=resumable&fields=name,id,size,parents'),
+                                     method='POST', body=json.dumps(file_metadata),
+                                     headers={'Content-Type': 'application/json; charset=UTF-8',
+                                              'X-Upload-Content-Type': mimetype})
+        if resp.status != 200 or 'location' not in resp:
+            raise apierrors.HttpError(resp, content, uri='/upload/drive/v3/files')
+        return resp['location']
+
+    def put_upload(self, http, sessionuri, body, contentrange):
+        """Sends body as contentrange of the upload session sessionuri, an empty body
+        with bytes */total asks how much of the upload the server has
+        Returns:
+                response and content, a 308 response while the upload isn't finished
+        """
+        resp, content = http.request(sessionuri, method='PUT', body=body,
+                                     headers={'Content-Range': contentrange,
+                                              'Content-Length': str(len(body))})
+        if resp.status not in (200, 201, 308):
+            raise apierrors.HttpError(resp, content, uri=sessionuri)
+        return resp, content
+
+    def upload_stream(self, stream, name, parentpath='', verbose=False, allowduplicate=False, chunk=16, checksum=None,
+                      mimetype='application/octet-stream', properties=None):
+        """Uploads everything read from stream as name in parentpath through a resumable
+        upload session. stream may be a file object (it doesn't need to be seekable) or an
+        iterator of bytes. At most one chunk (plus one byte of look ahead) is held in memory.
+        properties: optional dictionary of custom file properties set along with checksum
+        Returns:
+                path, id and file resource
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        parentpath, parentids = self.get_upload_parent(parentpath, name, allowduplicate=allowduplicate)
+        file_metadata = {
+              'name' : name,
+              'parents': parentids
+        }
+        properties = dict(properties or {})
+        if checksum is not None:
+            properties['checksum'] = checksum
+        if properties:
+            file_metadata['properties'] = properties
+        reader = StreamReader(stream)
+        chunker = self.chunker(chunk)
+        http = self.get_authorized_http()
+        try:
+            sessionuri = self.call_with_retry(lambda: self.start_upload(http, file_metadata, mimetype), 'upload %s' % name)
+            offset = 0
+            pending = b''
+            file = None
+            attempt = 0
+            while file is None:
+                chunksize = chunker.size
+                # read one byte past the chunk so we know whether this is the last one,
+                # after the chunk size shrinks pending may already hold more than that
+                pending = pending + reader.read(max(0, chunksize + 1 - len(pending)))
+                last = len(pending) <= chunksize
+                body = pending[:chunksize]
+                if last:
+                    total = str(offset + len(body))
+                else:
+                    total = '*'
+                if len(body) == 0:
+                    contentrange = 'bytes */%s' % total
+                else:
+                    contentrange = 'bytes %d-%d/%s' % (offset, offset + len(body) - 1, total)
+                started = time.time()
+                try:
+                    self.throttle(nbytes=len(body))
+                    resp, content = self.put_upload(http, sessionuri, body, contentrange)
+                    self.record_call('upload %s' % name, started, 0.0, 1, len(body), attempt)
+                    attempt = 0
+                except Exception as e:
+                    chunker.failed()
+                    try:
+                        self.wait_to_retry(e, attempt, 'upload %s' % name)
+                    except Exception:
+                        self.record_call('upload %s' % name, started, 0.0, 1, len(body), attempt, e)
+                        raise
+                    attempt = attempt + 1
+                    # ask the server how much of the upload it kept and carry on from there
+                    resp, content = self.call_with_retry(lambda: self.put_upload(http, sessionuri, b'', 'bytes */%s' % total), 'upload %s' % name)
+                if resp.status in (200, 201):
+                    file = json.loads(content.decode('utf-8'))
+                elif resp.status == 308:
+                    # the server tells us how much it kept, resend anything it didn't
+                    received = 0
+                    if 'range' in resp:
+                        received = int(resp['range'].split('-')[-1]) + 1 - offset
+                    offset = offset + received
+                    pending = pending[received:]
+                    if attempt == 0:
+                        chunker.record(received, time.time() - started)
+                    if verbose:
+                        sys.stdout.write("Uploaded %.1f MiB\r" % (offset / (1024.0*1024.0)))
+                        sys.stdout.flush()
+                else:
+                    raise apierrors.HttpError(resp, content, uri=sessionuri)
+            if verbose:
+                sys.stdout.write("Uploaded 100%% of stream %s, %s\n" % (name, chunker))
+        except apierrors.HttpError as e:
+            msg = "unable to upload stream %s: %s" % (name, e.reason)
+            if verbose:
+                sys.stdout.write("%s\n" % msg)
+            raise GoogleDriveException(msg)
+        return parentpath + '/' + name, file.get('id'), file
+
+    def upload_bytes(self, data, name, parentids, properties=None, mimetype='application/octet-stream', allowduplicate=False,
+                     verbose=False):
+        """Uploads data as name into the folders parentids with a single multipart request,
+        for small objects where a resumable session would double the API calls. Nothing
+        checks whether name already exists there.
+        allowduplicate: retry after errors the upload may have gone through despite
+        without first looking for the copy it made, which can leave two copies of name
+        Returns:
+                file resource
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        file_metadata = {
+              'name' : name,
+              'parents': parentids
+        }
+        if properties:
+            file_metadata['properties'] = properties
+        # googleapiclient ends the lines of a multipart body with a bare LF, which makes
+        # data ending in CR ambiguous to a server that expects the CRLF the RFC asks for
+        boundary = ("upload_%s" % uuid.uuid4().hex).encode('ascii')
+        body = b''.join((b'--' + boundary + b'\r\n',
+                         b'Content-Type: application/json; charset=UTF-8\r\n\r\n',
+                         json.dumps(file_metadata).encode('utf-8'),
+                         b'\r\n--' + boundary + b'\r\n',
+                         b'Content-Type: ' + mimetype.encode('ascii') + b'\r\n\r\n',
+                         data,
+                         b'\r\n--' + boundary + b'--\r\n'))
+        http = self.get_authorized_http()
+        url = self.media_url('/upload/drive/v3/files?uploadType=multipart&fields=name,id,size,parents')
+        def upload():
+            resp, content = http.request(url, method='POST', body=body,
+                                         headers={'Content-Type': 'multipart/related; boundary=%s' % boundary.decode('ascii')})
+            if resp.status != 200:
+                raise apierrors.HttpError(resp, content, uri='/upload/drive/v3/files')
+            return json.loads(content.decode('utf-8'))
+        try:
+            if allowduplicate:
+                return self.call_with_retry(upload, 'upload %s' % name, nbytes=len(data))
+            md5 = hashlib.md5(data).hexdigest()
+            return self.create_once(upload, name, parentids[0], 'upload %s' % name,
+                                    nbytes=len(data), fields='name,id,size,parents,md5Checksum',
+                                    made=lambda file: file.get('md5Checksum') == md5)
+        except apierrors.HttpError as e:
+            msg = "unable to upload %s: %s" % (name, e.reason)
+            if verbose:
+                sys.stdout.write("%s\n" % msg)
+            raise GoogleDriveException(msg)
+
+    def download_bytes(self, fileid, verbose=False):
+        """Downloads a small file into memory with a single request
+        Returns:
+                the contents of the file
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        try:
+            return self.execute_request(self.service.files().get_media(fileId=fileid))
+        except apierrors.HttpError as e:
+            msg = "unable to download file ID %s %s" % (fileid, e.reason)
+            if verbose:
+                sys.stdout.write("%s\n" % msg)
+            raise GoogleDriveException(msg)
+
+    def download_file(self, fileid, fileName, verbose=False, chunksize=1, progress=None, ranges=1, rangesize=32, decompress=False):
         """Downloads the fileId file
+        chunksize: size in MiB of the first chunk, later ones adapt to chunkseconds
+        progress: optional callable that is passed the number of bytes in each downloaded chunk
+        ranges, rangesize: with ranges > 1 a file bigger than rangesize MiB is fetched as
+        rangesize MiB byte ranges, ranges of them at the same time (see download_ranges)
+        decompress: files with a codec property (e.g. backups) are decompressed after
+        the download, archive.tgz becomes archive.tar
         Returns:
                 media object
         """
@@ -270,11 +1149,10 @@ class GoogleDrive(object):
         if fileid is None or fileName is None:
             return None
 
-        request = self.service.files().get_media(fileId=fileid)
         try:
-            file = self.service.files().get(fileId=fileid, fields='id,name').execute()
+            file = self.execute_request(self.service.files().get(fileId=fileid, fields='id,name,size,md5Checksum,properties'))
             fileName = file.get("name")
-        except HttpError as e:
+        except apierrors.HttpError as e:
             msg = "unable to access file ID %s %s" % (fileid, e.reason)
             if verbose:
                 sys.stdout.write("%s\n" % msg)
@@ -282,67 +1160,350 @@ class GoogleDrive(object):
         indx = 1
         name, ext = os.path.splitext(fileName)
         newname = name
-        while os.path.isfile(newname + ext):
-            newname = "%s(%d)" % (name, indx)
-            indx = indx +1
-        fh = io.FileIO(newname + ext, mode='wb')
-        downloader = MediaIoBaseDownload(fh, request, chunksize=1024*1024)
-        done = False
-        if verbose:
-            sys.stdout.write("Downloading file %s, id=%s\n" % (newname + ext, fileid))
-        while done is False:
+        # other download threads may be picking a name at the same time
+        with self.namelock:
+            while os.path.isfile(newname + ext):
+                newname = "%s(%d)" % (name, indx)
+                indx = indx +1
+            fh = io.FileIO(newname + ext, mode='wb')
+        if ranges > 1 and int(file.get('size') or 0) > rangesize*1024*1024:
+            if verbose:
+                sys.stdout.write("Downloading file %s, id=%s, %d ranges at a time\n" % (newname + ext, fileid, ranges))
             try:
-                status, done = downloader.next_chunk()
-            except HttpError as e:
-                msg = "failed to download file %s: %s" %(fh.name, e.reason)
+                self.download_ranges(file, fh, ranges=ranges, rangesize=rangesize, progress=progress, verbose=verbose)
+            except (apierrors.HttpError, GoogleDriveException, OSError) as e:
+                msg = "failed to download file %s: %s" % (fh.name, getattr(e, 'reason', str(e)))
                 fh.close()
                 os.remove(fh.name)
                 raise GoogleDriveException(msg)
-            if status:
-                if verbose:
-                    sys.stdout.write("Download %d%%.\n" % int(status.progress() * 100))
+            fh.close()
+            if verbose:
+                sys.stdout.write("Download Complete!\n")
+            if decompress:
+                return self.decompress_download(newname + ext, file, verbose=verbose), fileid, file
+            return newname + ext, fileid, file
+        if verbose:
+            sys.stdout.write("Downloading file %s, id=%s\n" % (newname + ext, fileid))
+        size = int(file.get('size') or 0)
+        received = 0
+        try:
+            # explicit byte ranges, sized by the adaptive chunker, each retried on its own
+            for data in self.iter_download(fileid, chunksize=chunksize, verbose=verbose):
+                view = memoryview(data)
+                written = 0
+                while written < len(data):
+                    written = written + fh.write(view[written:])
+                received = received + len(data)
+                if progress is not None:
+                    progress(len(data))
+                if verbose and size > 0:
+                    sys.stdout.write("Download %d%%.\n" % int(100.0 * received / size))
+        except GoogleDriveException:
+            fh.close()
+            os.remove(fh.name)
+            raise
+        except OSError as e:
+            msg = "failed to download file %s: %s" % (fh.name, str(e))
+            fh.close()
+            os.remove(fh.name)
+            raise GoogleDriveException(msg)
+        fh.close()
         if verbose:
             sys.stdout.write("Download Complete!\n")
+        if decompress:
+            return self.decompress_download(newname + ext, file, verbose=verbose), fileid, file
         return newname + ext, fileid, file
 
-    def list_files_in_drive(self, query=None, pathquery=None, fields="files(id,name,size,modifiedTime,parents,properties)", includetrashed=False, verbose=False, orderBy=None):
-        """Queries Google Drive for all files satisfying query
+    def decompress_download(self, filename, file, verbose=False):
+        """Decompresses the downloaded filename according to the codec property of
+        its file resource and removes the compressed copy
         Returns:
-                list of file resources
+                name of the decompressed file, filename itself if it has no codec
+        """
+        codec = (file.get('properties') or {}).get('codec')
+        if codec is None:
+            return filename
+        name, ext = os.path.splitext(decompressed_name(filename))
+        newname = name
+        indx = 1
+        with self.namelock:
+            while os.path.isfile(newname + ext):
+                newname = "%s(%d)" % (name, indx)
+                indx = indx + 1
+            out = open(newname + ext, 'wb')
+        try:
+            with out, open(filename, 'rb') as f:
+                reader = decompress_reader(f, codec)
+                data = reader.read(1024*1024)
+                while data:
+                    out.write(data)
+                    data = reader.read(1024*1024)
+        except (OSError, EOFError, CompressionException) as e:
+            os.remove(newname + ext)
+            raise GoogleDriveException("unable to decompress %s: %s" % (filename, str(e)))
+        os.remove(filename)
+        if verbose:
+            sys.stdout.write("Decompressed %s (%s) to %s\n" % (filename, codec, newname + ext))
+        return newname + ext
+
+    def download_ranges(self, file, fh, ranges=4, rangesize=32, progress=None, verbose=False):
+        """Downloads file (a resource with id, size and md5Checksum) into the open file fh
+        as rangesize MiB byte ranges fetched ranges at a time, each written in place and
+        retried on its own, then checks the whole file against Drive's md5Checksum
+        """
+        size = int(file.get('size'))
+        fd = fh.fileno()
+        # reserve the whole file up front so the ranges can land in any order
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, size)
+        url = self.media_url('files/%s?alt=media' % file.get('id'))
+        step = rangesize*1024*1024
+        def fetch(start, end):
+            resp, content = self.get_authorized_http().request(url, method='GET', headers={'Range': 'bytes=%d-%d' % (start, end)})
+            if resp.status == 200:
+                # the range was ignored and we got the whole file
+                content = content[start:end + 1]
+            elif resp.status != 206:
+                raise apierrors.HttpError(resp, content, uri=url)
+            if len(content) != end - start + 1:
+                raise ConnectionError("got %d of the %d bytes in range %d-%d" % (len(content), end - start + 1, start, end))
+            return content
+        def download(start, end):
+            content = self.call_with_retry(lambda: fetch(start, end), 'download %s bytes %d-%d' % (file.get('id'), start, end),
+                                           nbytes=end - start + 1)
+            view = memoryview(content)
+            written = 0
+            while written < len(content):
+                written = written + os.pwrite(fd, view[written:], start + written)
+            if progress is not None:
+                progress(len(content))
+            return len(content)
+        received = 0
+        with concurrentfutures.ThreadPoolExecutor(max_workers=ranges) as executor:
+            pending = [executor.submit(download, start, min(start + step, size) - 1) for start in range(0, size, step)]
+            try:
+                for future in pending:
+                    received = received + future.result()
+                    if verbose:
+                        sys.stdout.write("Download %d%%.\n" % int(100.0 * received / size))
+            except Exception:
+                for future in pending:
+                    future.cancel()
+                raise
+        checksum = file.get('md5Checksum')
+        if checksum is not None:
+            digest = hashlib.md5()
+            with open(fh.name, 'rb') as f:
+                data = f.read(1024*1024)
+                while data:
+                    digest.update(data)
+                    data = f.read(1024*1024)
+            if digest.hexdigest() != checksum:
+                raise GoogleDriveException("md5 %s of the downloaded file doesn't match %s on Drive" % (digest.hexdigest(), checksum))
+
+    def iter_download(self, fileid, chunksize=1, verbose=False):
+        """Downloads the contents of fileid one byte range at a time without writing
+        them anywhere. Each range is retried on its own, the range size starts at
+        chunksize MiB and adapts to chunkseconds.
+        Yields:
+                bytes, in order
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        url = self.media_url('files/%s?alt=media' % fileid)
+        chunker = self.chunker(chunksize)
+        def fetch(start, end):
+            started = time.time()
+            try:
+                resp, content = self.get_authorized_http().request(url, method='GET', headers={'Range': 'bytes=%d-%d' % (start, end)})
+                if resp.status not in (200, 206, 416):
+                    raise apierrors.HttpError(resp, content, uri=url)
+            except Exception:
+                chunker.failed()
+                raise
+            chunker.record(len(content), time.time() - started)
+            self.transferred(len(content))
+            return resp, content
+        offset = 0
+        total = None
+        while total is None or offset < total:
+            end = offset + chunker.size - 1
+            try:
+                resp, content = self.call_with_retry(lambda: fetch(offset, end), 'download %s' % fileid, nbytes=chunker.size)
+            except apierrors.HttpError as e:
+                msg = "failed to download file id %s: %s" % (fileid, e.reason)
+                if verbose:
+                    sys.stderr.write("%s\n" % msg)
+                raise GoogleDriveException(msg)
+            if resp.status == 416:
+                # an empty file has no byte ranges
+                break
+            if resp.status == 200:
+                # the range was ignored and this is the whole file
+                yield content[offset:]
+                break
+            total = int(resp.get('content-range', '*/%d' % (offset + len(content))).split('/')[-1])
+            if len(content) == 0 and offset < total:
+                raise GoogleDriveException("failed to download file id %s: no data at byte %d of %d" % (fileid, offset, total))
+            offset = offset + len(content)
+            yield content
+
+    def download_to(self, fileid, fileobj, chunksize=1, verbose=False, progress=None, decompress=False):
+        """Writes the contents of fileid to fileobj (anything with a write method, e.g. a
+        pipe) as it arrives and checks them against the md5Checksum Drive has for it
+        progress: optional callable that is passed the number of bytes in each chunk
+        decompress: decompress files with a codec property (e.g. backups) on the way
+        Returns:
+                number of bytes written and the file resource
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        try:
+            file = self.execute_request(self.service.files().get(fileId=fileid, fields='id,name,size,md5Checksum,properties'))
+        except apierrors.HttpError as e:
+            msg = "unable to access file ID %s %s" % (fileid, e.reason)
+            if verbose:
+                sys.stderr.write("%s\n" % msg)
+            raise GoogleDriveException(msg)
+        codec = None
+        if decompress:
+            codec = (file.get('properties') or {}).get('codec')
+        digest = hashlib.md5()
+        written = 0
+        try:
+            expander = None
+            if codec is not None:
+                expander = Decompressor(codec)
+            for data in self.iter_download(fileid, chunksize=chunksize, verbose=verbose):
+                digest.update(data)
+                if progress is not None:
+                    progress(len(data))
+                if expander is not None:
+                    data = expander.decompress(data)
+                fileobj.write(data)
+                written = written + len(data)
+        except CompressionException as e:
+            raise GoogleDriveException("unable to decompress %s: %s" % (file.get('name'), str(e)))
+        if file.get('md5Checksum') is not None and digest.hexdigest() != file.get('md5Checksum'):
+            raise GoogleDriveException("md5 %s of the downloaded data doesn't match %s on Drive" % (digest.hexdigest(), file.get('md5Checksum')))
+        return written, file
+
+    def download_files(self, files, jobs=4, maxinflight=512, chunksize=1, verbose=False, ranges=1, decompress=False):
+        """Downloads many files concurrently from a pool of jobs threads
+        files: iterable of file resources (id, name and size), it is consumed
+        lazily so a streamed listing can be passed straight in
+        maxinflight: MiB of downloads allowed to be in progress at once
+        ranges: byte ranges of each large file to fetch at the same time
+        Returns:
+                list of (path, id, file) for each download and
+                list of (id, GoogleDriveException) for each failure
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        budget = ByteBudget(maxinflight*1024*1024)
+        totals = {'bytes': 0, 'files': 0, 'queued': 0}
+        totalslock = threading.Lock()
+        def progress(nbytes):
+            with totalslock:
+                totals['bytes'] = totals['bytes'] + nbytes
+        def download(file, reserved):
+            try:
+                return self.download_file(file.get('id'), file.get('name'), chunksize=chunksize, progress=progress, ranges=ranges,
+                                          decompress=decompress)
+            finally:
+                budget.release(reserved)
+                with totalslock:
+                    totals['files'] = totals['files'] + 1
+                    if verbose:
+                        sys.stdout.write("Finished %d of %d files, %.1f MiB downloaded\n" % (totals['files'], totals['queued'],
+                                                                                          totals['bytes'] / (1024.0*1024.0)))
+        futures = []
+        with concurrentfutures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            for file in files:
+                reserved = budget.acquire(int(file.get('size') or 0))
+                with totalslock:
+                    totals['queued'] = totals['queued'] + 1
+                futures.append((file.get('id'), executor.submit(download, file, reserved)))
+        results = []
+        errors = []
+        for fileid, future in futures:
+            try:
+                results.append(future.result())
+            except GoogleDriveException as e:
+                errors.append((fileid, e))
+            except Exception as e:
+                errors.append((fileid, GoogleDriveException("failed to download file id %s: %s" % (fileid, str(e)))))
+        return results, errors
+
+    def iter_pages(self, query, fields="files(id,name,size,modifiedTime,parents,properties)", page_size=1000, orderBy=None, verbose=False):
+        """Follows nextPageToken through every page of results for query
+        Yields:
+                list of file resources, one list per page
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        if 'nextPageToken' not in fields:
+            fields = "nextPageToken," + fields
+        pagetoken = None
+        while True:
+            try:
+                response = self.execute_request(self.service.files().list(q=query, fields=fields, orderBy=orderBy,
+                                                     pageSize=page_size, pageToken=pagetoken))
+            except apierrors.HttpError as e:
+                msg = "unable to list files from query '%s': %s" %(query, e.reason)
+                if verbose:
+                    sys.stdout.write("%s\n" % msg)
+                raise GoogleDriveException(msg)
+            yield response.get('files', [])
+            pagetoken = response.get('nextPageToken')
+            if pagetoken is None:
+                break
+
+    def iter_files(self, query=None, pathquery=None, fields="files(id,name,size,modifiedTime,parents,properties)", includetrashed=False, verbose=False, orderBy=None, page_size=1000):
+        """Queries Google Drive for all files satisfying query, one page at a time
+        Yields:
+                (path, id, file resource) tuples
         """
         if pathquery is not None and query is not None:
             raise GoogleDriveException("You can't specify path and pathquery at the same time")
         if pathquery is not None:
             filename = pathquery.split('/')[-1]
             query = "name = '%s'" % filename
+        if query is None or len(query) == 0:
+            raise GoogleDriveException("You must specify a query or a pathquery")
         if not includetrashed:
             query = query + " and not trashed"
-        if self.service is None:
-            raise GoogleDriveException("GoogleDrive object not initialized yet")
-        try:
-            if len(query) > 0:
-                files= self.service.files().list(q=query, fields=fields, orderBy=orderBy).execute()
-        except HttpError as e:
-            msg = "unable to list files from query '%s': %s" %(query, e.reason)
-            if verbose:
-                sys.stdout.write("s\n" % msg)
-            raise GoogleDriveException(msg)
-        fileobjects = files.get('files')
+        for fileobjects in self.iter_pages(query, fields=fields, page_size=page_size, orderBy=orderBy, verbose=verbose):
+            self.prefetch_folders(fileobjects, verbose=verbose)
+            for file in fileobjects:
+                pathlist, pathstring = self.get_path(file=file)
+                if pathquery is None or pathquery == pathstring:
+                    yield pathstring, pathlist[-1], file
+        if verbose:
+            sys.stdout.write("%s\n" % self.pathcache)
+
+    def list_files_in_drive(self, query=None, pathquery=None, fields="files(id,name,size,modifiedTime,parents,properties)", includetrashed=False, verbose=False, orderBy=None):
+        """Queries Google Drive for all files satisfying query
+        Returns:
+                list of file resources
+        """
         files = []
         paths = []
         ids = []
-        for file in fileobjects:
-            pathlist, pathstring = self.get_path(file=file)
-            if pathquery is None or pathquery == pathstring: 
-                ids.append(pathlist[-1])
-                paths.append(pathstring)
-                files.append(file)
+        for path, fileid, file in self.iter_files(query=query, pathquery=pathquery, fields=fields,
+                                                  includetrashed=includetrashed, verbose=verbose, orderBy=orderBy):
+            ids.append(fileid)
+            paths.append(path)
+            files.append(file)
         return paths, ids, files
-    
-    def filter_filepath_in_drive(self, pathquery=None, fields="files(id,name,size,modifiedTime,parents,properties)", includetrashed=False, verbose=False):
-        """Queries Google Drive for all files satisfying query
-        Returns:
-                list of file resources
+
+    def iter_filter_filepath(self, pathquery=None, fields="files(id,name,size,modifiedTime,parents,properties)", includetrashed=False, verbose=False, page_size=1000):
+        """Queries Google Drive for all files in a folder whose path matches the
+        regex in the last component of pathquery, one page at a time
+        Yields:
+                (path, id, file resource) tuples
         """
         if pathquery is None:
             raise GoogleDriveException("You must specify a pathquery")
@@ -351,57 +1512,160 @@ class GoogleDrive(object):
         if pathquery[0] != '/':
             pathquery = '/' + pathquery
         m=re.match("(^/.*?)/?([^/]*?$)",pathquery)
-        if m.groups() is None:
-            raise GoogleDriveException("unable to parse the filepath [%s] with regex %s" % pathquery)
+        if m is None:
+            raise GoogleDriveException("unable to parse the filepath [%s]" % pathquery)
         parentpath = m.groups()[0]
         wildcard = m.groups()[1]
         if len(wildcard) == 0:
             wildcard = '.*'
         if parentpath == '/':
-            try:
-                query = "'root' in parents"
-                if not includetrashed:
-                    query = query + " and not trashed"
-                files= self.service.files().list(q=query, fields=fields).execute()
-            except HttpError as e:
-                msg = "unable to list files from query '%s': %s" %(query, e.reason)
-                if verbose:
-                    sys.stdout.write("s\n" % msg)
-                raise GoogleDriveException(msg)
+            query = "'root' in parents"
+            sep = ''
         else:
             parentpaths, parentids, parents = self.list_files_in_drive(pathquery=parentpath, fields=fields)
             if len(parentids) > 1:
                 raise GoogleDriveException("Found more than one parent path, parent path must reslolve to a single folder")
             if len(parentids) == 0:
                 raise GoogleDriveException("unable to find the parent path %s" % parentpath)
-            parentid = parentids[0]
-            query = "'%s' in parents" % parentid
-            if not includetrashed:
-                query = query + " and not trashed"
-            try:
-                if len(query) > 0:
-                    files= self.service.files().list(q=query, fields=fields).execute()
-            except HttpError as e:
-                msg = "unable to list files from query '%s': %s" %(query, e.reason)
-                if verbose:
-                    sys.stdout.write("s\n" % msg)
-                raise GoogleDriveException(msg)
-        fileobjects = files.get('files')
+            query = "'%s' in parents" % parentids[0]
+            sep = '/'
+        if not includetrashed:
+            query = query + " and not trashed"
+        for fileobjects in self.iter_pages(query, fields=fields, page_size=page_size, verbose=verbose):
+            self.prefetch_folders(fileobjects, verbose=verbose)
+            for file in fileobjects:
+                pathlist, pathstring = self.get_path(file=file)
+                if re.match(parentpath + sep + wildcard,pathstring):
+                    yield pathstring, pathlist[-1], file
+
+    def filter_filepath_in_drive(self, pathquery=None, fields="files(id,name,size,modifiedTime,parents,properties)", includetrashed=False, verbose=False):
+        """Queries Google Drive for all files satisfying query
+        Returns:
+                list of file resources
+        """
         files = []
         paths = []
         ids = []
-        for file in fileobjects:
-            pathlist, pathstring = self.get_path(file=file)
-            if parentpath == '/':
-                sep = ''
-            else:
-                sep = '/'
-            if re.match(parentpath + sep + wildcard,pathstring): 
-                ids.append(pathlist[-1])
-                paths.append(pathstring)
-                files.append(file)
+        for path, fileid, file in self.iter_filter_filepath(pathquery=pathquery, fields=fields,
+                                                            includetrashed=includetrashed, verbose=verbose):
+            ids.append(fileid)
+            paths.append(path)
+            files.append(file)
         return paths, ids, files
 
+    def forget_folders(self, fileids):
+        """Drops fileids from the folder index and the path cache after they were
+        trashed, deleted or moved, so their old paths don't resolve any more"""
+        forgotten = [fileid for fileid in fileids if self.folderindex.pop(fileid, None) is not None]
+        if len(forgotten) > 0:
+            self.pathcache.clear()
+
+    def folder_index_expired(self):
+        """True when the folder index was never loaded or is older than pathcachettl"""
+        return (self.folderindextime is None or
+                (self.folderindexttl is not None and time.monotonic() - self.folderindextime > self.folderindexttl))
+
+    def refresh_folder_index(self, verbose=False):
+        """Reloads the folder index when it is older than pathcachettl, other clients may
+        have renamed, moved or trashed folders since. Without usefolderindex the folders
+        looked up one at a time are forgotten instead.
+        """
+        if not self.folder_index_expired():
+            return
+        # only one thread loads the listing, the others wait for it
+        with self.folderindexlock:
+            if not self.folder_index_expired():
+                return
+            if self.usefolderindex:
+                self.load_folder_index(verbose=verbose)
+            else:
+                self.folderindex = {}
+                self.folderindextime = time.monotonic()
+            self.pathcache.clear()
+
+    def load_folder_index(self, verbose=False):
+        """Load every folder in the drive into the folder index
+        (id -> (name, first parent id)) using paged list calls
+        Returns:
+            the folder index dictionary
+        """
+        if self.service is None:
+            raise GoogleDriveException("GoogleDrive object not initialized yet")
+        query = "mimeType='application/vnd.google-apps.folder'"
+        folderindex = {}
+        # start from scratch, so only folders added while we are loading are kept
+        self.folderindex = {}
+        started = time.monotonic()
+        pagetoken = None
+        while True:
+            try:
+                response = self.execute_request(self.service.files().list(q=query, fields='nextPageToken,files(id,name,parents)',
+                                                     pageSize=1000, pageToken=pagetoken))
+            except apierrors.HttpError as e:
+                msg = "unable to load the folder index: %s" % e.reason
+                if verbose:
+                    sys.stdout.write("%s\n" % msg)
+                raise GoogleDriveException(msg)
+            for folder in response.get('files', []):
+                parents = folder.get('parents')
+                folderindex[folder.get('id')] = (folder.get('name'), parents[0] if parents else None)
+            pagetoken = response.get('nextPageToken')
+            if pagetoken is None:
+                break
+        # keep anything added while we were loading
+        folderindex.update(self.folderindex)
+        self.folderindex = folderindex
+        self.folderindexloaded = True
+        self.folderindextime = started
+        if verbose:
+            sys.stdout.write("Loaded %d folders into the folder index\n" % len(self.folderindex))
+        return self.folderindex
+
+    def prefetch_folders(self, files, verbose=False):
+        """Puts every ancestor folder of files that is missing from the folder
+        index into it, fetching one level of ancestors per batch request
+        """
+        self.refresh_folder_index(verbose=verbose)
+        rootid = self.root.get('id')
+        missing = set()
+        for file in files:
+            parents = file.get('parents')
+            if parents:
+                missing.add(parents[0])
+        while True:
+            missing = [folderid for folderid in missing if folderid != rootid and folderid not in self.folderindex]
+            if len(missing) == 0:
+                break
+            results, errors = self.get_many(missing, fields='id,name,parents', verbose=verbose)
+            nextmissing = set()
+            for folderid, folder in results.items():
+                parents = folder.get('parents')
+                self.folderindex[folderid] = (folder.get('name'), parents[0] if parents else None)
+                if parents:
+                    nextmissing.add(parents[0])
+            # anything that failed is left for get_folder to report
+            missing = nextmissing
+
+    def get_folder(self, folderid, verbose=False):
+        """Look up a folder in the folder index, fetching it from the drive if it isn't there
+        Returns:
+            (name, first parent id) tuple
+        """
+        self.refresh_folder_index(verbose=verbose)
+        entry = self.folderindex.get(folderid)
+        if entry is None:
+            try:
+                folder = self.execute_request(self.service.files().get(fileId=folderid, fields='name,id,parents'))
+            except apierrors.HttpError as e:
+                msg = "unable to find folder from id '%s': %s" % (folderid, e.reason)
+                if verbose:
+                    sys.stdout.write("%s\n" % msg)
+                raise GoogleDriveException(msg)
+            parents = folder.get('parents')
+            entry = (folder.get('name'), parents[0] if parents else None)
+            self.folderindex[folderid] = entry
+        return entry
+
     def get_path(self, file=None, fileid=None, verbose=False):
         """ return the path to the file"""
         if self.service is None:
@@ -412,21 +1676,32 @@ class GoogleDrive(object):
             raise GoogleDriveException("both fileid and file object passed into get_path command. you must specify one or the other")
         try:
             if file is None:
-                file= self.service.files().get(fileId=fileid, fields='name,id,parents').execute()
-        except HttpError:
-            msg = "unable to find file from id '%s'" % str(id)
+                file= self.execute_request(self.service.files().get(fileId=fileid, fields='name,id,parents'))
+        except apierrors.HttpError:
+            msg = "unable to find file from id '%s'" % str(fileid)
             if verbose:
-                sys.stdout.write("s\n" % msg)
+                sys.stdout.write("%s\n" % msg)
             raise GoogleDriveException(msg)
+        rootid = self.root.get('id')
         parents = file.get('parents')
         # only return path traced through the first parent listed for each file
-        
-        if parents is None or self.root.get('id') in parents:
-            # we have found the root directory
-            pathlist = [file.get('id')]
-            return pathlist, '/' + file.get('name')
-        else:
-            parent = self.service.files().get(fileId=parents[0], fields='name,id,parents').execute()
-            pathlist, thisparentpath = self.get_path(file=parent)
-            pathlist.append(file.get('id'))
-            return pathlist, thisparentpath + '/' + file.get('name')
+        parentid = None
+        if parents is not None and rootid not in parents:
+            parentid = parents[0]
+        # walk up until we reach the root or a folder whose path is already known
+        ancestors = []
+        pathlist = []
+        path = ''
+        while parentid is not None and parentid != rootid:
+            cached = self.pathcache.get(parentid)
+            if cached is not None:
+                pathlist, path = cached
+                break
+            name, nextparentid = self.get_folder(parentid, verbose=verbose)
+            ancestors.append((parentid, name))
+            parentid = nextparentid
+        for folderid, name in reversed(ancestors):
+            pathlist = pathlist + [folderid]
+            path = path + '/' + name
+            self.pathcache.put(folderid, (pathlist, path))
+        return pathlist + [file.get('id')], path + '/' + file.get('name')
@@ -0,0 +1,90 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import os
+import sqlite3
+import threading
+
+class HashCache(object):
+    '''
+    Persistent cache of file digests in a SQLite database, keyed by the file's
+    path and validated against its size, modification/change times, inode and
+    device. Files whose stat metadata hasn't changed don't need to be re-read.
+    '''
+    def __init__(self, dbfile):
+        '''
+        Constructor
+        '''
+        self.dbfile = dbfile
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        # paths are stored as bytes so names that aren't valid utf-8 survive
+        self.connection = sqlite3.connect(dbfile, check_same_thread=False)
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS files (
+                                       path BLOB PRIMARY KEY,
+                                       size INTEGER,
+                                       mtime INTEGER,
+                                       ctime INTEGER,
+                                       inode INTEGER,
+                                       device INTEGER,
+                                       digest TEXT)''')
+        self.connection.commit()
+
+    @staticmethod
+    def stat_key(st):
+        return (st.st_size, st.st_mtime_ns, st.st_ctime_ns, st.st_ino, st.st_dev)
+
+    @staticmethod
+    def prefix_range(directory):
+        """first and one past the last key of every path below directory"""
+        prefix = os.fsencode(directory.rstrip('/') + '/')
+        # '0' is the byte after '/'
+        return prefix, prefix[:-1] + b'0'
+
+    def load(self, directory):
+        """returns:
+            dictionary of path -> (stat key, digest) for everything cached below directory
+        """
+        low, high = self.prefix_range(directory)
+        with self.lock:
+            rows = self.connection.execute('SELECT path, size, mtime, ctime, inode, device, digest FROM files WHERE path >= ? AND path < ?',
+                                           (low, high)).fetchall()
+        entries = {}
+        for row in rows:
+            entries[os.fsdecode(row[0])] = (tuple(row[1:6]), row[6])
+        return entries
+
+    def lookup(self, entries, path, st):
+        """returns:
+            the cached digest of path if its stat metadata is unchanged else None
+        """
+        entry = entries.get(path)
+        if entry is not None and entry[0] == self.stat_key(st):
+            self.hits = self.hits + 1
+            return entry[1]
+        self.misses = self.misses + 1
+        return None
+
+    def update(self, directory, hashed, seen):
+        """store freshly hashed (path, stat result, digest) entries and forget every
+        path below directory that wasn't seen in this walk"""
+        low, high = self.prefix_range(directory)
+        with self.lock:
+            self.connection.executemany('INSERT OR REPLACE INTO files (path, size, mtime, ctime, inode, device, digest) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                        [(os.fsencode(path),) + self.stat_key(st) + (digest,) for path, st, digest in hashed])
+            cached = self.connection.execute('SELECT path FROM files WHERE path >= ? AND path < ?', (low, high)).fetchall()
+            seen = set(os.fsencode(path) for path in seen)
+            gone = [(row[0],) for row in cached if row[0] not in seen]
+            self.connection.executemany('DELETE FROM files WHERE path = ?', gone)
+            self.connection.commit()
+        return len(gone)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def __str__(self):
+        return "hash cache hits=%d misses=%d" % (self.hits, self.misses)
@@ -0,0 +1,65 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import socket
+from lazy_import import lazy_import
+requests = lazy_import('requests')
+authrequests = lazy_import('google.auth.transport.requests')
+httplib2 = lazy_import('httplib2')
+
+class PooledHttp(object):
+    '''
+    httplib2.Http stand in for googleapiclient that sends requests through a
+    google.auth AuthorizedSession. Connections are kept alive in a urllib3 pool,
+    so repeated calls don't pay for a new TLS handshake, and one instance can
+    be used from any number of threads at once.
+    '''
+    def __init__(self, credentials, poolsize=10, timeout=120, connecttimeout=30):
+        '''
+        Constructor
+        credentials: google.auth credentials, refreshed by the session when they expire
+        poolsize: most connections kept open per host, threads beyond that wait for one
+        timeout, connecttimeout: seconds to wait for data and for a connection (None waits forever)
+        '''
+        self.credentials = credentials
+        self.poolsize = poolsize
+        self.timeout = timeout
+        self.connecttimeout = connecttimeout
+        self.session = authrequests.AuthorizedSession(credentials)
+        # googleapiclient and the callers in google_drive do their own retries
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=poolsize,
+                                                max_retries=0, pool_block=True)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, uri, method='GET', body=None, headers=None, redirections=5, connection_type=None):
+        """Same signature and result as httplib2.Http.request
+        Returns:
+            httplib2.Response and the response body
+        """
+        try:
+            # like httplib2 only follow redirects of GET and HEAD, a resumable upload
+            # answers a PUT with 308 and that must come back to the caller
+            resp = self.session.request(method, uri, data=body, headers=headers,
+                                        timeout=(self.connecttimeout, self.timeout),
+                                        allow_redirects=method in ('GET', 'HEAD'))
+        except requests.exceptions.Timeout as e:
+            # raise what httplib2 would so the retry logic treats both transports alike
+            raise socket.timeout(str(e)) from e
+        except requests.exceptions.ConnectionError as e:
+            raise ConnectionError(str(e)) from e
+        content = resp.content
+        info = dict((key.lower(), value) for key, value in resp.headers.items())
+        if 'content-encoding' in info and info['content-encoding'] in ('gzip', 'deflate'):
+            # requests has already decompressed the body, report it the way httplib2 does
+            info['-content-encoding'] = info.pop('content-encoding')
+            info['content-length'] = str(len(content))
+        info['status'] = str(resp.status_code)
+        response = httplib2.Response(info)
+        response.reason = resp.reason
+        return response, content
+
+    def close(self):
+        self.session.close()
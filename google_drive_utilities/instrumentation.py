@@ -0,0 +1,244 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+class ApiCall(object):
+    '''
+    What GoogleDrive passes to its hooks after every API call: the method (e.g.
+    drive.files.list, upload, download, batch), the seconds from the first attempt
+    to the result with retries and backoff included, the seconds of that spent
+    waiting to retry, the API requests and bytes it accounted for, how many times
+    it was retried and its status, 'ok' or the HTTP status or exception name it
+    failed with.
+    '''
+    __slots__ = ('method', 'description', 'started', 'seconds', 'waited', 'requests', 'nbytes', 'retries', 'status')
+
+    def __init__(self, method, description, started, seconds, waited=0.0, requests=1, nbytes=0, retries=0, status='ok'):
+        self.method = method
+        self.description = description
+        self.started = started
+        self.seconds = seconds
+        self.waited = waited
+        self.requests = requests
+        self.nbytes = nbytes
+        self.retries = retries
+        self.status = status
+
+    def to_dict(self):
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def __str__(self):
+        return "%s %s %.3fs retries=%d bytes=%d" % (self.description, self.status, self.seconds, self.retries, self.nbytes)
+
+class Histogram(object):
+    '''
+    Counts of observations at or below each bucket boundary, Prometheus style
+    '''
+    # seconds, from a fast metadata call to a big chunk on a slow link
+    buckets = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+    def __init__(self, buckets=None):
+        if buckets is not None:
+            self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count = self.count + 1
+        self.sum = self.sum + value
+        for indx, bucket in enumerate(self.buckets):
+            if value <= bucket:
+                self.counts[indx] = self.counts[indx] + 1
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': OrderedDict(("%g" % bucket, count) for bucket, count in zip(self.buckets, self.counts))}
+
+def labels(**values):
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in sorted(values.items()))
+
+class Metrics(object):
+    '''
+    A GoogleDrive hook that keeps counters of calls, retries, errors and bytes and
+    histograms of latency per API method, plus histograms of the stage times
+    recorded with observe_stage. Export them with to_json (one JSON line) or
+    prometheus (the text exposition format), or write them to a file with write.
+    '''
+    def __init__(self, prefix='gdrive'):
+        '''
+        Constructor
+        '''
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.started = time.time()
+        # (method, status) -> count
+        self.calls = {}
+        self.requests = {}
+        self.retries = {}
+        self.nbytes = {}
+        self.waited = {}
+        self.latency = {}
+        self.stages = {}
+
+    def __call__(self, call):
+        with self.lock:
+            key = (call.method, call.status)
+            self.calls[key] = self.calls.get(key, 0) + 1
+            self.requests[call.method] = self.requests.get(call.method, 0) + call.requests
+            self.retries[call.method] = self.retries.get(call.method, 0) + call.retries
+            self.nbytes[call.method] = self.nbytes.get(call.method, 0) + call.nbytes
+            self.waited[call.method] = self.waited.get(call.method, 0.0) + call.waited
+            if call.method not in self.latency:
+                self.latency[call.method] = Histogram()
+            self.latency[call.method].observe(call.seconds)
+
+    def observe_stage(self, stage, seconds):
+        with self.lock:
+            if stage not in self.stages:
+                self.stages[stage] = Histogram()
+            self.stages[stage].observe(seconds)
+
+    def snapshot(self):
+        """returns:
+            dict of every counter and histogram, ready for json
+        """
+        with self.lock:
+            methods = {}
+            for (method, status), count in sorted(self.calls.items()):
+                entry = methods.setdefault(method, {'calls': {}, 'requests': self.requests.get(method, 0),
+                                                    'retries': self.retries.get(method, 0),
+                                                    'bytes': self.nbytes.get(method, 0),
+                                                    'waited': self.waited.get(method, 0.0),
+                                                    'latency': self.latency[method].to_dict()})
+                entry['calls'][status] = count
+            return {'time': time.time(),
+                    'started': self.started,
+                    'methods': methods,
+                    'stages': dict((stage, histogram.to_dict()) for stage, histogram in sorted(self.stages.items()))}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), sort_keys=True)
+
+    def histogram_lines(self, name, histogram, **values):
+        lines = []
+        for bucket, count in zip(histogram.buckets, histogram.counts):
+            lines.append("%s_bucket%s %d" % (name, labels(le="%g" % bucket, **values), count))
+        lines.append("%s_bucket%s %d" % (name, labels(le="+Inf", **values), histogram.count))
+        lines.append("%s_sum%s %.6f" % (name, labels(**values), histogram.sum))
+        lines.append("%s_count%s %d" % (name, labels(**values), histogram.count))
+        return lines
+
+    def prometheus(self):
+        """returns:
+            the metrics in the Prometheus text exposition format
+        """
+        p = self.prefix
+        with self.lock:
+            lines = ["# HELP %s_api_calls_total API calls by method and final status" % p,
+                     "# TYPE %s_api_calls_total counter" % p]
+            for (method, status), count in sorted(self.calls.items()):
+                lines.append("%s_api_calls_total%s %d" % (p, labels(method=method, status=status), count))
+            for name, values, help in (('api_requests_total', self.requests, "API requests accounted for, a batch counts each request in it"),
+                                       ('api_retries_total', self.retries, "retries of API calls"),
+                                       ('api_bytes_total', self.nbytes, "bytes uploaded or downloaded"),
+                                       ('api_retry_wait_seconds_total', self.waited, "seconds spent waiting to retry")):
+                lines.append("# HELP %s_%s %s" % (p, name, help))
+                lines.append("# TYPE %s_%s counter" % (p, name))
+                for method, value in sorted(values.items()):
+                    lines.append("%s_%s%s %s" % (p, name, labels(method=method), value))
+            lines.append("# HELP %s_api_call_seconds API call latency, retries included" % p)
+            lines.append("# TYPE %s_api_call_seconds histogram" % p)
+            for method, histogram in sorted(self.latency.items()):
+                lines.extend(self.histogram_lines("%s_api_call_seconds" % p, histogram, method=method))
+            if self.stages:
+                lines.append("# HELP %s_stage_seconds time spent in each stage of a job" % p)
+                lines.append("# TYPE %s_stage_seconds histogram" % p)
+                for stage, histogram in sorted(self.stages.items()):
+                    lines.extend(self.histogram_lines("%s_stage_seconds" % p, histogram, stage=stage))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, filename):
+        """write the metrics to filename: Prometheus text replacing the file if it ends
+        in .prom (e.g. for the node exporter textfile collector), else one JSON line
+        appended to it
+        """
+        if filename.endswith('.prom'):
+            # write then rename so a scraper never reads half a file
+            tmpfile = "%s.%d" % (filename, os.getpid())
+            with open(tmpfile, 'w') as f:
+                f.write(self.prometheus())
+            os.replace(tmpfile, filename)
+        else:
+            with open(filename, 'a') as f:
+                f.write(self.to_json() + '\n')
+
+    def __str__(self):
+        with self.lock:
+            methods = sorted(self.latency.items())
+            return "api calls " + ' '.join("%s=%d/%.1fs" % (method, histogram.count, histogram.sum) for method, histogram in methods)
+
+class CallLog(object):
+    '''
+    A GoogleDrive hook that appends every API call to filename as a JSON line
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.file = open(filename, 'a')
+
+    def __call__(self, call):
+        line = json.dumps(call.to_dict(), sort_keys=True)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class StageTimer(object):
+    '''
+    Wall clock time spent in the named stages of one job, e.g. hashing, tarring and
+    uploading a directory. Stages entered more than once add up. Given metrics, each
+    stage is also observed there when it ends.
+    '''
+    def __init__(self, metrics=None):
+        self.metrics = metrics
+        self.times = OrderedDict()
+
+    @contextmanager
+    def stage(self, name):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - started)
+
+    def add(self, name, seconds):
+        self.times[name] = self.times.get(name, 0.0) + seconds
+        if self.metrics is not None:
+            self.metrics.observe_stage(name, seconds)
+
+    def total(self):
+        return sum(self.times.values())
+
+    def slowest(self):
+        """returns:
+            name of the stage that took longest or None
+        """
+        if not self.times:
+            return None
+        return max(self.times.items(), key=lambda item: item[1])[0]
+
+    def __str__(self):
+        return ' '.join("%s %.2fs" % item for item in self.times.items()) + " (total %.2fs)" % self.total()
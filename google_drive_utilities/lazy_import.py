@@ -0,0 +1,42 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import importlib
+import threading
+
+class LazyModule(object):
+    '''
+    Stands in for a module and only imports it the first time one of its
+    attributes is used, so code paths that never need it don't pay for it.
+    '''
+    def __init__(self, name):
+        self.__dict__['_name'] = name
+        self.__dict__['_module'] = None
+        self.__dict__['_lock'] = threading.Lock()
+
+    def _load(self):
+        module = self.__dict__['_module']
+        if module is None:
+            with self.__dict__['_lock']:
+                module = self.__dict__['_module']
+                if module is None:
+                    module = importlib.import_module(self.__dict__['_name'])
+                    self.__dict__['_module'] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return "<lazy module '%s'>" % self.__dict__['_name']
+
+def lazy_import(name):
+    """returns:
+        a stand in for the module name that imports it on first use
+    """
+    return LazyModule(name)
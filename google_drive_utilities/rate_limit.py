@@ -0,0 +1,109 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import os
+import time
+import threading
+
+class TokenBucket(object):
+    '''
+    Thread safe token bucket that refills at rate tokens per second up to capacity.
+    If statefile is given the bucket lives in that file, guarded by flock, so every
+    process using the same file draws from the same bucket.
+    '''
+    def __init__(self, rate, capacity=None, statefile=None):
+        '''
+        Constructor
+        '''
+        self.rate = float(rate)
+        if capacity is None:
+            # allow up to one second worth of burst
+            capacity = max(1.0, self.rate)
+        self.capacity = float(capacity)
+        self.statefile = statefile
+        self.lock = threading.Lock()
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.waited = 0.0
+
+    def take(self, tokens, now):
+        """refill by the time elapsed since the last update and take tokens if enough are there
+        returns:
+            0 if the tokens were taken else the number of seconds to wait before trying again
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        # requests bigger than the bucket wait for a full bucket and leave it in debt
+        needed = min(tokens, self.capacity)
+        if self.tokens >= needed:
+            self.tokens = self.tokens - tokens
+            return 0
+        return (needed - self.tokens) / self.rate
+
+    def take_shared(self, tokens):
+        import fcntl
+        fd = os.open(self.statefile, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            state = os.read(fd, 64).split()
+            now = time.time()
+            if len(state) == 2:
+                self.tokens = float(state[0])
+                self.updated = min(float(state[1]), now)
+            wait = self.take(tokens, now)
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, ("%r %r" % (self.tokens, self.updated)).encode())
+            return wait
+        finally:
+            # closing the descriptor releases the lock
+            os.close(fd)
+
+    def acquire(self, tokens=1):
+        """block until tokens are available and take them"""
+        while True:
+            with self.lock:
+                if self.statefile is None:
+                    wait = self.take(tokens, time.time())
+                else:
+                    wait = self.take_shared(tokens)
+                if wait > 0:
+                    self.waited = self.waited + wait
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+class RateLimiter(object):
+    '''
+    Limits API calls to requestspersecond and transferred data to bytespersecond.
+    Either limit may be None to leave it unlimited. With statefile the limits are
+    shared by every process pointing at the same file.
+    '''
+    def __init__(self, requestspersecond=None, bytespersecond=None, statefile=None):
+        '''
+        Constructor
+        '''
+        self.requests = None
+        self.bytes = None
+        if requestspersecond is not None:
+            self.requests = TokenBucket(requestspersecond,
+                                        statefile=None if statefile is None else statefile + '.requests')
+        if bytespersecond is not None:
+            self.bytes = TokenBucket(bytespersecond,
+                                     statefile=None if statefile is None else statefile + '.bytes')
+
+    def acquire(self, requests=1, nbytes=0):
+        """block until requests API calls transferring nbytes are allowed"""
+        if self.requests is not None and requests > 0:
+            self.requests.acquire(requests)
+        if self.bytes is not None and nbytes > 0:
+            self.bytes.acquire(nbytes)
+
+    def __str__(self):
+        waited = 0.0
+        for bucket in (self.requests, self.bytes):
+            if bucket is not None:
+                waited = waited + bucket.waited
+        return "rate limiter waited %.1f seconds" % waited
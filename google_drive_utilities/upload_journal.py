@@ -0,0 +1,116 @@
+'''
+Created on Oct 17, 2026
+
+@author: grovesr
+'''
+import os
+import json
+import time
+import threading
+
+class UploadJournal(object):
+    '''
+    Remembers the resumable upload sessions of local files in a JSON file, so an
+    upload interrupted by the process dying can carry on where the server left off
+    the next time the same file is uploaded.
+    Entries are keyed by the absolute path of the file and are only handed back
+    while the file's size and modification time (and checksum if one was given)
+    are unchanged and the session is younger than maxage seconds.
+    '''
+    # Drive forgets resumable sessions after a week
+    maxage = 6*24*60*60
+
+    def __init__(self, journalfile):
+        '''
+        Constructor
+        '''
+        self.journalfile = journalfile
+        self.lock = threading.Lock()
+
+    def read(self):
+        try:
+            with open(self.journalfile) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def write(self, entries):
+        try:
+            # write then rename so a crash never leaves half a journal
+            tmpfile = "%s.%d.%d" % (self.journalfile, os.getpid(), threading.get_ident())
+            with open(tmpfile, 'w') as f:
+                json.dump(entries, f, indent=1)
+            os.replace(tmpfile, self.journalfile)
+        except OSError:
+            pass
+
+    def is_current(self, filename, entry, checksum=None):
+        """True if entry still describes filename and its session may still be open"""
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return False
+        if entry.get('size') != st.st_size or entry.get('mtime') != st.st_mtime_ns:
+            return False
+        if checksum is not None and entry.get('checksum') != checksum:
+            return False
+        return time.time() - entry.get('started', 0) < self.maxage
+
+    def get(self, filename, parentpath, checksum=None):
+        """returns:
+            the journal entry of an unfinished upload of filename into parentpath or None
+        """
+        filename = os.path.abspath(filename)
+        with self.lock:
+            entry = self.read().get(filename)
+        if entry is None or entry.get('parentpath') != parentpath or not self.is_current(filename, entry, checksum):
+            return None
+        return entry
+
+    def find(self, prefix, parentpath, checksum):
+        """returns:
+            path of a local file named prefix* with an unfinished upload into parentpath
+            of the same checksum, or None
+        """
+        with self.lock:
+            entries = self.read()
+        for filename, entry in entries.items():
+            if os.path.basename(filename).startswith(prefix) and entry.get('parentpath') == parentpath and \
+                    self.is_current(filename, entry, checksum):
+                return filename
+        return None
+
+    def put(self, filename, sessionuri, parentpath, checksum=None):
+        """record that filename is being uploaded into parentpath through sessionuri"""
+        filename = os.path.abspath(filename)
+        st = os.stat(filename)
+        with self.lock:
+            entries = self.read()
+            # forget sessions that can't be resumed any more
+            for name in list(entries):
+                if not self.is_current(name, entries[name]):
+                    del entries[name]
+            entries[filename] = {'sessionuri': sessionuri,
+                                 'parentpath': parentpath,
+                                 'checksum': checksum,
+                                 'size': st.st_size,
+                                 'mtime': st.st_mtime_ns,
+                                 'offset': 0,
+                                 'started': time.time()}
+            self.write(entries)
+
+    def update(self, filename, offset):
+        """record how far the upload of filename has got"""
+        filename = os.path.abspath(filename)
+        with self.lock:
+            entries = self.read()
+            if filename in entries:
+                entries[filename]['offset'] = offset
+                self.write(entries)
+
+    def remove(self, filename):
+        filename = os.path.abspath(filename)
+        with self.lock:
+            entries = self.read()
+            if entries.pop(filename, None) is not None:
+                self.write(entries)
@@ -18,17 +18,25 @@ import json
 import logging
 import glob
 import re
+import locale
 sys.path.insert(0, os.path.expanduser("~/git/google-drive-utilities/google_drive_utilities"))
 from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 from google_drive import GoogleDrive
 from google_drive import GoogleDriveException
-from logging.handlers import SMTPHandler
+from rate_limit import RateLimiter
+from backup_archive import ArchiveStream, ArchiveException, write_tar, deletion_list, extract_archive, remove_members
+from backup_manifest import BackupManifest
+from compression import CODECS, default_level, check_codec, compress_writer, CompressibilityProbe, CompressionException
+from chunk_store import ContentChunker, ChunkIndex, ChunkStore, ChunkStoreException, ChunkReader, write_snapshot, read_snapshot
+from dir_hash import DirectoryHasher, collation_key
+from hash_cache import HashCache
+from instrumentation import Metrics, CallLog, StageTimer
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from subprocess import run, PIPE, CalledProcessError
 from pathlib import Path
-from hashlib import md5
 
 logger = logging.getLogger(__name__)
 
@@ -110,6 +118,8 @@ def setup_logging(settings):
         isSecure = None
         if emailUseTLS == "True":
             isSecure = ()
+        # only pay for importing the smtp machinery when email logging is on
+        from logging.handlers import SMTPHandler
         smtpHandler = SMTPHandler((emailHost, emailPort),
                                   emailFromUser,
                                   adminemail,
@@ -123,6 +133,697 @@ def setup_logging(settings):
         logger.warning("Test of logging capabilities for warning messages")
         logger.error("Test of logging capabilities for error messages")
         
+def backup_root(directory, parentname, excludestring):
+    """returns:
+        the prefix of the names of every backup of directory
+    """
+    return directory.replace(os.path.sep,'_')[1:] + excludestring.replace(re.sub('[\-/]','_',parentname), '').replace('__','_')
+
+# the archive extension of each codec, the codec property tells restores how to unpack
+ARCHIVEEXTENSIONS = {'gzip': '.tgz', 'zstd': '.tar.zst'}
+BACKUPEXTENSION = re.compile(r'(\.incr)?(%s)$' % '|'.join(re.escape(extension) for extension in list(ARCHIVEEXTENSIONS.values()) + ['.snapshot']))
+
+def is_incremental(name):
+    match = BACKUPEXTENSION.search(name)
+    return match is not None and match.group(1) is not None
+
+def backup_extension(options):
+    """returns:
+        the extension of the backup files made with these options
+    """
+    return '.snapshot' if options['dedupe'] else ARCHIVEEXTENSIONS[options['codec']]
+
+def backup_extensions(options):
+    """returns:
+        the extensions of every backup the lookups have to find, archives made with
+        any codec for tarball backups
+    """
+    return ('.snapshot',) if options['dedupe'] else tuple(ARCHIVEEXTENSIONS.values())
+
+def backup_query(backuproot, extensions):
+    """returns:
+        the part of a Drive query matching the backups of backuproot with any of extensions
+    """
+    return "name contains '%s' and (%s)" % (backuproot, ' or '.join("name contains '%s'" % extension[1:] for extension in extensions))
+
+def md5_name(name):
+    """returns:
+        the name of the md5 file uploaded with the backup name
+    """
+    match = BACKUPEXTENSION.search(name)
+    return name[:match.start(2)] + '.md5' if match is not None else name
+
+def backup_stamp(name, backuproot):
+    """returns:
+        the time stamp part of a backup name
+    """
+    return name[len(backuproot) + 1:BACKUPEXTENSION.search(name).start()]
+
+def plan_incremental(directory, dirname, digests, backuproot, backups, options):
+    """
+    decide between a full and an incremental backup of directory. An incremental
+    needs the manifest saved by the last run to describe the newest backup on
+    Google Drive, the full backup it builds on to still be there and fewer than
+    fullevery backups in the chain.
+    returns the manifest to save once the backup is uploaded, the manifest of the
+    backup it builds on (None for a full backup), the (path, member name) pairs to
+    archive (None for a full backup) and the deleted member names
+    """
+    prefix = directory.rstrip(os.path.sep)
+    files = {}
+    paths = {}
+    for path, digest in digests.items():
+        name = dirname + path[len(prefix):]
+        files[name] = digest
+        paths[name] = path
+    names = [file.get("name") for file in backups]
+    previous = BackupManifest.load(options['manifestdir'], backuproot)
+    if (previous is None or len(names) == 0 or previous.last != names[0] or previous.full not in names
+            or previous.incrementals + 1 >= options['fullevery']):
+        return BackupManifest(backuproot, files=files), None, None, []
+    changed, deleted = previous.diff(files)
+    manifest = BackupManifest(backuproot, files=files, full=previous.full, incrementals=previous.incrementals + 1)
+    return manifest, previous, [(paths[name], name) for name in changed], deleted
+
+def forget_skipped(job, skipped):
+    """
+    a member that couldn't be archived isn't in the backup, leave it out of the
+    manifest so the next incremental picks it up again
+    """
+    manifest = job['manifest']
+    if manifest is None:
+        return
+    previous = {}
+    if job['previous'] is not None:
+        previous = job['previous'].files
+    for member, reason in skipped:
+        if member in previous:
+            # the version in the backups before this one is what a restore gets
+            manifest.files[member] = previous[member]
+        else:
+            manifest.files.pop(member, None)
+
+def report_skipped(skipped, options):
+    for member, reason in skipped:
+        if options['verbose']:
+            sys.stdout.write("skipped %s: %s\n" % (member, reason))
+        else:
+            logger.info("skipped %s: %s" % (member, reason))
+
+def compression_probe(options):
+    """returns:
+        a CompressibilityProbe to pick the files an archive stores as is or None
+        when every file is compressed
+    """
+    if options['compressall'] or options['codec'] != 'gzip':
+        # zstd already stores blocks it can't shrink as is, and quickly
+        return None
+    return CompressibilityProbe(compresslevel=options['compresslevel'], threshold=options['compressthreshold'])
+
+def report_compression(directory, probe, options):
+    if probe is None:
+        return
+    msg = "compression of %s: %s" % (directory, str(probe))
+    if options['verbose']:
+        sys.stdout.write("%s\n" % msg)
+    else:
+        logger.info(msg)
+
+def archive_directory(gdrive, directory, options):
+    """
+    cpu bound stage: checksum the directory, check whether an identical backup
+    is already on Google Drive and tar the directory up if it isn't.
+    returns the job to hand to the upload stage or None if there is nothing to upload
+    """
+    verbose = options['verbose']
+    DEBUG = options['DEBUG']
+    excludefolders = options['excludefolders']
+    directory = os.path.expanduser(directory)
+    path = Path(directory)
+    parentname = str(path.parent.absolute())
+    dirname = path.parts[-1]
+    if not os.path.exists(directory):
+        if verbose:
+            sys.stdout.write("directory %s doesn't exist. Ignoring\n" % directory)
+        else:
+            logger.info("directory %s doesn't exist. Ignoring" % directory)
+        return None
+    if verbose:
+        sys.stdout.write("Checking md5sum of %s\n" % (directory))
+    # in process version of find -L directory -not -path "exclude/*" -type f | sort | xargs -n 1 md5sum | md5sum
+    stages = StageTimer(options['metrics'])
+    options['stages'][directory] = stages
+    hasher = DirectoryHasher(excludefolders=excludefolders, jobs=options['hashjobs'], sortkey=collation_key,
+                             cache=options['hashcache'], verbose=DEBUG)
+    with stages.stage('hash'):
+        digests = hasher.digest_directory(directory)
+        checksum, md5lines = hasher.summarize(digests)
+
+    backuproot = backup_root(directory, parentname, options['excludestring'])
+    # check to see if this file already exists on Drive, if so check its checksum
+    utcnow = datetime.utcnow().isoformat()
+    extension = backup_extension(options)
+    # backups made with another codec belong to the same chain
+    extensions = backup_extensions(options)
+    with stages.stage('lookup'):
+        oldpaths, oldids, oldfiles = gdrive.list_files_in_drive(query="modifiedTime < '%sZ' and %s" % (utcnow, backup_query(backuproot, extensions)), verbose=DEBUG)
+    backups = []
+    for indx, file in enumerate(oldfiles):
+        if file.get("name").startswith(backuproot + '.') and file.get("name").endswith(extensions) and oldpaths[indx] == "%s/%s" % (options['backupfolder'], file.get("name")):
+            backups.append(file)
+    # the time stamps in the names sort the backups newest first
+    backups.sort(key=lambda file: file.get("name"), reverse=True)
+    candidates = oldfiles
+    if options['incremental']:
+        # only the newest backup can be compared, an incremental always extends it
+        candidates = backups[:1]
+    for file in candidates:
+        # double check that the file is really a match
+        if backuproot in file.get("name") and file.get("name").endswith(extensions):
+            properties = file.get('properties', None)
+            if properties is not None:
+                oldchecksum = properties.get('checksum', None)
+                if oldchecksum is not None and verbose:
+                    sys.stdout.write("new checksum=%s, drive checksum=%s\n" % (checksum, oldchecksum))
+                if oldchecksum == checksum and not options['forceupload']:
+                    options['exists'].append("filename=%s/%s already exists and is identical" % (options['backupfolder'], file.get("name")))
+                    return None
+    manifest = None
+    previous = None
+    members = None
+    deleted = []
+    if options['incremental']:
+        manifest, previous, members, deleted = plan_incremental(directory, dirname, digests, backuproot, backups, options)
+    suffix = '.incr' if members is not None else ''
+    utcnow = datetime.now().isoformat().replace(':', '.')
+    resumefile = None
+    if not options['streamupload'] and not options['dedupe'] and gdrive.journal is not None:
+        # an earlier run died uploading an archive of the same contents, finish that upload
+        resumefile = gdrive.journal.find(backuproot + '.', options['backupfolder'], checksum)
+        if resumefile is not None and is_incremental(resumefile) != (members is not None):
+            # a full backup isn't a substitute for an incremental or the other way round
+            resumefile = None
+    if resumefile is not None:
+        utcnow = backup_stamp(os.path.basename(resumefile), backuproot)
+    backupname = "%s.%s%s%s" % (backuproot, utcnow, suffix, extension)
+    backupfile = "%s%s%s" %('/tmp',os.path.sep, backupname)
+    md5file = None
+    if options['writemd5']:
+        md5file = "%s%s%s.%s%s.md5" %('/tmp',os.path.sep, backuproot, utcnow, suffix)
+        with open(md5file, 'w') as f:
+            f.write(md5lines)
+    # restores pick the decompressor from the codec property
+    properties = {'backup': 'full', 'codec': options['codec'], 'level': str(options['compresslevel'])}
+    if manifest is not None:
+        manifest.last = backupname
+        manifest.checksum = checksum
+        if members is None:
+            manifest.full = backupname
+        else:
+            # restore checks that the chain of incrementals has no gaps
+            properties.update({'backup': 'incremental', 'previous': backup_stamp(backups[0].get("name"), backuproot)})
+            msg = "incremental backup %d of %s: %d changed or added, %d deleted files" % (manifest.incrementals, directory, len(members), len(deleted))
+            if verbose:
+                sys.stdout.write("%s\n" % msg)
+            else:
+                logger.info(msg)
+    job = {'directory': directory,
+           'parentname': parentname,
+           'dirname': dirname,
+           'backuproot': backuproot,
+           'backupname': backupname,
+           'backupfile': backupfile,
+           'md5file': md5file,
+           'checksum': checksum,
+           'oldfiles': oldfiles,
+           'backups': backups,
+           'manifest': manifest,
+           'previous': previous,
+           'members': members,
+           'deleted': deleted,
+           'properties': properties,
+           'probe': compression_probe(options),
+           'stages': stages}
+    if options['streamupload'] or options['dedupe']:
+        # the upload stage tars straight into the upload, nothing is staged in /tmp
+        job['backupfile'] = None
+        return job
+    if resumefile is not None:
+        if verbose:
+            sys.stdout.write("Resuming the interrupted upload of %s\n" % backupfile)
+        else:
+            logger.info("Resuming the interrupted upload of %s" % backupfile)
+        return job
+    if members is not None or job['probe'] is not None:
+        # only the changed files and the list of deleted ones go into an incremental,
+        # and tar can't store some files without compressing them
+        extra = None
+        if verbose and members is not None:
+            sys.stdout.write("Taring %d changed files of %s to %s\n" % (len(members), directory, backupfile))
+        elif verbose:
+            sys.stdout.write("Taring %s to %s\n" % (directory, backupfile))
+        if members is not None:
+            extra = [deletion_list(deleted)]
+        with stages.stage('tar'):
+            try:
+                with open(backupfile, 'wb') as f:
+                    skipped = write_tar(f, parentname, dirname, excludefolders=excludefolders, members=members, extra=extra,
+                                        codec=options['codec'], compresslevel=options['compresslevel'], jobs=options['compressjobs'],
+                                        probe=job['probe'])
+            except (OSError, CompressionException) as e:
+                if verbose:
+                    sys.stdout.write("unable to tar directory=%s Error='%s'\n" % (directory, str(e)))
+                else:
+                    logger.error("unable to tar directory=%s Error='%s'" % (directory, str(e)))
+                return None
+        forget_skipped(job, skipped)
+        report_skipped(skipped, options)
+        report_compression(directory, job['probe'], options)
+        return job
+    from subprocess import run, PIPE, CalledProcessError
+    # include files accessed through symbolic links        
+    tarargs = ['tar', '--dereference']
+    if excludefolders is not None:
+        for excludefolder in excludefolders:
+            tarargs.extend(['--exclude', excludefolder.replace(parentname, '')[1:]])
+    # gzip in tar only uses one core, anything else is compressed in process
+    intar = options['codec'] == 'gzip' and options['compressjobs'] == 1 and options['compresslevel'] == default_level('gzip')
+    # use ustar format to ensure we don't change checksum for changed file attributes that don't change file contents 
+    if intar:
+        tarargs.extend(["--format", "ustar", "-czf", backupfile,"--directory", parentname, dirname])
+    else:
+        tarargs.extend(["--format", "ustar", "-cf", "-", "--directory", parentname, dirname])
+    tarcommand = ' '.join(tarargs)
+    if verbose:
+        sys.stdout.write("Taring %s to %s\n" % (directory, backupfile))
+        sys.stdout.write("using command: %s\n" % tarcommand)
+        if not intar:
+            sys.stdout.write("compressing with %s level %d on %d cores\n" % (options['codec'], options['compresslevel'], options['compressjobs']))
+    with stages.stage('tar'):
+        if not intar:
+            try:
+                compress_tar(tarargs, backupfile, options)
+            except (OSError, CompressionException) as e:
+                if verbose:
+                    sys.stdout.write("unable to tar directory=%s Error='%s'\n" % (directory, str(e)))
+                else:
+                    logger.error("unable to tar directory=%s Error='%s'" % (directory, str(e)))
+                return None
+            return job
+        try:
+            # don't check return code in case some file is inaccessible
+            run(tarargs, stderr=PIPE, check=False)
+        except CalledProcessError as e:
+            # try again after a 5 second delay
+            time.sleep(5)
+            try:
+                run(tarargs, stderr=PIPE, check=True)
+            except CalledProcessError as e:
+                if gdrive.verbose:
+                    sys.stdout.write("unable to tar directory=%s Error='%s'\n" % (directory, e.stderr.decode()))
+                else:
+                    logger.error("unable to tar directory=%s Error='%s'" % (directory, e.stderr.decode()))
+                return None
+    return job
+
+def compress_tar(tarargs, backupfile, options):
+    """
+    run tar writing a plain archive to its stdout and compress that into backupfile
+    in process, with the codec and level of the options on compressjobs cores
+    """
+    from subprocess import Popen, PIPE, DEVNULL
+    with open(backupfile, 'wb') as f:
+        writer = compress_writer(f, codec=options['codec'], compresslevel=options['compresslevel'], jobs=options['compressjobs'])
+        # don't check return code in case some file is inaccessible
+        process = Popen(tarargs, stdout=PIPE, stderr=DEVNULL)
+        try:
+            data = process.stdout.read(1024*1024)
+            while data:
+                writer.write(data)
+                data = process.stdout.read(1024*1024)
+        finally:
+            process.stdout.close()
+            process.wait()
+            writer.close()
+
+def upload_snapshot(gdrive, job, options):
+    """
+    tar the directory into the chunk store, uploading only the chunks it doesn't
+    have yet, then upload the snapshot listing the chunks of the tar in order
+    returns the path, id and file resource of the snapshot, None for the id if
+    the directory couldn't be archived
+    """
+    verbose = options['verbose']
+    DEBUG = options['DEBUG']
+    directory = job['directory']
+    store = options['chunkstore']
+    if verbose:
+        sys.stdout.write("Taring %s into the chunk store of %s\n" % (directory, options['backupfolder']))
+    for attempt in range(2):
+        # a plain tar, compressing the whole stream would hide the repeats between runs
+        stream = ArchiveStream(job['parentname'], job['dirname'], excludefolders=options['excludefolders'], codec=None)
+        try:
+            chunks, uploaded, uploadedbytes = store.store(stream, options['chunker'])
+            break
+        except ChunkStoreException as e:
+            if attempt > 0:
+                if verbose:
+                    sys.stdout.write("unable to store directory=%s Error='%s'\n" % (directory, str(e)))
+                else:
+                    logger.error("unable to store directory=%s Error='%s'" % (directory, str(e)))
+                return None, None, None
+            # chunks were trashed behind the index's back, the second pass uploads them again
+            if verbose:
+                sys.stdout.write("%s, storing %s again\n" % (str(e), directory))
+            else:
+                logger.warning("%s, storing %s again" % (str(e), directory))
+        except ArchiveException as e:
+            if verbose:
+                sys.stdout.write("unable to tar directory=%s Error='%s'\n" % (directory, str(e)))
+            else:
+                logger.error("unable to tar directory=%s Error='%s'" % (directory, str(e)))
+            return None, None, None
+        finally:
+            stream.close()
+    report_skipped(stream.skipped, options)
+    msg = "%s: %d chunks, %d new (%.1f MiB uploaded)" % (directory, len(chunks), uploaded, uploadedbytes / (1024.0*1024.0))
+    if verbose:
+        sys.stdout.write("%s\n" % msg)
+    else:
+        logger.info(msg)
+    data = write_snapshot(chunks, directory=directory, checksum=job['checksum'], created=time.time())
+    properties = {'backup': 'snapshot', 'checksum': job['checksum']}
+    file = gdrive.upload_bytes(data, job['backupname'], [options['backupfolderid']], properties=properties, verbose=DEBUG)
+    return "%s/%s" % (options['backupfolder'], job['backupname']), file.get('id'), file
+
+def upload_archive(gdrive, job, options):
+    """
+    network bound stage: upload the archive made by archive_directory, remove the
+    local copy and prune the old backups of the directory from Google Drive
+    """
+    verbose = options['verbose']
+    DEBUG = options['DEBUG']
+    backupfolder = options['backupfolder']
+    directory = job['directory']
+    backuproot = job['backuproot']
+    md5file = job['md5file']
+    stages = job['stages']
+    # with streamupload the tar runs inside the upload, so its time counts as upload
+    with stages.stage('upload'):
+        if options['dedupe']:
+            uploadedpath, uploadedid, uploadedfile = upload_snapshot(gdrive, job, options)
+        elif job['backupfile'] is None:
+            if verbose:
+                sys.stdout.write("Taring %s straight into %s/%s\n" % (directory, backupfolder, job['backupname']))
+            extra = None
+            if job['members'] is not None:
+                extra = [deletion_list(job['deleted'])]
+            stream = ArchiveStream(job['parentname'], job['dirname'], excludefolders=options['excludefolders'],
+                                   members=job['members'], extra=extra, codec=options['codec'],
+                                   compresslevel=options['compresslevel'], jobs=options['compressjobs'], probe=job['probe'])
+            try:
+                uploadedpath, uploadedid, uploadedfile = gdrive.upload_stream(stream, job['backupname'], parentpath=backupfolder, checksum=job['checksum'],
+                                                                              properties=job['properties'], verbose=DEBUG)
+            except ArchiveException as e:
+                if verbose:
+                    sys.stdout.write("unable to tar directory=%s Error='%s'\n" % (directory, str(e)))
+                else:
+                    logger.error("unable to tar directory=%s Error='%s'" % (directory, str(e)))
+                uploadedid = None
+            finally:
+                stream.close()
+            forget_skipped(job, stream.skipped)
+            report_skipped(stream.skipped, options)
+            if uploadedid is not None:
+                report_compression(directory, job['probe'], options)
+        else:
+            uploadedpath, uploadedid, uploadedfile = gdrive.upload_file_to_path(filename=job['backupfile'], parentpath=backupfolder, checksum=job['checksum'],
+                                                                                properties=job['properties'], verbose=DEBUG)
+        if uploadedid is not None:
+            options['successful'].append(directory + (" (filename=%s, size=%s)" % (uploadedpath, uploadedfile.get("size"))))
+            if md5file is not None:
+                md5path, md5id, md5file = gdrive.upload_file_to_path(filename=md5file, parentpath=backupfolder, verbose=DEBUG)
+    from subprocess import run, PIPE, CalledProcessError
+    for rmfile in glob.glob("%s*" % os.path.join('/tmp', backuproot)):
+        fileToRemove = os.path.join('/tmp', rmfile)
+        try:
+            run(["rm", fileToRemove], stderr=PIPE, check=True)
+            if verbose:
+                sys.stdout.write("removing %s from filesystem\n" % fileToRemove)
+        except CalledProcessError as e:
+            if verbose:
+                sys.stdout.write("unable to remove %s, Error='%s'\n" % (fileToRemove, e.stderr.decode()))
+            else:
+                logger.error("unable to remove %s, Error='%s'" % (fileToRemove, e.stderr.decode()))
+            continue
+    if uploadedid is None:
+        # keep the old backups when the new one didn't make it
+        return
+    if job['manifest'] is not None:
+        # the next incremental is diffed against what was just uploaded
+        job['manifest'].save(options['manifestdir'])
+    with stages.stage('prune'):
+        prune_backups(gdrive, job, options)
+
+def expired_chains(job, keepfiles):
+    """
+    with incremental backups keepfiles counts full backups, an incremental is kept
+    as long as the full backup it builds on is
+    returns the old backups that are no longer needed
+    """
+    fulls = 0 if is_incremental(job['backupname']) else 1
+    expired = []
+    for file in job['backups']:
+        if fulls >= keepfiles:
+            expired.append(file)
+        elif not is_incremental(file.get("name")):
+            fulls = fulls + 1
+    return expired
+
+def prune_backups(gdrive, job, options):
+    """
+    trash all but the newest keepfiles backups of the directory (and their md5 files)
+    """
+    verbose = options['verbose']
+    DEBUG = options['DEBUG']
+    backupfolder = options['backupfolder']
+    backuproot = job['backuproot']
+    if options['incremental']:
+        prunefiles = expired_chains(job, options['keepfiles'])
+    else:
+        indx = 1
+        prunefiles = []
+        for file in  job['oldfiles']:
+            if backuproot in file.get("name"):
+                # double check the name comparison here
+                if indx >= options['keepfiles']:
+                    prunefiles.append(file)
+                indx = indx + 1
+    pruneids = []
+    prunemd5names = []
+    for file in prunefiles:
+        pruneids.append(file.get('id'))
+        prunemd5names.append(md5_name(file.get("name")))
+        if verbose:
+            pathlist, thispath = gdrive.get_path(file=file, verbose=DEBUG)
+            sys.stdout.write("removing %s from Google Drive\n" % thispath)
+    if len(pruneids) > 0:
+        # find the matching md5 files with one listing instead of one lookup per file
+        md5paths, md5ids, md5files = gdrive.list_files_in_drive(query="name contains '%s' and name contains 'md5'" % backuproot, verbose=DEBUG)
+        for indx, md5file in enumerate(md5files):
+            if md5file.get("name") in prunemd5names and md5paths[indx] == "%s/%s" % (backupfolder, md5file.get("name")):
+                pruneids.append(md5ids[indx])
+                if verbose:
+                    sys.stdout.write("removing %s from Google Drive\n" % md5paths[indx])
+        trashed, errors = gdrive.trash_many(pruneids, verbose=DEBUG)
+        if options['dedupe']:
+            # chunks only the pruned snapshots used are collected once every upload is done
+            options['collect'] = True
+        for fileid, e in errors.items():
+            msg = "unable to delete fileid=%s: %s" % (fileid, getattr(e, 'reason', str(e)))
+            if verbose:
+                sys.stdout.write("%s\n" % msg)
+            else:
+                logger.error(msg)
+
+def backup_directories(gdrive, directories, options):
+    """
+    run archive_directory and upload_archive as a pipeline so that directory N+1 is
+    checksummed and tarred while directory N uploads. At most cpujobs + uploadjobs
+    archives are staged in /tmp at any one time.
+    """
+    cpujobs = options['cpujobs']
+    uploadjobs = options['uploadjobs']
+    staged = threading.Semaphore(cpujobs + uploadjobs)
+    uploads = []
+    def upload(job):
+        try:
+            upload_archive(gdrive, job, options)
+        finally:
+            staged.release()
+    def archive(directory):
+        try:
+            job = archive_directory(gdrive, directory, options)
+        except Exception:
+            staged.release()
+            raise
+        if job is None:
+            staged.release()
+            return
+        uploads.append(uploadpool.submit(upload, job))
+    with ThreadPoolExecutor(max_workers=uploadjobs) as uploadpool:
+        with ThreadPoolExecutor(max_workers=cpujobs) as archivepool:
+            archives = []
+            for directory in directories:
+                staged.acquire()
+                archives.append(archivepool.submit(archive, directory))
+            for future in archives:
+                future.result()
+        for future in uploads:
+            future.result()
+
+def report_stages(directories, options):
+    """
+    write how long each directory spent hashing, looking up old backups, tarring,
+    uploading and pruning, and which of those was its slowest stage
+    """
+    for directory in directories:
+        stages = options['stages'].get(os.path.expanduser(directory))
+        if stages is None:
+            continue
+        msg = "stage times of %s: %s, slowest %s" % (directory, stages, stages.slowest())
+        if options['verbose']:
+            sys.stdout.write("%s\n" % msg)
+        else:
+            logger.info(msg)
+
+def restore_chain(backups, backuproot):
+    """
+    backups: the backups of one directory, newest first
+    returns the newest full backup followed by the incrementals made after it, oldest
+    first, or an empty list if there is no full backup
+    raises CLIError if the chain of incrementals has a gap
+    """
+    chain = []
+    for file in backups:
+        chain.insert(0, file)
+        if not is_incremental(file.get("name")):
+            break
+    else:
+        return []
+    for indx in range(1, len(chain)):
+        properties = chain[indx].get('properties') or {}
+        stamp = backup_stamp(chain[indx - 1].get("name"), backuproot)
+        if properties.get('previous') is not None and properties.get('previous') != stamp:
+            raise CLIError("%s doesn't build on %s, the backup before it is missing" % (chain[indx].get("name"), chain[indx - 1].get("name")))
+    return chain
+
+def download_archive(gdrive, file, destination, options):
+    """
+    download a backup and unpack it into destination as it arrives, nothing is staged
+    returns the member names an incremental lists as deleted
+    """
+    readfd, writefd = os.pipe()
+    reader = os.fdopen(readfd, 'rb')
+    writer = os.fdopen(writefd, 'wb')
+    errors = []
+    def download():
+        try:
+            gdrive.download_to(file.get('id'), writer, verbose=options['DEBUG'])
+        except Exception as e:
+            errors.append(e)
+        finally:
+            try:
+                writer.close()
+            except OSError:
+                pass
+    thread = threading.Thread(target=download)
+    thread.daemon = True
+    thread.start()
+    try:
+        # backups from before the codec property are gzip
+        codec = (file.get('properties') or {}).get('codec', 'gzip')
+        deleted = extract_archive(reader, destination, codec=codec)
+        # tar pads the end of the archive, let the download finish and check its md5
+        while reader.read(1024*1024):
+            pass
+    finally:
+        reader.close()
+        thread.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return deleted
+
+def restore_snapshot(gdrive, file, destination, options):
+    """
+    download the chunks a snapshot lists and unpack the tar they make up into destination
+    returns the member names listed as deleted, always none for a snapshot
+    """
+    snapshot = read_snapshot(gdrive.download_bytes(file.get('id'), verbose=options['DEBUG']))
+    stream = ChunkReader(options['chunkstore'].iter_chunks(snapshot['chunks']))
+    return extract_archive(stream, destination, codec=None)
+
+def snapshot_chunks(gdrive, options):
+    """
+    returns the set of chunks used by the snapshots in the backup folder
+    """
+    referenced = set()
+    paths, ids, files = gdrive.list_files_in_drive(query="name contains 'snapshot'", verbose=options['DEBUG'])
+    for indx, file in enumerate(files):
+        if file.get("name").endswith('.snapshot') and paths[indx] == "%s/%s" % (options['backupfolder'], file.get("name")):
+            snapshot = read_snapshot(gdrive.download_bytes(file.get('id'), verbose=options['DEBUG']))
+            referenced.update(digest for digest, size in snapshot['chunks'])
+    return referenced
+
+def collect_chunks(gdrive, options):
+    """
+    trash the chunks no snapshot in the backup folder uses any more
+    """
+    store = options['chunkstore']
+    collected, duplicates = store.collect_garbage(snapshot_chunks(gdrive, options), grace=options['chunkgrace'])
+    msg = "collected %d chunks no snapshot uses and %d duplicate copies" % (collected, duplicates)
+    if options['verbose']:
+        sys.stdout.write("%s\n" % msg)
+    else:
+        logger.info(msg)
+
+def restore_directory(gdrive, directory, destination, options):
+    """
+    restore the newest backup of directory into destination/<directory name> by
+    unpacking its full backup and then each incremental after it in turn, applying
+    the deletions each incremental records
+    """
+    verbose = options['verbose']
+    DEBUG = options['DEBUG']
+    backupfolder = options['backupfolder']
+    directory = os.path.expanduser(directory)
+    path = Path(directory)
+    parentname = str(path.parent.absolute())
+    backuproot = backup_root(directory, parentname, options['excludestring'])
+    extensions = backup_extensions(options)
+    paths, ids, files = gdrive.list_files_in_drive(query=backup_query(backuproot, extensions), verbose=DEBUG)
+    backups = []
+    for indx, file in enumerate(files):
+        if file.get("name").startswith(backuproot + '.') and file.get("name").endswith(extensions) and paths[indx] == "%s/%s" % (backupfolder, file.get("name")):
+            backups.append(file)
+    backups.sort(key=lambda file: file.get("name"), reverse=True)
+    chain = restore_chain(backups, backuproot)
+    if len(chain) == 0:
+        raise CLIError("no full backup of %s in %s" % (directory, backupfolder))
+    if not os.path.isdir(destination):
+        os.makedirs(destination, exist_ok=True)
+    for file in chain:
+        if verbose:
+            sys.stdout.write("Restoring %s/%s into %s\n" % (backupfolder, file.get("name"), destination))
+        if options['dedupe']:
+            deleted = restore_snapshot(gdrive, file, destination, options)
+        else:
+            deleted = download_archive(gdrive, file, destination, options)
+        removed = remove_members(destination, deleted)
+        if verbose and removed > 0:
+            sys.stdout.write("removed %d files deleted before %s\n" % (removed, file.get("name")))
+    options['successful'].append("%s (from %s)" % (directory, ', '.join(file.get("name") for file in chain)))
+
 def main(argv=None): # IGNORE:C0111
     '''Command line options.'''
 
@@ -180,6 +881,22 @@ USAGE
         parser.add_argument("-e", "--excludefolders", dest="excludefolders", action="append", help="exclude this directory from the gzipped directory [default: %(default)s]", default=None)
         parser.add_argument("-w", "--writemd5", dest="writemd5", action="store_true", help="Upload the md5 results for uploaded files. [default: %(default)s]", default=False)
         parser.add_argument("-f", "--forceupload", dest="forceupload", action="store_true", help="Force uploading of files even if checksums indicate the identical file already exists on drive. [default: %(default)s]", default=False)
+        parser.add_argument("-s", "--streamupload", dest="streamupload", action="store_true", help="tar directories straight into the upload instead of staging the archive in /tmp [default: %(default)s]", default=False)
+        parser.add_argument("--hashjobs", dest="hashjobs", type=int, help="number of files to checksum at the same time [default: twice the number of cpus]", default=None)
+        parser.add_argument("--nohashcache", dest="nohashcache", action="store_true", help="re-read every file instead of trusting the checksums cached from earlier runs [default: %(default)s]", default=False)
+        parser.add_argument("--cpujobs", dest="cpujobs", type=int, help="number of directories to checksum and tar at the same time [default: %(default)s]", default=1)
+        parser.add_argument("--uploadjobs", dest="uploadjobs", type=int, help="number of archives to upload at the same time [default: %(default)s]", default=1)
+        parser.add_argument("-i", "--incremental", dest="incremental", action="store_true", help="upload only the files changed since the last backup, plus a list of the deleted ones [default: %(default)s]", default=False)
+        parser.add_argument("--fullevery", dest="fullevery", type=int, help="with --incremental make a full backup every this many backups [default: %(default)s]", default=7)
+        parser.add_argument("-r", "--restore", dest="restore", help="restore the newest backup of each directory (its full backup and the incrementals after it) into this folder instead of backing up", default=None)
+        parser.add_argument("--codec", dest="codec", choices=CODECS, help="compression of the archives, zstd needs the zstandard package [default: %(default)s]", default="gzip")
+        parser.add_argument("--compresslevel", dest="compresslevel", type=int, help="compression level [default: 6 for gzip, 3 for zstd]", default=None)
+        parser.add_argument("--compressjobs", dest="compressjobs", type=int, help="cores compressing each archive [default: the number of cpus]", default=None)
+        parser.add_argument("--compressall", dest="compressall", action="store_true", help="compress every file instead of storing files that are already compressed (media, archives) as they are [default: %(default)s]", default=False)
+        parser.add_argument("--dedupe", dest="dedupe", action="store_true", help="keep directories as content defined chunks stored once in <backupfolder>/chunks plus a snapshot listing them, only chunks Drive doesn't have yet are uploaded [default: %(default)s]", default=False)
+        parser.add_argument("--chunksize", dest="chunksize", type=int, help="with --dedupe the average chunk size in MiB [default: %(default)s]", default=4)
+        parser.add_argument("--resyncchunks", dest="resyncchunks", action="store_true", help="with --dedupe relist the chunk folder instead of trusting the local chunk index [default: %(default)s]", default=False)
+        parser.add_argument("--collectchunks", dest="collectchunks", action="store_true", help="with --dedupe trash the chunks no snapshot uses even if no snapshot was pruned [default: %(default)s]", default=False)
         parser.add_argument(dest="directories", help="space separated list of directories to zip & upload to drive", nargs='+')
 
         # Process arguments
@@ -192,6 +909,29 @@ USAGE
         writemd5 = args.writemd5
         forceupload = args.forceupload
         directories = args.directories
+        cpujobs = args.cpujobs
+        uploadjobs = args.uploadjobs
+        streamupload = args.streamupload
+        hashjobs = args.hashjobs
+        nohashcache = args.nohashcache
+        incremental = args.incremental
+        fullevery = args.fullevery
+        restore = args.restore
+        dedupe = args.dedupe
+        codec = args.codec
+        compresslevel = args.compresslevel
+        if compresslevel is None:
+            compresslevel = default_level(codec)
+        compressjobs = args.compressjobs
+        if compressjobs is None:
+            compressjobs = os.cpu_count() or 1
+        if restore is None and not dedupe:
+            try:
+                check_codec(codec)
+            except CompressionException as e:
+                raise CLIError(str(e))
+        if dedupe and incremental:
+            raise CLIError("--dedupe and --incremental can't be used together, snapshots only upload new chunks anyway")
         if len(settingsfile) > 0:
             try:
                 with open(settingsfile) as f:
@@ -206,136 +946,121 @@ USAGE
         scopes = get_secret(settings, "scopes")
         verbose = get_secret(settings, "verbose")
         setup_logging(settings)
+        try:
+            # order files for the checksum the way sort(1) would
+            locale.setlocale(locale.LC_COLLATE, '')
+        except locale.Error:
+            pass
         excludestring = '_excl_'
         if excludefolders is not None:
             for excludefolder in excludefolders:
                 excludestring = excludestring + re.sub('[\*\[\]\-/]', '_', excludefolder)[1:]
         else:
             excludestring = excludestring + "none"
+        hashcache = None
+        if not nohashcache:
+            # checksums of unchanged files are reused from earlier runs
+            hashcache = HashCache("%s/%s" % (privatedir, settings.get("hash_cachefile", ".drive_backup_hashcache.sqlite")))
         try:
-            gdrive = GoogleDrive(keyfile, tokenfile, scopes, verbose=DEBUG)
-            backupfolderpath, backupfolderid, backupfolderfile = gdrive.create_folder_path(backupfolder)
+            ratelimiter = None
+            if settings.get("requests_per_second") is not None or settings.get("bytes_per_second") is not None:
+                # stay under the Drive quotas, optionally together with other processes using the same file
+                ratelimitfile = settings.get("ratelimit_file")
+                if ratelimitfile is not None:
+                    ratelimitfile = "%s/%s" % (privatedir, ratelimitfile)
+                ratelimiter = RateLimiter(settings.get("requests_per_second"), settings.get("bytes_per_second"), statefile=ratelimitfile)
+            # every API call is timed, and logged one JSON line each if api_log_file is set
+            metrics = Metrics()
+            hooks = [metrics]
+            if settings.get("api_log_file") is not None:
+                hooks.append(CallLog(settings.get("api_log_file")))
+            # every thread shares one pool of keep-alive connections
+            gdrive = GoogleDrive(keyfile, tokenfile, scopes, verbose=DEBUG, ratelimiter=ratelimiter,
+                                 poolsize=settings.get("http_poolsize", max(10, cpujobs + uploadjobs)),
+                                 timeout=settings.get("http_timeout", 120),
+                                 chunkseconds=settings.get("chunk_seconds", 4.0),
+                                 hooks=hooks)
+            backupfolderid = None
+            if restore is None:
+                backupfolderpath, backupfolderid, backupfolderfile = gdrive.create_folder_path(backupfolder)
+            chunkstore = None
+            chunker = None
+            if dedupe:
+                if restore is None:
+                    chunkfolderpath, chunkfolderid, chunkfolder = gdrive.create_folder_path(backupfolder + '/chunks')
+                else:
+                    # a restore only reads, it mustn't leave empty backup folders behind
+                    chunkfolderpaths, chunkfolderids, chunkfolders = gdrive.list_files_in_drive(pathquery=backupfolder + '/chunks', verbose=DEBUG)
+                    if len(chunkfolderids) == 0:
+                        raise CLIError("no chunk folder %s/chunks to restore snapshots from" % backupfolder)
+                    if len(chunkfolderids) > 1:
+                        raise CLIError("there are %d folders at %s/chunks, we don't know which one to restore from" % (len(chunkfolderids), backupfolder))
+                    chunkfolderid = chunkfolderids[0]
+                chunkindex = ChunkIndex("%s/%s" % (privatedir, settings.get("chunk_index_file", ".drive_backup_chunks.sqlite")))
+                synced = chunkindex.synced(chunkfolderid)
+                if args.resyncchunks or synced is None or time.time() - synced > settings.get("chunk_index_maxage", 7*24*60*60):
+                    # one listing of the chunk folder instead of asking about every chunk
+                    chunkindex.sync(gdrive, chunkfolderid, verbose=DEBUG)
+                chunkstore = ChunkStore(gdrive, chunkfolderid, chunkindex, jobs=settings.get("chunk_jobs", 4), verbose=DEBUG)
+                chunksize = args.chunksize*1024*1024
+                chunker = ContentChunker(minsize=chunksize // 4, avgsize=chunksize, maxsize=chunksize * 4)
             successful = []
             exists = []
-            for directory in directories:
-                directory = os.path.expanduser(directory)
-                path = Path(directory)
-                parentname = str(path.parent.absolute())
-                dirname = path.parts[-1]
-                if os.path.exists(directory):
-                    # follow symlinks with -L
-                    md5args = ['find', '-L', directory]
-                    if excludefolders is not None:
-                        for excludefolder in excludefolders:
-                            md5args.extend(["-not", "-path", "%s/*" % excludefolder])
-                    md5args.extend(['-type', 'f'])
-                    md5command = ' '.join(md5args)
-                    md5command = "%s | sort | xargs -n 1 md5sum | md5sum" % md5command
-                    if verbose:
-                        sys.stdout.write("Checking md5sum of %s\n" % (directory))
-                        sys.stdout.write("using command: %s\n" % md5command)
-                    try:
-                        p1 = run(md5args, stdout=PIPE, check=True)
-                        p2 = run(['sort'], input=p1.stdout, stdout=PIPE, check=True)
-                        # don't check return code in case some file is inaccessible
-                        p3 = run(['xargs', '-n', '1', 'md5sum'], input=p2.stdout, stdout=PIPE, check=False)
-                        p4 = run(['md5sum'], input = p3.stdout, stdout=PIPE, check=True)
-                        checksum = p4.stdout.strip().decode("utf-8")
-                    except CalledProcessError as e:
-                        if gdrive.verbose:
-                            sys.stdout.write("unable to run md5sum on directory=%s Error='%s'\n" % (directory, e.stderr.decode()))
-                        else:
-                            logger.error("unable to run md5sum on  directory=%s Error='%s'" % (directory, e.stderr.decode()))
-                        continue
-                    
-                    backuproot =  directory.replace(os.path.sep,'_')[1:] + excludestring.replace(re.sub('[\-/]','_',parentname), '').replace('__','_')
-                    # check to see if this file already exists on Drive, if so check its checksum
-                    utcnow = datetime.utcnow().isoformat()
-                    oldpaths, oldids, oldfiles = gdrive.list_files_in_drive(query="modifiedTime < '%sZ' and name contains '%s' and name contains 'tgz'" % (utcnow, backuproot), verbose=DEBUG)
-                    fileexists = False
-                    for file in oldfiles:
-                        # double check that the file is really a match
-                        if backuproot in file.get("name") and '.tgz' in file.get("name"):
-                            properties = file.get('properties', None)
-                            if properties is not None:
-                                oldchecksum = properties.get('checksum', None)
-                                if oldchecksum is not None and verbose:
-                                    sys.stdout.write("new checksum=%s, drive checksum=%s\n" % (checksum, oldchecksum))
-                                if oldchecksum == checksum and not forceupload:
-                                    fileexists = True
-                                    exists.append("filename=%s/%s already exists and is identical" % (backupfolder, file.get("name")))
-                                    break
-                    if not fileexists:
-                        utcnow = datetime.now().isoformat().replace(':', '.')
-                        backupfile = "%s%s%s.%s.tgz" %('/tmp',os.path.sep, backuproot, utcnow)
-                        if writemd5:
-                            md5file = "%s%s%s.%s.md5" %('/tmp',os.path.sep, backuproot, utcnow) 
-                            with open(md5file, 'w') as f:
-                                f.write(p3.stdout.decode("utf-8"))
-                        # include files accessed through symbolic links        
-                        tarargs = ['tar', '--dereference']
-                        if excludefolders is not None:
-                            for excludefolder in excludefolders:
-                                tarargs.extend(['--exclude', excludefolder.replace(parentname, '')[1:]])
-                        # use ustar format to ensure we don't change checksum for changed file attributes that don't change file contents 
-                        tarargs.extend(["--format", "ustar", "-czf", backupfile,"--directory", parentname, dirname])
-                        tarcommand = ' '.join(tarargs)
-                        if verbose:
-                            sys.stdout.write("Taring %s to %s\n" % (directory, backupfile))
-                            sys.stdout.write("using command: %s\n" % tarcommand)
-                        try:
-                            # don't check return code in case some file is inaccessible
-                            run(tarargs, stderr=PIPE, check=False)
-                        except CalledProcessError as e:
-                            # try again after a 5 second delay
-                            time.sleep(5)
-                            try:
-                                run(tarargs, stderr=PIPE, check=True)
-                            except CalledProcessError as e:
-                                if gdrive.verbose:
-                                    sys.stdout.write("unable to tar directory=%s Error='%s'\n" % (directory, e.stderr.decode()))
-                                else:
-                                    logger.error("unable to tar directory=%s Error='%s'" % (directory, e.stderr.decode()))
-                                continue
-                        uploadedpath, uploadedid, uploadedfile = gdrive.upload_file_to_path(filename=backupfile, parentpath=backupfolder, checksum=checksum, verbose=DEBUG) 
-                        if uploadedid is not None:
-                            successful.append(directory + (" (filename=%s, size=%s)" % (uploadedpath, uploadedfile.get("size"))))
-                            if writemd5:
-                                md5path, md5id, md5file = gdrive.upload_file_to_path(filename=md5file, parentpath=backupfolder, verbose=DEBUG)
-                        for rmfile in glob.glob("%s*" % os.path.join('/tmp', backuproot)):
-                            fileToRemove = os.path.join('/tmp', rmfile)
-                            try:
-                                run(["rm", fileToRemove], stderr=PIPE, check=True)
-                                if verbose:
-                                    sys.stdout.write("removing %s from filesystem\n" % fileToRemove)
-                            except CalledProcessError as e:
-                                if verbose:
-                                    sys.stdout.write("unable to remove %s, Error='%s'\n" % (fileToRemove, e.stderr.decode()))
-                                else:
-                                    logger.error("unable to remove %s, Error='%s'" % (fileToRemove, e.stderr.decode()))
-                                continue
-                        indx = 1
-                        for file in  oldfiles:
-                            if backuproot in file.get("name"):
-                                # double check the name comparison here
-                                if indx >= keepfiles:
-                                    gdrive.delete_file_id(fileid=file.get('id'), verbose=DEBUG)
-                                    if verbose:
-                                        pathlist, thispath = gdrive.get_path(file=file, verbose=DEBUG)
-                                        sys.stdout.write("removing %s from Google Drive\n" % thispath)
-                                    try:
-                                        gdrive.delete_file_path(path='%s/%s' %(backupfolder, file.get("name").replace("tgz","md5")))
-                                        if verbose:
-                                            sys.stdout.write("removing %s/%s from Google Drive\n" % (backupfolder, file.get("name").replace("tgz","md5")))
-                                    except GoogleDriveException as e:
-                                        if 'unable to find filepath' in str(e):
-                                            pass
-                                indx = indx + 1
+            options = {'verbose': verbose,
+                       'DEBUG': DEBUG,
+                       'backupfolder': backupfolder,
+                       'keepfiles': keepfiles,
+                       'excludefolders': excludefolders,
+                       'excludestring': excludestring,
+                       'writemd5': writemd5,
+                       'forceupload': forceupload,
+                       'cpujobs': cpujobs,
+                       'uploadjobs': uploadjobs,
+                       'streamupload': streamupload,
+                       'hashjobs': hashjobs,
+                       'hashcache': hashcache,
+                       'successful': successful,
+                       'exists': exists,
+                       'incremental': incremental,
+                       'fullevery': fullevery,
+                       'manifestdir': "%s/%s" % (privatedir, settings.get("manifest_dir", ".drive_backup_manifests")),
+                       'codec': codec,
+                       'compresslevel': compresslevel,
+                       'compressjobs': compressjobs,
+                       'compressall': args.compressall,
+                       'compressthreshold': settings.get("compress_threshold", 0.95),
+                       'dedupe': dedupe,
+                       'chunkstore': chunkstore,
+                       'chunker': chunker,
+                       'chunkgrace': settings.get("chunk_grace", 24*60*60),
+                       'collect': args.collectchunks,
+                       'backupfolderid': backupfolderid,
+                       'metrics': metrics,
+                       'stages': {}}
+            if restore is not None:
+                try:
+                    for directory in directories:
+                        restore_directory(gdrive, directory, os.path.expanduser(restore), options)
+                finally:
+                    if chunkstore is not None:
+                        chunkstore.close()
+                msg = "Restored the following directories from Google Drive: %s" % str(successful)
+                if verbose:
+                    sys.stdout.write("%s\n" % msg)
                 else:
-                    if verbose:
-                        sys.stdout.write("directory %s doesn't exist. Ignoring\n" % directory)
-                    else:
-                        logger.info("directory %s doesn't exist. Ignoring" % directory)
+                    logger.warning(msg)
+                return 0
+            try:
+                backup_directories(gdrive, directories, options)
+                if chunkstore is not None and options['collect']:
+                    collect_chunks(gdrive, options)
+            finally:
+                if chunkstore is not None:
+                    chunkstore.close()
+                report_stages(directories, options)
+                if settings.get("metrics_file") is not None:
+                    # .prom files are replaced with Prometheus text, anything else gets a JSON line
+                    metrics.write(settings.get("metrics_file"))
             if verbose:
                 if len(successful) > 0:
                     sys.stdout.write("Uploaded the following directories to Google Drive: %s\n" % str(successful))
@@ -346,6 +1071,23 @@ USAGE
                     logger.warning("Uploaded the following directories to Google Drive: %s" % str(successful))
                 if len(exists) > 0:
                     logger.info("The following files already exist on Google Drive: %s" % str(exists))
+            if verbose:
+                sys.stdout.write("%s\n" % gdrive.pathcache)
+                sys.stdout.write("%s\n" % gdrive.retry_summary())
+                sys.stdout.write("%s\n" % metrics)
+                if hashcache is not None:
+                    sys.stdout.write("%s\n" % hashcache)
+                if chunkstore is not None:
+                    sys.stdout.write("%s\n%s\n" % (chunkstore, chunkstore.index))
+            else:
+                logger.info(str(gdrive.pathcache))
+                logger.info(gdrive.retry_summary())
+                logger.info(str(metrics))
+                if hashcache is not None:
+                    logger.info(str(hashcache))
+                if chunkstore is not None:
+                    logger.info(str(chunkstore))
+                    logger.info(str(chunkstore.index))
             return 0
         except GoogleDriveException as e:
             msg = "Problem accessing Google Drive API: %s" % str(e)
@@ -20,7 +20,8 @@ from argparse import ArgumentParser
 from argparse import RawDescriptionHelpFormatter
 from google_drive import GoogleDrive
 from google_drive import GoogleDriveException
-from logging.handlers import SMTPHandler
+from rate_limit import RateLimiter
+from instrumentation import Metrics, CallLog
 
 __version__ = 0.1
 __date__ = '2024-01-01'
@@ -102,6 +103,8 @@ def setup_logging(settings):
         isSecure = None
         if emailUseTLS == "True":
             isSecure = ()
+        # only pay for importing the smtp machinery when email logging is on
+        from logging.handlers import SMTPHandler
         smtpHandler = SMTPHandler((emailHost, emailPort),
                                   emailFromUser,
                                   adminemail,
@@ -152,11 +155,16 @@ example call: python3 gdrive_helper.py settings.json -q="name contains 'Getting'
         parser.add_argument("-d", "--debug", dest="DEBUG", action="store_true", help="print out debuggung info [default: %(default)s]", default=False)
         parser.add_argument("--filterfilepath", dest="filterfilepath", help="use regex to filter files in a folder path from Google Drive [default: %(default)s]", default = None)
         parser.add_argument("--downloadfiles", dest="downloadfiles", action='store_true', help="download specified in the query or querypath from Google Drive [default: %(default)s]", default = False)
+        parser.add_argument("--stdout", dest="tostdout", action='store_true', help="write the contents of the single file matching the query or filterfilepath to stdout, e.g. to pipe a backup into tar xz. Messages go to stderr [default: %(default)s]", default = False)
+        parser.add_argument("--decompress", dest="decompress", action='store_true', help="decompress downloaded files that record a codec (e.g. backups made with --codec), archive.tgz is saved as archive.tar [default: %(default)s]", default = False)
         parser.add_argument("--deletefilepath", dest="deletefilepath", help="delete queried file (includes path to file) from Google Drive [default: %(default)s]", default = None)
         parser.add_argument("--deletefileid", dest="deletefileid", help="delete queried file id from Google Drive [default: %(default)s]", default = None)
         parser.add_argument("--createfolderpath", dest="createfolderpath", help="create a folder path in Google Drive.", default = None)
         parser.add_argument("--uploadfile", dest="uploadfile", help="upload file in Google Drive under parentpath if supplied else under root [default: %(default)s]", default = None)
         parser.add_argument("--parentpath", dest="parentpath", help="parent directory path to use when creating file or directory [default: %(default)s]", default = "/")
+        parser.add_argument("-j", "--jobs", dest="jobs", type=int, help="number of files to download at the same time [default: %(default)s]", default = 1)
+        parser.add_argument("--ranges", dest="ranges", type=int, help="number of byte ranges of each large file to download at the same time [default: %(default)s]", default = 1)
+        parser.add_argument("--maxinflight", dest="maxinflight", type=int, help="MiB of parallel downloads allowed in progress at once [default: %(default)s]", default = 512)
         parser.add_argument("--allowduplicate", dest="allowduplicate", action='store_true', help="upload duplicate file if it already exists [default: %(default)s]", default = False)
 
         # Process arguments
@@ -167,10 +175,20 @@ example call: python3 gdrive_helper.py settings.json -q="name contains 'Getting'
         filterfilepath = args.filterfilepath
         deletefileid = args.deletefileid
         downloadfiles = args.downloadfiles
+        tostdout = args.tostdout
+        out = None
+        if tostdout:
+            # stdout carries the file, every message goes to stderr instead
+            out = sys.stdout.buffer
+            sys.stdout = sys.stderr
         createfolderpath = args.createfolderpath
         uploadfile = args.uploadfile
         parentpath = args.parentpath
         allowduplicate = args.allowduplicate
+        jobs = args.jobs
+        ranges = args.ranges
+        decompress = args.decompress
+        maxinflight = args.maxinflight
         settingsfile = args.settingsfile
         settings = {}
         
@@ -195,7 +213,7 @@ example call: python3 gdrive_helper.py settings.json -q="name contains 'Getting'
             else:
                 logger.error(msg)
             return 2
-        if downloadfiles and query is None and filterfilepath is None:
+        if (downloadfiles or tostdout) and query is None and filterfilepath is None:
             msg = "You need to supply a query or filterfilepath in order to download files"
             if verbose:
                 sys.stderr.write("%s\n" % msg)
@@ -217,39 +235,103 @@ example call: python3 gdrive_helper.py settings.json -q="name contains 'Getting'
                 logger.error(msg)
             return 2
         try:
-            gdrive = GoogleDrive(keyfile, tokenfile, scopes, verbose=DEBUG)
+            ratelimiter = None
+            if settings.get("requests_per_second") is not None or settings.get("bytes_per_second") is not None:
+                # stay under the Drive quotas, optionally together with other processes using the same file
+                ratelimitfile = settings.get("ratelimit_file")
+                if ratelimitfile is not None:
+                    ratelimitfile = "%s/%s" % (privatedir, ratelimitfile)
+                ratelimiter = RateLimiter(settings.get("requests_per_second"), settings.get("bytes_per_second"), statefile=ratelimitfile)
+            hooks = []
+            if settings.get("api_log_file") is not None:
+                # one JSON line per API call
+                hooks.append(CallLog(settings.get("api_log_file")))
+            if settings.get("metrics_file") is not None:
+                # .prom files are replaced with Prometheus text, anything else gets a JSON line
+                import atexit
+                metrics = Metrics()
+                hooks.append(metrics)
+                atexit.register(metrics.write, settings.get("metrics_file"))
+            # every thread shares one pool of keep-alive connections
+            gdrive = GoogleDrive(keyfile, tokenfile, scopes, verbose=DEBUG, ratelimiter=ratelimiter,
+                                 poolsize=settings.get("http_poolsize", max(10, jobs * ranges)),
+                                 timeout=settings.get("http_timeout", 120),
+                                 chunkseconds=settings.get("chunk_seconds", 4.0),
+                                 hooks=hooks)
             paths = []
             ids = []
             files = []
             if deletefilepath is None and deletefileid is None and createfolderpath is None and uploadfile is None:
-                # get the files from a query if you need them
+                # stream the files from a query page by page if you need them
+                matches = iter([])
                 if query is not None:
                     # allow general queries to retrieve trashed files
-                    paths, ids, files = gdrive.list_files_in_drive(query=query, includetrashed=True, verbose=DEBUG)
+                    matches = gdrive.iter_files(query=query, includetrashed=True, verbose=DEBUG)
                 if filterfilepath is not None:
-                    paths, ids, files = gdrive.filter_filepath_in_drive(pathquery=filterfilepath, includetrashed=False, verbose=DEBUG)
-                if not downloadfiles:
-                    # list files if verbose
+                    matches = gdrive.iter_filter_filepath(pathquery=filterfilepath, includetrashed=False, verbose=DEBUG)
+                if tostdout:
+                    matches = list(matches)
+                    if len(matches) != 1:
+                        msg = "--stdout needs a query or filterfilepath that matches exactly one file, it matched %d" % len(matches)
+                        if verbose:
+                            sys.stderr.write("%s\n" % msg)
+                        else:
+                            logger.error(msg)
+                        return 2
+                    path, id, file = matches[0]
+                    try:
+                        nbytes, file = gdrive.download_to(id, out, verbose=DEBUG, decompress=decompress)
+                        out.flush()
+                    except BrokenPipeError:
+                        # whatever reads the pipe has stopped, that's not our error to report
+                        return 1
+                    except GoogleDriveException as e:
+                        msg = str(e)
+                        if verbose:
+                            sys.stderr.write("%s\n" % msg)
+                        else:
+                            logger.error(msg)
+                        return 2
+                    msg = "wrote %s (%d bytes) to stdout" % (path, nbytes)
                     if verbose:
-                        for indx in range(len(files)):
+                        sys.stderr.write("%s\n" % msg)
+                    else:
+                        logger.info(msg)
+                    matches = iter([])
+                if downloadfiles and jobs > 1:
+                    # hand the streamed listing to the download pool
+                    results, errors = gdrive.download_files((file for path, id, file in matches), jobs=jobs,
+                                                            maxinflight=maxinflight, verbose=DEBUG, ranges=ranges,
+                                                            decompress=decompress)
+                    for path, id, file in results:
+                        msg = "downloaded file %s" % file
+                        if verbose:
+                            sys.stdout.write("%s\n" % msg)
+                        else:
+                            logger.info(msg)
+                    for id, e in errors:
+                        msg = str(e)
+                        if verbose:
+                            sys.stderr.write("%s\n" % msg)
+                        else:
+                            logger.error(msg)
+                    matches = iter([])
+                for path, id, file in matches:
+                    if not downloadfiles:
+                        # list files if verbose
+                        if verbose:
                             dirslash = ''
-                            if files[indx].get('mimeType') == 'application/vnd.google-apps.folder':
+                            if file.get('mimeType') == 'application/vnd.google-apps.folder':
                                 dirslash = '/'
-                            sys.stdout.write("%s%s (id=%s, size='%s', modified='%s')\n" % (paths[indx],
+                            sys.stdout.write("%s%s (id=%s, size='%s', modified='%s')\n" % (path,
                                                                                     dirslash,
-                                                                                  files[indx].get('id'),
-                                                                                  files[indx].get('size'),
-                                                                                  files[indx].get('modifiedTime')))
-            if downloadfiles and len(ids) > 0:
-                downloadpaths = []
-                downloadids = []
-                downloadfiles = []
-                for indx in range(len(ids)):
+                                                                                  file.get('id'),
+                                                                                  file.get('size'),
+                                                                                  file.get('modifiedTime')))
+                        continue
                     try:
-                        path, id, file = gdrive.download_file(ids[indx], paths[indx].split('/')[-1], verbose=DEBUG)
-                        downloadpaths.append(path)
-                        downloadids.append(id)
-                        downloadfiles.append(file)
+                        path, id, file = gdrive.download_file(id, path.split('/')[-1], verbose=DEBUG, ranges=ranges,
+                                                                      decompress=decompress)
                         msg = "downloaded file %s" % file
                         if verbose:
                             sys.stdout.write("%s\n" % msg)
@@ -262,9 +344,6 @@ example call: python3 gdrive_helper.py settings.json -q="name contains 'Getting'
                         else:
                             logger.error(msg)
                         pass
-                paths = downloadpaths
-                ids = downloadids
-                files = downloadfiles
             if deletefilepath is not None:
                 try:
                     path, id, file = gdrive.delete_file_path(path=deletefilepath, trash=True, verbose=DEBUG)